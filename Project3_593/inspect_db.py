@@ -1,11 +1,16 @@
-import sqlite3
+import sqlite3, glob
 
-for db in ("pencilpros.db", "paypal.db", "pencilpros_prov.db", "paypal_prov.db"):
+def files(db):
+    """db itself, or its shard files (name.s0.db, ...) when DB_SHARDS > 1"""
+    return sorted(glob.glob(db[:-3] + ".s[0-9]*.db")) or [db]
+
+for db in [f for base in ("pencilpros.db", "paypal.db", "pencilpros_prov.db", "paypal_prov.db")
+           for f in files(base)]:
     print("\n==", db, "==")
     conn = sqlite3.connect(db)
     conn.row_factory = sqlite3.Row
 
-    if db.endswith("_prov.db"):
+    if "_prov." in db:
         rows = conn.execute(
             "SELECT op,src_app,dst_app,user_id,tag_id,t_unix,meta "
             "FROM provenance ORDER BY t_unix"
@@ -13,7 +18,7 @@ for db in ("pencilpros.db", "paypal.db", "pencilpros_prov.db", "paypal_prov.db")
         for r in rows:
             print(" ", dict(r))
 
-    elif db == "pencilpros.db":
+    elif db.startswith("pencilpros"):
         print("users:")
         for r in conn.execute("SELECT * FROM users"):
             print(" ", dict(r))
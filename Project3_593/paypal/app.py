@@ -1,14 +1,45 @@
 from fastapi import FastAPI, Header
-from pydantic import BaseModel
-import json
+from pydantic import BaseModel, ValidationError
+from contextlib import asynccontextmanager
+import json, os
 
 from shadowrt.runtime import ShadowRuntime
-from .db import init_db, insert_payment, delete_payments_by_user
+from shadowrt.backpressure import AdmissionPolicy
+from shadowrt.capture import CaptureMiddleware, CaptureWriter
+from shadowrt.labels import Labeled
+from shadowrt.trace import add_exporter, jsonl_exporter
+from shadowrt.transport import LocalTransport, TransportError
+from .db import init_db, insert_payment, delete_payments_by_user_chunked, SHARDS
 
-app = FastAPI(title="PayPal-like Service")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema checks and provenance stores open at startup, not import
+    init_db()
+    rt.open()
+    yield
 
-init_db()
-rt = ShadowRuntime(appname="PayPal", prov_db="paypal_prov.db")
+app = FastAPI(title="PayPal-like Service", lifespan=lifespan)
+
+rt = ShadowRuntime(appname="PayPal", prov_db="paypal_prov.db",
+                   snapshot_s=float(os.environ.get("PROV_SNAPSHOT_S", "0")) or None,
+                   shards=SHARDS,
+                   archive_after_s=float(os.environ.get("PROV_ARCHIVE_AFTER_S", "0")) or None,
+                   max_pending=int(os.environ.get("PROV_MAX_PENDING", "0")) or None,
+                   admission=AdmissionPolicy(max_lag_s=float(os.environ.get("PROV_MAX_LAG_S", "1.0"))),
+                   profile_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+                   bloom_exclusive=os.environ.get("PROV_BLOOM_EXCLUSIVE", "0") == "1",
+                   admin_token=os.environ.get("SHADOW_ADMIN_TOKEN"))
+rt.mount(app)
+
+if os.environ.get("TRACE_EXPORT"):
+    add_exporter(jsonl_exporter(os.environ["TRACE_EXPORT"]))
+
+if os.environ.get("CAPTURE_FILE"):
+    app.add_middleware(CaptureMiddleware, writer=CaptureWriter(os.environ["CAPTURE_FILE"]),
+                       app_name="PayPal")
+
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "500"))
+DELETE_PAUSE_S = float(os.environ.get("DELETE_PAUSE_S", "0.01"))
 
 class Charge(BaseModel):
     user_id: str
@@ -16,6 +47,15 @@ class Charge(BaseModel):
     item: str
     billing_address: str
     ts: float | None = None  # forwarded from PencilPros
+    items: list[dict] | None = None  # line items of an itemized checkout
+
+class LabeledCharge(BaseModel):
+    label: str  # X-Shadow-Label header value of this item
+    value: Charge
+
+# Co-located callers (PencilPros with PAYPAL_TRANSPORT=local) reach the
+# same handlers through this, with no HTTP or JSON in between.
+local = LocalTransport()
 
 @app.post("/charge")
 def charge(charge: Charge, x_shadow_label: str = Header(...)):
@@ -25,14 +65,60 @@ def charge(charge: Charge, x_shadow_label: str = Header(...)):
       - insert into PayPal DB
       - log the DB insertion in PayPal provenance
     """
-    labeled = rt.receive(x_shadow_label, charge.model_dump())
+    return record_charge(rt.receive(x_shadow_label, charge.model_dump()))
+
+@local.route("POST", "/charge")
+def charge_local(labeled: Labeled[dict]):
+    """
+    In-process /charge: the label comes with the object, nothing to parse.
+    A body that fails validation is a 422, as it is over HTTP.
+    """
+    try:
+        charge = Charge.model_validate(labeled.value)
+    except ValidationError as e:
+        raise TransportError(422, str(e))
+    return record_charge(rt.receive(labeled.label, charge.model_dump()))
 
-    payment_id = insert_payment(
+@app.post("/charge_batch")
+def charge_batch(batch: list[dict]):
+    """
+    Several labeled charges in one request (PencilPros' queued checkouts),
+    each {"label", "value"}. Not atomic: one result per item, in order,
+    and an item that fails validation gets {"ok": false, "status": 422,
+    "error"} without affecting the rest.
+    """
+    def one(item: dict) -> dict:
+        c = LabeledCharge.model_validate(item)
+        return record_charge(rt.receive(c.label, c.value.model_dump()))
+    return [_each(one, item) for item in batch]
+
+@local.route("POST", "/charge_batch")
+def charge_batch_local(batch: list[Labeled[dict]]):
+    return [_each(charge_local, labeled) for labeled in batch]
+
+def _each(fn, item) -> dict:
+    try:
+        return fn(item)
+    except ValidationError as e:
+        return {"ok": False, "status": 422, "error": str(e)}
+    except TransportError as e:
+        return {"ok": False, "status": e.status, "error": e.detail}
+
+def record_charge(labeled: Labeled[dict]) -> dict:
+    """
+    Insert the payment and log it. Keyed on the label's tag, so a charge
+    PencilPros retries (e.g. a whole batch after a timeout) is recorded
+    once and answered with the original payment_id.
+    """
+    payment_id, inserted = insert_payment(
         labeled.value["user_id"],
         labeled.value["billing_address"],
         labeled.value["item"],
         labeled.value["amount_cents"],
+        charge_tag=labeled.label.tag_id,
     )
+    if not inserted:
+        return {"ok": True, "payment_id": payment_id, "duplicate": True}
 
     rt.log.log(
         op="insert_payment",
@@ -40,17 +126,22 @@ def charge(charge: Charge, x_shadow_label: str = Header(...)):
         tag_id=f"payment:{payment_id}",
         payload=json.dumps(labeled.value).encode(),
         dst_app=None,
-        meta={},
+        meta={"line_items": len(labeled.value["items"])} if labeled.value["items"] else {},
     )
 
     return {"ok": True, "payment_id": payment_id}
 
 @app.delete("/delete_by_user/{user_id}")
+@local.route("DELETE", "/delete_by_user/{user_id}")
+@rt.coalesced("delete_by_user")
 def delete_by_user(user_id: str):
     """
     Delete all PayPal records for this user, and log it in provenance.
+    Concurrent calls for the same user share one run.
     """
-    deleted = delete_payments_by_user(user_id)
+    deleted = delete_payments_by_user_chunked(
+        user_id, batch_size=DELETE_BATCH_SIZE, pause_s=DELETE_PAUSE_S,
+    )
 
     receipt = {
         "deleted_user_id": user_id,
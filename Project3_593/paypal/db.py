@@ -1,7 +1,20 @@
-import sqlite3, os, time
+import sqlite3, os, time, threading
+
+from shadowrt.deleter import ChunkedDeleter
+from shadowrt.migrate import ensure_schema
+from shadowrt.shards import HashRing, shard_path, scatter, next_id, pin_shards
+from shadowrt.profiler import ProfiledConnection
 
 DB_PATH = "paypal.db"
 
+# DB_SHARDS > 1 splits the database into that many files (paypal.s0.db, ...),
+# each owning the users that hash to it, so writers for different users
+# don't queue on one SQLite lock. Every per-user operation stays on one
+# shard; cross-user reads scatter over all of them. Payment ids are unique
+# across shards (shards.next_id), so payment:{id} tags are too.
+SHARDS = int(os.environ.get("DB_SHARDS", "1"))
+RING = HashRing(SHARDS)
+
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS payments (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -13,33 +26,98 @@ CREATE TABLE IF NOT EXISTS payments (
 );
 """
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# Ordered (version, sql) migrations applied on top of SCHEMA by init_db().
+# Append new entries; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id);"),
+    # the label tag of the charge, so a retried charge is recorded once
+    (2, """
+ALTER TABLE payments ADD COLUMN charge_tag TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge ON payments(charge_tag);
+"""),
+]
+
+def _connect(shard: int):
+    # each `with conn:` block shows up as a "db" section in sampled profiles
+    conn = sqlite3.connect(shard_path(DB_PATH, shard, SHARDS), factory=ProfiledConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def shard_conn(shard: int):
+    init_db()
+    return _connect(shard)
+
+def get_conn(user_id: str):
+    """Connection to the shard that owns user_id."""
+    return shard_conn(RING.shard_for(user_id))
+
+_ready = False
+_ready_lock = threading.Lock()
+
 def init_db():
-    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
-    with get_conn() as conn:
-        conn.executescript(SCHEMA)
-        conn.commit()
+    """
+    Create/migrate every shard. Runs once per process (the app's lifespan,
+    or the first connection if that comes earlier) and skips the DDL for
+    files already at the latest version.
+    """
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        pin_shards(DB_PATH, SHARDS, ("payments",))     # refuses a changed DB_SHARDS
+        for shard in range(SHARDS):
+            with _connect(shard) as conn:
+                ensure_schema(conn, SCHEMA, MIGRATIONS)
+        _ready = True
 
 def insert_payment(user_id: str, billing_address: str,
-                   item: str, amount_cents: int) -> int:
-    with get_conn() as conn:
+                   item: str, amount_cents: int,
+                   charge_tag: str | None = None) -> tuple[int, bool]:
+    """
+    (payment_id, inserted). A charge_tag already on file is not inserted
+    again: its existing payment comes back with inserted=False.
+    """
+    shard = RING.shard_for(user_id)
+    with shard_conn(shard) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        payment_id = next_id(conn, "payments", shard, SHARDS)
         cur = conn.execute(
-            "INSERT INTO payments(user_id,billing_address,item,amount_cents,created) "
-            "VALUES(?,?,?,?,?)",
-            (user_id, billing_address, item, amount_cents, time.time()),
+            "INSERT OR IGNORE INTO payments(id,user_id,billing_address,item,amount_cents,created,charge_tag) "
+            "VALUES(?,?,?,?,?,?,?)",
+            (payment_id, user_id, billing_address, item, amount_cents, time.time(), charge_tag),
         )
         conn.commit()
-        return cur.lastrowid
+        if cur.rowcount:
+            return payment_id, True
+        row = conn.execute("SELECT id FROM payments WHERE charge_tag=?", (charge_tag,)).fetchone()
+        return row["id"], False
 
 def delete_payments_by_user(user_id: str) -> int:
-    with get_conn() as conn:
+    with get_conn(user_id) as conn:
         cur = conn.execute(
             "DELETE FROM payments WHERE user_id=?",
             (user_id,),
         )
         conn.commit()
         return cur.rowcount
+
+def delete_payments_by_user_chunked(user_id: str, batch_size: int = 500,
+                                    pause_s: float = 0.01, progress=None) -> int:
+    """Like delete_payments_by_user, but in bounded batches by id range."""
+    deleter = ChunkedDeleter(lambda: get_conn(user_id), batch_size=batch_size,
+                             pause_s=pause_s, progress=progress)
+    return deleter.delete("payments", user_id)
+
+def export_payments() -> list[dict]:
+    """
+    Every payment on every shard, oldest first, each with its shard number.
+    """
+    def one(shard: int) -> list[dict]:
+        with shard_conn(shard) as conn:
+            return [{**dict(r), "shard": shard} for r in conn.execute(
+                "SELECT id,user_id,billing_address,item,amount_cents,created FROM payments")]
+    return sorted((r for rows in scatter(SHARDS, one) for r in rows),
+                  key=lambda r: r["created"])
@@ -1,13 +1,34 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-import time, os, requests, json
+from contextlib import asynccontextmanager
+import time, os, json
 
 from shadowrt.runtime import ShadowRuntime
-from shadowrt.labels import current_user, Labeled
-from .db import init_db, upsert_user, insert_purchase, delete_user_and_purchases
+from shadowrt.backpressure import AdmissionPolicy
+from shadowrt.capture import CaptureMiddleware, CaptureWriter
+from shadowrt.labels import current_user, Label, Labeled, child_label
+from shadowrt.jobqueue import JobQueue
+from shadowrt.trace import current_header, add_exporter, jsonl_exporter
+from shadowrt.transport import TransportError
+from shadowrt.destinations import Registry
+from .db import (init_db, upsert_user, insert_purchase, insert_purchase_with_items,
+                 delete_user_and_purchases_chunked, list_purchases, get_purchase,
+                 SHARDS)
 
-app = FastAPI(title="PencilPros Shop")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing touches disk at import: schema checks (DDL only for files not
+    # yet at the latest version), the provenance stores and the charge
+    # workers start here. Anything used before startup opens itself lazily.
+    init_db()
+    rt.open()
+    charge_queue.batch_size = rt.destinations["PayPal"].batch_size
+    charge_queue.start()
+    yield
+    charge_queue.stop()
+
+app = FastAPI(title="PencilPros Shop", lifespan=lifespan)
 
 # allow the frontend on port 5500 to call the API
 app.add_middleware(
@@ -18,13 +39,57 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Runtime (opened in lifespan)
+# PROV_SNAPSHOT_S > 0 sends provenance reads to a snapshot refreshed that often;
+# provenance is sharded by user_id the same way as the app DB (DB_SHARDS)
+# and events older than PROV_ARCHIVE_AFTER_S move to compressed archives
+# PROV_MAX_PENDING > 0 queues provenance writes (bounded) for a batch writer;
+# while they lag more than PROV_MAX_LAG_S, non-deletion requests get 503
+# PROFILE_SAMPLE_RATE profiles that share of requests (changeable via /admin/profile,
+# which takes an X-Admin-Token header matching SHADOW_ADMIN_TOKEN; unset disables it)
+# DESTINATIONS is the JSON registry of the apps we ship data to: transport,
+# routes, batch size and concurrency budget each (default destinations.json
+# here; PAYPAL_TRANSPORT / PAYPAL_URL pick how PayPal is reached)
+# PROV_BLOOM_EXCLUSIVE=1 declares this the only process writing the
+# provenance store (a single worker), so the in-memory Bloom filters see
+# every transfer_out and deletions may skip the provenance query on a
+# miss. Off by default: every deletion queries.
+DESTINATIONS = os.environ.get("DESTINATIONS",
+                              os.path.join(os.path.dirname(__file__), "destinations.json"))
+rt = ShadowRuntime(appname="PencilPros", prov_db="pencilpros_prov.db",
+                   snapshot_s=float(os.environ.get("PROV_SNAPSHOT_S", "0")) or None,
+                   shards=SHARDS,
+                   archive_after_s=float(os.environ.get("PROV_ARCHIVE_AFTER_S", "0")) or None,
+                   max_pending=int(os.environ.get("PROV_MAX_PENDING", "0")) or None,
+                   admission=AdmissionPolicy(max_lag_s=float(os.environ.get("PROV_MAX_LAG_S", "1.0"))),
+                   profile_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+                   destinations=Registry.load(DESTINATIONS),
+                   bloom_exclusive=os.environ.get("PROV_BLOOM_EXCLUSIVE", "0") == "1",
+                   admin_token=os.environ.get("SHADOW_ADMIN_TOKEN"))
+rt.mount(app)
+
+# TRACE_EXPORT=<file> appends every finished span (per-hop timings) as JSON lines
+if os.environ.get("TRACE_EXPORT"):
+    add_exporter(jsonl_exporter(os.environ["TRACE_EXPORT"]))
 
+# CAPTURE_FILE=<file> records request/response pairs as JSON lines for
+# `python -m shadowrt.replay`
+if os.environ.get("CAPTURE_FILE"):
+    app.add_middleware(CaptureMiddleware, writer=CaptureWriter(os.environ["CAPTURE_FILE"]),
+                       app_name="PencilPros")
 
-# Init DB and runtime
-init_db()
-rt = ShadowRuntime(appname="PencilPros", prov_db="pencilpros_prov.db")
+# Erasures run in bounded batches so heavy users don't stall checkouts
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "500"))
+DELETE_PAUSE_S = float(os.environ.get("DELETE_PAUSE_S", "0.01"))
 
-PAYPAL_URL = os.environ.get("PAYPAL_URL", "http://127.0.0.1:8001")
+# Async checkout: persist + label the purchase, queue the PayPal charge and
+# return immediately. CHARGE_WORKERS workers drain the queue, each shipping
+# up to PayPal's batch_size charges per request.
+# Finished charge jobs are purged after CHARGE_JOB_RETENTION_S; a user's
+# pending ones are cancelled when the user is deleted.
+ASYNC_CHECKOUT = os.environ.get("ASYNC_CHECKOUT", "0") == "1"
+CHARGE_WORKERS = int(os.environ.get("CHARGE_WORKERS", "4"))
+CHARGE_JOB_RETENTION_S = float(os.environ.get("CHARGE_JOB_RETENTION_S", "86400"))
 
 # ---------- Pydantic models ----------
 
@@ -32,45 +97,79 @@ class UserCreate(BaseModel):
     user_id: str
     name: str
 
+class LineItem(BaseModel):
+    item: str
+    qty: int = 1
+    unit_cents: int
+
 class PurchaseCreate(BaseModel):
     user_id: str
-    item: str
-    amount_cents: int
+    item: str = "Cart order"
+    amount_cents: int | None = None  # derived from items when they are given
+    items: list[LineItem] = []
     billing_address: str  # sent to PayPal, not stored locally
 
 # ---------- Runtime-wrapped functions ----------
 
 @rt.source
-def build_payment_blob(user_id: str, amount_cents: int, item: str) -> dict:
+def build_payment_blob(user_id: str, amount_cents: int, item: str,
+                       items: list[dict] | None = None) -> dict:
     """
     This is the labeled payload leaving PencilPros.
     Note: no billing address; that's only for PayPal's DB.
+    Line items (if any) ride along in the same blob under one label.
     """
-    return {
+    blob = {
         "user_id": user_id,
         "amount_cents": amount_cents,
         "item": item,
         "ts": time.time(),
     }
+    if items:
+        blob["items"] = items
+    return blob
 
-@rt.sink(dst_app="PayPal")
-def send_to_paypal(labeled: Labeled[dict], billing_address: str):
+def send_to_paypal(labeled: Labeled[dict]):
     """
-    Sink: logs transfer_out, then calls PayPal /charge with the label attached.
+    Sink: logs transfer_out, then sends the blob with its label (and the
+    sink's trace context) to PayPal's send route in the destination
+    registry. The blob already carries the billing address (see
+    charge_paypal).
     """
-    header = labeled.label.to_header()
-    payload = dict(labeled.value)
-    payload["billing_address"] = billing_address
-
-    resp = requests.post(
-        f"{PAYPAL_URL}/charge",
-        json=payload,
-        headers={"X-Shadow-Label": header},
-        timeout=5,
-    )
-    if not resp.ok:
+    try:
+        return rt.send("PayPal", labeled)
+    except TransportError:
         raise HTTPException(status_code=502, detail="PayPal error")
-    return resp.json()
+
+def run_charge_jobs(jobs: list[dict]) -> list:
+    """
+    Queue handler: rebuild the labeled blobs and ship them as one batch.
+    Each charge's transfer_out is logged in its own checkout's trace; a
+    charge PayPal rejected comes back as a TransportError and fails only
+    its job. PayPal dedupes on the label's tag, so retrying a whole batch
+    after a failed request doesn't charge twice.
+    """
+    labeled = [Labeled(value=j["value"], label=Label.from_header(j["label"])) for j in jobs]
+    with rt.span("charge_jobs"), rt.profile("job:charge"):
+        return rt.send_many("PayPal", labeled, traces=[j.get("trace") for j in jobs])
+
+# batch_size is PayPal's, set at startup from the destination registry
+charge_queue = JobQueue("pencilpros_jobs.db", run_charge_jobs, workers=CHARGE_WORKERS,
+                        batched=True, retention_s=CHARGE_JOB_RETENTION_S)
+
+def charge_paypal(labeled: Labeled[dict], billing_address: str, async_mode: bool) -> dict:
+    """Charge now (sync) or enqueue the charge and hand back a status URL."""
+    # derived label: the PayPal blob is the payment blob plus the billing address
+    charge = rt.map(lambda v: {**v, "billing_address": billing_address},
+                    labeled, op="add_billing_address")
+    if not async_mode:
+        return {"paypal_result": send_to_paypal(charge)}
+    job_id = charge_queue.enqueue({
+        "label": charge.label.to_header(),
+        "value": charge.value,
+        "trace": current_header(),
+    }, user_id=charge.label.user_id)
+    return {"charge_job": job_id, "status_url": f"/charge_jobs/{job_id}"}
 
 # ---------- API endpoints ----------
 
@@ -91,12 +190,19 @@ def create_or_update_user(u: UserCreate):
     return {"ok": True}
 
 @app.post("/purchase")
-def purchase(p: PurchaseCreate):
+def purchase(p: PurchaseCreate, async_mode: bool = ASYNC_CHECKOUT):
     """
     Creates a purchase locally and sends a labeled payment blob to PayPal.
+    With async_mode the charge is queued and polled via status_url.
     """
+    if p.items:
+        return purchase_items(p, async_mode)
+    if p.amount_cents is None:
+        raise HTTPException(status_code=422, detail="amount_cents or items required")
+
     # Insert into local DB
     purchase_id = insert_purchase(p.user_id, p.item, p.amount_cents)
+    rt.cache.invalidate(p.user_id, ("purchases",))
 
     # Log that purchase row exists in our DB
     rt.log.log(
@@ -119,64 +225,115 @@ def purchase(p: PurchaseCreate):
         current_user.reset(token)
 
     # Send to PayPal with sink (logs transfer_out)
-    paypal_result = send_to_paypal(labeled_payment, p.billing_address)
+    return {
+        "ok": True,
+        "purchase_id": purchase_id,
+        **charge_paypal(labeled_payment, p.billing_address, async_mode),
+    }
+
+def purchase_items(p: PurchaseCreate, async_mode: bool):
+    """
+    Itemized checkout: all line items go into one transaction, one parent
+    label (with derived child tags per item) and one PayPal charge.
+    """
+    items = [li.model_dump() for li in p.items]
+    amount_cents = sum(li.qty * li.unit_cents for li in p.items)
+
+    purchase_id, item_ids = insert_purchase_with_items(
+        p.user_id, p.item, amount_cents,
+        [(li.item, li.qty, li.unit_cents) for li in p.items],
+    )
+    rt.cache.invalidate(p.user_id, ("purchases",))
+
+    token = current_user.set(p.user_id)
+    try:
+        labeled_payment = build_payment_blob(p.user_id, amount_cents, p.item, items)
+    finally:
+        current_user.reset(token)
+
+    child_tags = [child_label(labeled_payment.label, i).tag_id for i in range(len(items))]
+    rt.log.log(
+        op="insert_purchase",
+        user_id=p.user_id,
+        tag_id=f"purchase:{purchase_id}",
+        payload=json.dumps({"items": items, "amount_cents": amount_cents}).encode(),
+        dst_app=None,
+        meta={
+            "label": labeled_payment.label.tag_id,
+            "child_tags": dict(zip(map(str, item_ids), child_tags)),
+        },
+    )
 
     return {
         "ok": True,
         "purchase_id": purchase_id,
-        "paypal_result": paypal_result,
+        "item_ids": item_ids,
+        **charge_paypal(labeled_payment, p.billing_address, async_mode),
     }
 
+@rt.cached("purchases")
+def purchase_history(user_id: str) -> list[dict]:
+    return list_purchases(user_id)
+
+@rt.cached("purchase")
+def order_status(user_id: str, purchase_id: int) -> dict | None:
+    return get_purchase(user_id, purchase_id)
+
+@app.get("/purchases/{user_id}")
+def read_purchases(user_id: str):
+    """A user's purchase history (cached until TTL, a new purchase, or deletion)."""
+    return {"user_id": user_id, "purchases": purchase_history(user_id)}
+
+@app.get("/purchases/{user_id}/{purchase_id}")
+def read_purchase(user_id: str, purchase_id: int):
+    order = order_status(user_id, purchase_id)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Unknown purchase")
+    return order
+
+@app.get("/charge_jobs/{job_id}")
+def charge_job_status(job_id: int):
+    """Poll an async checkout's PayPal charge: queued, running, done or failed."""
+    status = charge_queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown charge job")
+    return status
+
 @app.delete("/delete/{user_id}")
+@rt.coalesced("delete_user")
 def delete_user(user_id: str):
     """
     Deletion request:
+      0. Cancel the user's queued charge jobs (waiting out any in flight,
+         so their transfers are logged before step 1 reads provenance).
       1. Check provenance for destinations of this user's data.
-      2. Send delete requests (e.g., to PayPal).
-      3. Log delete_request + delete_done in our provenance.
-      4. Actually delete from PencilPros DB.
+      2. Send delete requests to each of them that the destination
+         registry can reach, logging delete_request + delete_done.
+      3. Actually delete from PencilPros DB (and its read cache).
+    Concurrent requests for the same user (double clicks, retries) share
+    one run and its receipts.
     """
-    # 1) Which external apps have we sent this user's data to?
-    destinations = rt.log.destinations_for_user(user_id)
-
-    receipts = {}
-
-    # 2) Send deletion requests based on provenance
-    if "PayPal" in destinations:
-        rt.log.log(
-            op="delete_request",
-            user_id=user_id,
-            tag_id="*",
-            payload=b"",
-            dst_app="PayPal",
-            meta={"reason": "user deletion request"},
-        )
-        resp = requests.delete(f"{PAYPAL_URL}/delete_by_user/{user_id}", timeout=5)
-        if not resp.ok:
-            raise HTTPException(status_code=502, detail="PayPal delete failed")
-
-        receipts["PayPal"] = resp.json()
-
-        rt.log.log(
-            op="delete_done",
-            user_id=user_id,
-            tag_id="*",
-            payload=json.dumps(receipts["PayPal"]).encode(),
-            dst_app="PayPal",
-            meta={},
-        )
-
-    # 3) Delete from our own DB
-    delete_user_and_purchases(user_id)
-
-    # 4) Log local DB deletion (for audit trail)
-    rt.log.log(
-        op="delete_local",
-        user_id=user_id,
-        tag_id="*",
-        payload=b"",
-        dst_app=None,
-        meta={"details": "deleted from users + purchases"},
+    # 0) Nothing of the user's may still be waiting to leave for PayPal
+    try:
+        charge_queue.cancel_user(user_id)
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    # 1+2) Fan the deletion out to every app provenance says has this
+    #      user's data (concurrently, each within its concurrency budget)
+    try:
+        receipts = rt.delete_remote(user_id)
+    except TransportError as e:
+        raise HTTPException(status_code=502, detail=e.detail)
+
+    # 3) Delete from our own DB (chunked, so the write lock is released between
+    #    batches), drop cached reads for the user and log delete_local
+    rt.delete_local(
+        user_id,
+        lambda uid: delete_user_and_purchases_chunked(
+            uid, batch_size=DELETE_BATCH_SIZE, pause_s=DELETE_PAUSE_S,
+        ),
+        details="deleted from users + purchases",
     )
 
     return {"ok": True, "receipts": receipts}
@@ -1,7 +1,22 @@
-import sqlite3, os, time
+import sqlite3, os, time, threading
+
+from shadowrt.deleter import ChunkedDeleter
+from shadowrt.migrate import ensure_schema
+from shadowrt.shards import HashRing, shard_path, scatter, next_id, pin_shards
+from shadowrt.profiler import ProfiledConnection
 
 DB_PATH = "pencilpros.db"
 
+# DB_SHARDS > 1 splits the database into that many files (pencilpros.s0.db, ...),
+# each owning the users that hash to it, so writers for different users
+# don't queue on one SQLite lock. Every per-user operation stays on one
+# shard; cross-user reads scatter over all of them. Purchase and item ids
+# are unique across shards (shards.next_id), so purchase:{id} tags are too.
+# The count is recorded on first start (shards.pin_shards) and a different
+# DB_SHARDS is refused later, since users' rows do not move between files.
+SHARDS = int(os.environ.get("DB_SHARDS", "1"))
+RING = HashRing(SHARDS)
+
 SCHEMA = """
 PRAGMA foreign_keys = ON;
 
@@ -20,19 +35,62 @@ CREATE TABLE IF NOT EXISTS purchases (
 );
 """
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# Ordered (version, sql) migrations applied on top of SCHEMA by init_db().
+# Append new entries; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(user_id);"),
+    (2, """
+CREATE TABLE IF NOT EXISTS purchase_items (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  purchase_id INTEGER NOT NULL,
+  user_id TEXT NOT NULL,
+  item TEXT NOT NULL,
+  qty INTEGER NOT NULL,
+  unit_cents INTEGER NOT NULL,
+  FOREIGN KEY (purchase_id) REFERENCES purchases(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_purchase_items_user ON purchase_items(user_id);
+"""),
+]
+
+def _connect(shard: int):
+    # each `with conn:` block shows up as a "db" section in sampled profiles
+    conn = sqlite3.connect(shard_path(DB_PATH, shard, SHARDS), factory=ProfiledConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def shard_conn(shard: int):
+    init_db()
+    return _connect(shard)
+
+def get_conn(user_id: str):
+    """Connection to the shard that owns user_id."""
+    return shard_conn(RING.shard_for(user_id))
+
+_ready = False
+_ready_lock = threading.Lock()
+
 def init_db():
-    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
-    with get_conn() as conn:
-        conn.executescript(SCHEMA)
-        conn.commit()
+    """
+    Create/migrate every shard. Runs once per process (the app's lifespan,
+    or the first connection if that comes earlier) and skips the DDL for
+    files already at the latest version.
+    """
+    global _ready
+    if _ready:
+        return
+    with _ready_lock:
+        if _ready:
+            return
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        pin_shards(DB_PATH, SHARDS, ("users", "purchases"))     # refuses a changed DB_SHARDS
+        for shard in range(SHARDS):
+            with _connect(shard) as conn:
+                ensure_schema(conn, SCHEMA, MIGRATIONS)
+        _ready = True
 
 def upsert_user(user_id: str, name: str):
-    with get_conn() as conn:
+    with get_conn(user_id) as conn:
         conn.execute(
             "INSERT INTO users(user_id,name) VALUES(?,?) "
             "ON CONFLICT(user_id) DO UPDATE SET name=excluded.name",
@@ -41,17 +99,96 @@ def upsert_user(user_id: str, name: str):
         conn.commit()
 
 def insert_purchase(user_id: str, item: str, amount_cents: int) -> int:
-    with get_conn() as conn:
-        cur = conn.execute(
-            "INSERT INTO purchases(user_id,item,amount_cents,created) "
-            "VALUES(?,?,?,?)",
-            (user_id, item, amount_cents, time.time()),
+    return insert_purchase_with_items(user_id, item, amount_cents, [])[0]
+
+def insert_purchase_with_items(user_id: str, item: str, amount_cents: int,
+                               items: list[tuple[str, int, int]]) -> tuple[int, list[int]]:
+    """
+    Insert a purchase and its (item, qty, unit_cents) line items in one
+    transaction. Returns (purchase_id, line item ids).
+    """
+    shard = RING.shard_for(user_id)
+    with shard_conn(shard) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        purchase_id = next_id(conn, "purchases", shard, SHARDS)
+        conn.execute(
+            "INSERT INTO purchases(id,user_id,item,amount_cents,created) "
+            "VALUES(?,?,?,?,?)",
+            (purchase_id, user_id, item, amount_cents, time.time()),
         )
+        item_ids = []
+        for name, qty, unit_cents in items:
+            item_id = next_id(conn, "purchase_items", shard, SHARDS)
+            conn.execute(
+                "INSERT INTO purchase_items(id,purchase_id,user_id,item,qty,unit_cents) "
+                "VALUES(?,?,?,?,?,?)",
+                (item_id, purchase_id, user_id, name, qty, unit_cents),
+            )
+            item_ids.append(item_id)
         conn.commit()
-        return cur.lastrowid
+        return purchase_id, item_ids
+
+def list_purchases(user_id: str) -> list[dict]:
+    """All of a user's purchases, newest first, each with its line items."""
+    with get_conn(user_id) as conn:
+        purchases = [dict(r) for r in conn.execute(
+            "SELECT id,item,amount_cents,created FROM purchases "
+            "WHERE user_id=? ORDER BY id DESC",
+            (user_id,),
+        )]
+        items = {}
+        for r in conn.execute(
+            "SELECT purchase_id,item,qty,unit_cents FROM purchase_items WHERE user_id=?",
+            (user_id,),
+        ):
+            items.setdefault(r["purchase_id"], []).append(
+                {"item": r["item"], "qty": r["qty"], "unit_cents": r["unit_cents"]}
+            )
+    for p in purchases:
+        p["items"] = items.get(p["id"], [])
+    return purchases
+
+def get_purchase(user_id: str, purchase_id: int) -> dict | None:
+    with get_conn(user_id) as conn:
+        row = conn.execute(
+            "SELECT id,item,amount_cents,created FROM purchases WHERE id=? AND user_id=?",
+            (purchase_id, user_id),
+        ).fetchone()
+        if row is None:
+            return None
+        p = dict(row)
+        p["items"] = [dict(r) for r in conn.execute(
+            "SELECT item,qty,unit_cents FROM purchase_items WHERE purchase_id=?",
+            (purchase_id,),
+        )]
+    return p
 
 def delete_user_and_purchases(user_id: str):
-    with get_conn() as conn:
+    with get_conn(user_id) as conn:
+        conn.execute("DELETE FROM purchase_items WHERE user_id=?", (user_id,))
         conn.execute("DELETE FROM purchases WHERE user_id=?", (user_id,))
         conn.execute("DELETE FROM users WHERE user_id=?", (user_id,))
         conn.commit()
+
+def delete_user_and_purchases_chunked(user_id: str, batch_size: int = 500,
+                                      pause_s: float = 0.01, progress=None) -> int:
+    """Like delete_user_and_purchases, but purchases go in bounded batches."""
+    deleter = ChunkedDeleter(lambda: get_conn(user_id), batch_size=batch_size,
+                             pause_s=pause_s, progress=progress)
+    deleter.delete("purchase_items", user_id)
+    deleted = deleter.delete("purchases", user_id)
+    with get_conn(user_id) as conn:
+        conn.execute("DELETE FROM users WHERE user_id=?", (user_id,))
+        conn.commit()
+    return deleted
+
+def export_purchases() -> list[dict]:
+    """
+    Every purchase on every shard, oldest first, each with its shard number.
+    """
+    def one(shard: int) -> list[dict]:
+        with shard_conn(shard) as conn:
+            return [{**dict(r), "shard": shard} for r in conn.execute(
+                "SELECT id,user_id,item,amount_cents,created FROM purchases")]
+    return sorted((r for rows in scatter(SHARDS, one) for r in rows),
+                  key=lambda r: r["created"])
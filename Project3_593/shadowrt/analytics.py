@@ -0,0 +1,209 @@
+"""
+Vectorized compliance reports over a provenance log (needs numpy).
+
+Columns are pulled from a backend in keyset-paginated chunks, with op, app
+and user strings dictionary-encoded into small integer arrays, and every
+report is computed with numpy array operations rather than per-row Python.
+From SQLite stores (sharded or not, replicas included) the op and app
+columns are read as the integer codes provenance_v2 already keeps, so
+nothing is decoded to strings and back.
+
+    cols = load_columns(rt.log.reader)
+    transfers_per_destination_per_day(cols)
+    deletion_sla(cols)
+    top_users(cols, 10)
+"""
+import datetime
+from contextlib import closing
+from typing import Optional, List
+
+try:
+    import numpy as np
+except ImportError as e:     # optional: only these reports need it
+    raise ImportError("shadowrt.analytics needs numpy; pip install numpy") from e
+
+from .storage import ProvBackend, SQLiteBackend, ShardedBackend
+
+DAY_S = 86400
+
+class Dictionary:
+    """String <-> int32 code mapping that grows as new chunks arrive."""
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self.codes: dict = {}
+
+    def encode(self, strings) -> np.ndarray:
+        # one dict lookup per row; sorting object arrays (np.unique) costs far more
+        codes, values = self.codes, self.values
+        def code(s):
+            c = codes.get(s)
+            if c is None:
+                c = codes[s] = len(values)
+                values.append(s)
+            return c
+        return np.fromiter(map(code, strings), dtype=np.int32, count=len(strings))
+
+    def code(self, s: Optional[str]) -> int:
+        return self.codes.get(s, -1)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class ProvColumns:
+    """Typed column arrays for a slice of the provenance log."""
+    def __init__(self):
+        self.ops, self.apps, self.users = Dictionary(), Dictionary(), Dictionary()
+        self._chunks = {k: [] for k in ("t", "op", "src", "dst", "user")}
+        self.t = self.op = self.src = self.dst = self.user = np.empty(0)
+
+    def add_chunk(self, rows: list) -> None:
+        cols = list(zip(*rows))
+        self._chunks["t"].append(np.fromiter(cols[1], dtype=np.float64, count=len(rows)))
+        self._chunks["op"].append(self.ops.encode(cols[2]))
+        self._chunks["src"].append(self.apps.encode(cols[3]))
+        self._chunks["dst"].append(self.apps.encode(cols[4]))
+        self._chunks["user"].append(self.users.encode(cols[5]))
+
+    def add_arrays(self, t: np.ndarray, op: np.ndarray, src: np.ndarray,
+                   dst: np.ndarray, user: np.ndarray) -> None:
+        """Add a chunk whose columns are already encoded with this object's dictionaries."""
+        for k, a in (("t", t), ("op", op), ("src", src), ("dst", dst), ("user", user)):
+            self._chunks[k].append(a)
+
+    def finish(self) -> "ProvColumns":
+        for k, parts in self._chunks.items():
+            dtype = np.float64 if k == "t" else np.int32
+            setattr(self, k, np.concatenate(parts) if parts else np.empty(0, dtype=dtype))
+        self._chunks = {k: [] for k in self._chunks}
+        return self
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+
+def _remap(c, table: str, d: Dictionary) -> np.ndarray:
+    """Store code -> Dictionary code; the last slot stands for NULL."""
+    names = dict(c.execute(f"SELECT id, name FROM {table}"))
+    remap = np.full(max(names, default=0) + 2, -1, dtype=np.int32)
+    for i, name in names.items():
+        remap[i] = d.encode([name])[0]
+    remap[-1] = d.encode([None])[0]
+    return remap
+
+def _load_sqlite(cols: ProvColumns, backend: SQLiteBackend, t_from: Optional[float],
+                 t_to: Optional[float], chunk_rows: int) -> None:
+    where, args = [], []
+    if t_from is not None:
+        where.append("t_unix>=?")
+        args.append(t_from)
+    if t_to is not None:
+        where.append("t_unix<?")
+        args.append(t_to)
+    with closing(backend._connect()) as c:
+        ops, apps = _remap(c, "prov_ops", cols.ops), _remap(c, "prov_apps", cols.apps)
+        # unbounded, a plain table scan beats walking the time index
+        cur = c.execute("SELECT t_unix, op, src_app, COALESCE(dst_app, -1), user_id "
+                        f"FROM provenance_v2 WHERE {' AND '.join(where) or '1'}", args)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            t, op, src, dst, user = zip(*rows)
+            n = len(rows)
+            cols.add_arrays(np.fromiter(t, dtype=np.float64, count=n),
+                            ops[np.fromiter(op, dtype=np.int64, count=n)],
+                            apps[np.fromiter(src, dtype=np.int64, count=n)],
+                            apps[np.fromiter(dst, dtype=np.int64, count=n)],
+                            cols.users.encode(user))
+
+def load_columns(backend: ProvBackend, t_from: Optional[float] = None,
+                 t_to: Optional[float] = None, chunk_rows: int = 500_000) -> ProvColumns:
+    """
+    Read [t_from, t_to) from a backend chunk by chunk into ProvColumns.
+    Rows come in time order except from SQLite stores, where each shard
+    is read as stored; no report depends on the order.
+    """
+    cols = ProvColumns()
+    shards = ([backend] if isinstance(backend, SQLiteBackend)
+              else backend.shards if isinstance(backend, ShardedBackend) else None)
+    if shards and all(isinstance(b, SQLiteBackend) for b in shards):
+        for b in shards:
+            _load_sqlite(cols, b, t_from, t_to, chunk_rows)
+        return cols.finish()
+    after = None
+    while True:
+        rows = backend.query(t_from=t_from, t_to=t_to, after=after, limit=chunk_rows)
+        if not rows:
+            break
+        cols.add_chunk(rows)
+        if len(rows) < chunk_rows:
+            break
+        after = (rows[-1][1], rows[-1][0])
+    return cols.finish()
+
+
+def transfers_per_destination_per_day(cols: ProvColumns) -> List[dict]:
+    """transfer_out counts grouped by (dst_app, UTC day)."""
+    mask = cols.op == cols.ops.code("transfer_out")
+    if not mask.any():
+        return []
+    day = (cols.t[mask] // DAY_S).astype(np.int64)
+    d0 = day.min()
+    span = day.max() - d0 + 1
+    key = cols.dst[mask].astype(np.int64) * span + (day - d0)
+    keys, counts = np.unique(key, return_counts=True)
+    return [
+        {
+            "dst_app": cols.apps.values[k // span],
+            "day": datetime.datetime.fromtimestamp(
+                int(d0 + k % span) * DAY_S, datetime.timezone.utc).date().isoformat(),
+            "transfers": int(c),
+        }
+        for k, c in zip(keys.tolist(), counts.tolist())
+    ]
+
+
+def deletion_sla(cols: ProvColumns, percentiles=(50, 90, 99)) -> dict:
+    """
+    Pair each delete_request with the first delete_done for the same
+    (user, dst_app) at or after it; report latency percentiles (seconds),
+    plus how many requests are still open.
+    """
+    req = cols.op == cols.ops.code("delete_request")
+    done = cols.op == cols.ops.code("delete_done")
+    sel = req | done
+    # sort requests and dones together by (user, dst_app, t), a request
+    # ahead of a done at the same instant; then each request's match is the
+    # next done in that order, if it is still in the request's group
+    user, dst, t, is_done = cols.user[sel], cols.dst[sel], cols.t[sel], done[sel]
+    order = np.lexsort((is_done, t, dst, user))
+    user, dst, t, is_done = user[order], dst[order], t[order], is_done[order]
+    n = len(order)
+    pos = np.where(is_done, np.arange(n), n)
+    next_done = np.minimum.accumulate(pos[::-1])[::-1]
+
+    r = np.flatnonzero(~is_done)
+    nd = next_done[r]
+    hit = nd < n
+    hit[hit] = (user[nd[hit]] == user[r[hit]]) & (dst[nd[hit]] == dst[r[hit]])
+    lat = t[nd[hit]] - t[r[hit]]
+
+    out = {"requests": int(req.sum()), "completed": int(hit.sum()),
+           "open": int((~hit).sum())}
+    if len(lat):
+        for p, v in zip(percentiles, np.percentile(lat, percentiles)):
+            out[f"p{p}_s"] = float(v)
+        out["max_s"] = float(lat.max())
+    return out
+
+
+def top_users(cols: ProvColumns, n: int = 10) -> List[dict]:
+    """Users with the most provenance events."""
+    if not len(cols):
+        return []
+    counts = np.bincount(cols.user, minlength=len(cols.users))
+    n = min(n, len(counts))
+    top = np.argpartition(-counts, n - 1)[:n]
+    top = top[np.argsort(-counts[top], kind="stable")]
+    return [{"user_id": cols.users.values[u], "events": int(counts[u])} for u in top.tolist()]
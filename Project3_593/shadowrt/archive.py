@@ -0,0 +1,362 @@
+"""
+Cold tier for provenance: immutable, compressed archive files.
+
+An Archiver moves events older than a cutoff out of the hot store into
+files under <prov db>.archive/, one keyset-ordered run of records per
+file. index.json keeps each file's time range, row count and Bloom
+filters of its user and tag ids, so reads only open files that might
+match. Several processes may share one archive directory: writers
+serialize on an OS file lock (index.lock) and re-read the index under
+it, and readers reload index.json whenever it has been replaced. Files are zstd-compressed when the `zstandard` package is
+installed and lzma-compressed (stdlib) otherwise; either kind reads back
+as long as its codec is available.
+
+    hot = SQLiteBackend("prov.db")
+    cold = ArchiveBackend("prov.db.archive")
+    backend = TieredBackend(hot, cold)      # reads span both tiers
+    Archiver(hot, cold, after_s=30 * 86400).run_once()
+"""
+import json, lzma, os, time, base64, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Iterator, List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+def _lock_file(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+
+def _unlock_file(fh) -> None:
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+from .storage import ProvBackend, Record, _key, _in_range
+from .bloom import BloomFilter
+
+def _compress(data: bytes) -> tuple[str, bytes]:
+    if zstandard is not None:
+        return "zst", zstandard.ZstdCompressor(level=19).compress(data)
+    return "xz", lzma.compress(data, preset=6)
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zst":
+        if zstandard is None:
+            raise RuntimeError("archive file is zstd-compressed; pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return lzma.decompress(data)
+
+def _bloom(keys: set) -> BloomFilter:
+    f = BloomFilter(m_bits=max(64, 10 * len(keys)), k=7)     # ~1% false positives
+    for k in keys:
+        f.add(k)
+    return f
+
+def _bloom_to_json(f: BloomFilter) -> dict:
+    return {"m": f.m, "k": f.k, "bits": base64.b64encode(f.bits).decode()}
+
+def _bloom_from_json(d: dict) -> BloomFilter:
+    return BloomFilter(d["m"], d["k"], base64.b64decode(d["bits"]))
+
+
+class ArchiveBackend(ProvBackend):
+    """
+    Read side of the archive directory. Files never change once written;
+    `high` is the (t_unix, event_id) of the newest archived event, and
+    every archived event sorts at or before it. `entries` and `high`
+    always reflect the index on disk, whichever process wrote it.
+    """
+    def __init__(self, directory: str, cache_files: int = 4):
+        self.dir = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self._entries: List[dict] = []
+        self._high: Optional[tuple] = None
+        self._loaded = None         # (inode, mtime_ns, size) of the index read last
+        self._cache: OrderedDict = OrderedDict()    # file name -> records
+        self._cache_files = cache_files
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._lock_fh = None
+        self._refresh()
+
+    def _refresh(self) -> None:
+        """Re-read index.json if another process (or we) replaced it since."""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._loaded:
+            return
+        with self._lock:
+            if stamp == self._loaded:
+                return
+            with open(self.index_path) as fh:
+                state = json.load(fh)
+            self._entries = [self._load_entry(e) for e in state["files"]]
+            self._high = tuple(state["high"]) if state["high"] else None
+            self._loaded = stamp
+
+    @property
+    def entries(self) -> List[dict]:
+        self._refresh()
+        return self._entries
+
+    @property
+    def high(self) -> Optional[tuple]:
+        self._refresh()
+        return self._high
+
+    @contextmanager
+    def locked(self):
+        """
+        Exclusive writer access across threads and processes, with the
+        index freshly loaded. Re-entrant within a thread (Archiver.run_once
+        holds it around its write() calls).
+        """
+        with self._write_lock:
+            if self._write_depth == 0:
+                self._lock_fh = open(os.path.join(self.dir, "index.lock"), "a+")
+                _lock_file(self._lock_fh)
+            self._write_depth += 1
+            try:
+                self._refresh()
+                yield self
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    _unlock_file(self._lock_fh)
+                    self._lock_fh.close()
+                    self._lock_fh = None
+
+    @staticmethod
+    def _load_entry(e: dict) -> dict:
+        return {**e, "users": _bloom_from_json(e["users"]), "tags": _bloom_from_json(e["tags"])}
+
+    def write(self, recs: List[Record]) -> dict:
+        """Archive a run of records that all sort after `high`."""
+        with self.locked():
+            return self._write(recs)
+
+    def _write(self, recs: List[Record]) -> dict:
+        recs = sorted(recs, key=_key)
+        if self._high is not None and _key(recs[0]) <= self._high:
+            raise ValueError("archive runs must be appended in (t_unix, event_id) order")
+        codec, blob = _compress(json.dumps(recs, separators=(",", ":")).encode())
+        # the last event id keeps names unique when runs share a timestamp
+        name = f"{recs[0][1]:.6f}-{recs[-1][1]:.6f}-{recs[-1][0]}.{codec}"
+        tmp = os.path.join(self.dir, name + ".tmp")
+        with open(tmp, "wb") as fh:
+            fh.write(blob)
+        os.replace(tmp, os.path.join(self.dir, name))
+        entry = {
+            "name": name, "codec": codec, "count": len(recs), "bytes": len(blob),
+            "t_min": recs[0][1], "t_max": recs[-1][1],
+            "users": _bloom({r[5] for r in recs}), "tags": _bloom({r[6] for r in recs}),
+        }
+        # entries before high: a reader holding the old high ignores the new file
+        self._save_index(self._entries + [entry], _key(recs[-1]))
+        return entry
+
+    def _save_index(self, entries: List[dict], high: tuple):
+        """Replace index.json; call with locked() held and the index fresh."""
+        state = {
+            "high": list(high) if high else None,
+            "files": [{**e, "users": _bloom_to_json(e["users"]), "tags": _bloom_to_json(e["tags"])}
+                      for e in entries],
+        }
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.index_path)
+        with self._lock:
+            self._entries, self._high = entries, high
+            st = os.stat(self.index_path)
+            self._loaded = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _records(self, entry: dict) -> List[Record]:
+        with self._lock:
+            recs = self._cache.get(entry["name"])
+            if recs is not None:
+                self._cache.move_to_end(entry["name"])
+                return recs
+        with open(os.path.join(self.dir, entry["name"]), "rb") as fh:
+            recs = [tuple(r) for r in json.loads(_decompress(entry["codec"], fh.read()))]
+        with self._lock:
+            self._cache[entry["name"]] = recs
+            while len(self._cache) > self._cache_files:
+                self._cache.popitem(last=False)
+        return recs
+
+    def _candidates(self, user_id=None, tag_id=None, t_from=None, t_to=None,
+                    after=None) -> List[dict]:
+        """Files the index can't rule out, oldest first."""
+        return [e for e in self.entries
+                if (t_from is None or e["t_max"] >= t_from)
+                and (t_to is None or e["t_min"] < t_to)
+                and (after is None or e["t_max"] >= after[0])
+                and (user_id is None or user_id in e["users"])
+                and (tag_id is None or tag_id in e["tags"])]
+
+    def stats(self) -> dict:
+        return {"files": len(self.entries),
+                "events": sum(e["count"] for e in self.entries),
+                "bytes": sum(e["bytes"] for e in self.entries)}
+
+    # ---------- ProvBackend ----------
+
+    def append(self, rec: Record) -> None:
+        raise RuntimeError("provenance archives are immutable; use write()")
+
+    def by_user(self, user_id: str) -> List[Record]:
+        return [r for e in self._candidates(user_id=user_id)
+                for r in self._records(e) if r[5] == user_id]
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        return [r for e in self._candidates(tag_id=tag_id)
+                for r in self._records(e) if r[6] == tag_id]
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        for e in self._candidates(t_from=t_from, t_to=t_to):
+            yield from (r for r in self._records(e) if _in_range(r[1], t_from, t_to))
+
+    def query(self, user_id=None, tag_id=None, op=None, dst_app=None,
+              t_from=None, t_to=None, after=None, limit=100) -> List[Record]:
+        out = []
+        for e in self._candidates(user_id, tag_id, t_from, t_to, after):
+            for r in self._records(e):
+                if ((user_id is None or r[5] == user_id)
+                        and (tag_id is None or r[6] == tag_id)
+                        and (op is None or r[2] == op)
+                        and (dst_app is None or r[4] == dst_app)
+                        and _in_range(r[1], t_from, t_to)
+                        and (after is None or _key(r) > tuple(after))):
+                    out.append(r)
+                    if len(out) == limit:
+                        return out
+        return out
+
+
+class TieredBackend(ProvBackend):
+    """
+    Hot backend plus archive, read as one log. Events at or before the
+    archive's `high` mark are served from the archive, later ones from the
+    hot store, so rows not yet dropped from hot (or still present in a
+    lagging snapshot replica) are never returned twice.
+    """
+    def __init__(self, hot: ProvBackend, archive: ArchiveBackend):
+        self.hot = hot
+        self.archive = archive
+
+    def _split(self, cold: List[Record], hot: List[Record]) -> List[Record]:
+        high = self.archive.high
+        if high is None:
+            return hot
+        return [r for r in cold if _key(r) <= high] + [r for r in hot if _key(r) > high]
+
+    def append(self, rec: Record) -> None:
+        self.hot.append(rec)
+
+    def append_many(self, recs: List[Record]) -> None:
+        self.hot.append_many(recs)
+
+    def by_user(self, user_id: str) -> List[Record]:
+        return self._split(self.archive.by_user(user_id), self.hot.by_user(user_id))
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        return self._split(self.archive.by_tag(tag_id), self.hot.by_tag(tag_id))
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        high = self.archive.high
+        if high is not None and (t_from is None or t_from <= high[0]):
+            yield from (r for r in self.archive.scan(t_from, t_to) if _key(r) <= high)
+        yield from (r for r in self.hot.scan(t_from, t_to) if high is None or _key(r) > high)
+
+    def query(self, user_id=None, tag_id=None, op=None, dst_app=None,
+              t_from=None, t_to=None, after=None, limit=100) -> List[Record]:
+        kw = dict(user_id=user_id, tag_id=tag_id, op=op, dst_app=dst_app,
+                  t_from=t_from, t_to=t_to)
+        high = self.archive.high
+        rows = []
+        if high is not None and (after is None or tuple(after) < high):
+            rows = [r for r in self.archive.query(**kw, after=after, limit=limit)
+                    if _key(r) <= high]
+        if len(rows) < limit:
+            if high is not None and (after is None or tuple(after) < high):
+                after = high
+            rows += self.hot.query(**kw, after=after, limit=limit - len(rows))
+        return rows
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        seen = self.hot.destinations_for_user(user_id)
+        return seen + [d for d in self.archive.destinations_for_user(user_id) if d not in seen]
+
+
+class Archiver:
+    """
+    Every every_s seconds, moves events older than after_s from the hot
+    backend into the archive in runs of rows_per_file, deleting each run
+    from hot once its file and index entry are on disk.
+    """
+    def __init__(self, hot: ProvBackend, archive: ArchiveBackend, after_s: float,
+                 every_s: float = 3600.0, rows_per_file: int = 20_000):
+        self.hot = hot
+        self.archive = archive
+        self.after_s = after_s
+        self.every_s = every_s
+        self.rows_per_file = rows_per_file
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        """Archive everything older than after_s; returns events moved."""
+        cutoff = time.time() - self.after_s
+        moved = 0
+        # one archiver at a time per directory, also across processes
+        with self.archive.locked():
+            if self.archive.high is not None:
+                self.hot.drop_through(self.archive.high)    # leftovers of an interrupted run
+            while True:
+                rows = self.hot.query(t_to=cutoff, after=self.archive.high,
+                                      limit=self.rows_per_file)
+                if not rows:
+                    return moved
+                self.archive.write(rows)
+                self.hot.drop_through(self.archive.high)
+                moved += len(rows)
+
+    def _loop(self):
+        while not self._stop.wait(self.every_s):
+            try:
+                self.run_once()
+            except Exception:
+                pass    # hot rows stay put; retry next tick
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prov-archive",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
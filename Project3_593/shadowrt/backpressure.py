@@ -0,0 +1,127 @@
+"""
+Backpressure for provenance writes.
+
+ProvWriter moves appends off the request thread: log() queues the record
+(bounded by max_pending) and one background thread writes batches with
+backend.append_many. When the queue is full submit() refuses the record
+and log() writes it through itself: log() usually runs right after the
+app's own write has committed, so failing it there would leave data
+without provenance (or a charge a client then retries).
+
+AdmissionPolicy looks at the writer's live lag before a request starts
+and sheds non-critical requests with 503 + Retry-After while the store
+is behind, which is where load is turned away: before any side effect.
+Overloaded is also raised when a read that must see every queued event
+(ProvLogger.destinations_for_user) cannot flush the queue in time. Deletion traffic is always admitted, and deletion events
+bypass the queue entirely (written through, see ProvLogger.log).
+"""
+import time, math, threading, atexit
+from collections import deque
+from typing import Callable, Optional
+
+from .storage import ProvBackend, Record
+
+class Overloaded(Exception):
+    """The provenance store is behind; retry after retry_after_s seconds."""
+    def __init__(self, retry_after_s: int):
+        super().__init__(f"provenance writer overloaded, retry after {retry_after_s}s")
+        self.retry_after_s = retry_after_s
+
+
+class ProvWriter:
+    """Bounded queue of pending records plus the thread that drains it in batches."""
+    def __init__(self, backend: ProvBackend, max_pending: int = 10_000,
+                 batch_size: int = 500):
+        self.backend = backend
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.pending: deque = deque()
+        self.batch_s = 0.0          # moving average of one append_many call
+        self.errors = 0
+        self.overflow = 0           # records refused because the queue was full
+        self._submitted = 0
+        self._written = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="prov-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 5.0)
+
+    def submit(self, rec: Record) -> bool:
+        """Queue rec; False (nothing queued) when max_pending are already waiting."""
+        with self._cond:
+            if len(self.pending) >= self.max_pending:
+                self.overflow += 1
+                return False
+            self.pending.append(rec)
+            self._submitted += 1
+            self._cond.notify_all()
+            return True
+
+    def lag_s(self) -> float:
+        """Age of the oldest record not yet written."""
+        try:
+            return max(0.0, time.time() - self.pending[0][1])
+        except IndexError:
+            return 0.0
+
+    def retry_after_s(self) -> int:
+        return max(1, math.ceil(self.lag_s()))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything submitted so far is written."""
+        with self._cond:
+            target = self._submitted
+            return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending)
+                batch = [self.pending[i] for i in range(min(len(self.pending), self.batch_size))]
+            t0 = time.perf_counter()
+            try:
+                self.backend.append_many(batch)
+            except Exception:
+                # keep the batch queued (append_many ignores rows already
+                # written) and let the lag show it
+                self.errors += 1
+                time.sleep(0.1)
+                continue
+            dt = time.perf_counter() - t0
+            with self._cond:
+                for _ in batch:
+                    self.pending.popleft()
+                self._written += len(batch)
+                self.batch_s = 0.8 * self.batch_s + 0.2 * dt
+                self._cond.notify_all()
+
+
+def _default_critical(method: str, path: str) -> bool:
+    return method in ("DELETE", "OPTIONS") or path.startswith(("/delete", "/backpressure", "/admin"))
+
+
+class AdmissionPolicy:
+    """
+    Sheds a request before it starts when the provenance writer lags more
+    than max_lag_s, or its queue is more than max_fill full. Requests for
+    which critical(method, path) is true (by default deletions, CORS
+    preflights, /backpressure and /admin) are always admitted.
+    """
+    def __init__(self, max_lag_s: float = 1.0, max_fill: float = 0.8,
+                 critical: Callable[[str, str], bool] = _default_critical):
+        self.max_lag_s = max_lag_s
+        self.max_fill = max_fill
+        self.critical = critical
+        self.stats = {"admitted": 0, "shed": 0, "critical": 0}
+
+    def check(self, pressure: dict, method: str, path: str) -> Optional[int]:
+        """None to admit, else the Retry-After seconds for a 503."""
+        if self.critical(method, path):
+            self.stats["critical"] += 1
+            return None
+        full = pressure["max_pending"] and pressure["pending"] >= self.max_fill * pressure["max_pending"]
+        if pressure["lag_s"] > self.max_lag_s or full:
+            self.stats["shed"] += 1
+            return max(1, math.ceil(pressure["lag_s"]))
+        self.stats["admitted"] += 1
+        return None
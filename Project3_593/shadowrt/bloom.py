@@ -0,0 +1,30 @@
+import hashlib, math
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. No false negatives; the false
+    positive rate is roughly (1 - e^(-k*n/m))^k for n added keys.
+    """
+    def __init__(self, m_bits: int = 1 << 20, k: int = 7, bits: bytes | None = None):
+        self.m = m_bits
+        self.k = k
+        self.bits = bytearray(bits) if bits is not None else bytearray((m_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        d = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.m
+
+    def add(self, key: str) -> None:
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def expected_fp_rate(self) -> float:
+        return (1 - math.exp(-self.k * self.count / self.m)) ** self.k
@@ -0,0 +1,175 @@
+import sqlite3, time, threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from .migrate import ensure_schema
+
+_MISS = object()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_invalidations (
+  user_id TEXT PRIMARY KEY,
+  epoch INTEGER NOT NULL,
+  t REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_invalidations_epoch ON cache_invalidations(epoch);
+"""
+
+class LabelCache:
+    """
+    Bounded LRU + TTL cache keyed by (user_id, tag). Every entry is
+    indexed by its user so a deletion can drop all of them in one call.
+
+    With `path` set, invalidations are shared by every process caching
+    the same data (e.g. the workers of one app): each one is recorded in
+    that SQLite file under a rising epoch, and every get() first drops
+    the users invalidated elsewhere since the last epoch it saw. Records
+    older than the TTL are pruned, as nothing cached before them is left.
+    """
+    def __init__(self, maxsize: int = 1024, ttl_s: float = 30.0, path: Optional[str] = None):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.path = path
+        self._data: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self._by_user: dict[str, set] = {}
+        # epoch of each user's latest invalidation, newest last; at most maxsize
+        # of them, older ones only raise _floor
+        self._gen: OrderedDict[str, int] = OrderedDict()
+        self._floor = 0
+        self._epoch = 0         # newest invalidation seen, local or shared
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ready = False
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")     # get() never waits on a writer
+                ensure_schema(conn, SCHEMA)
+                self._ready = True
+        return conn
+
+    def _sync(self) -> None:
+        """Drop the users other processes invalidated since the last epoch seen."""
+        if self.path is None:
+            return
+        self._apply(self._conn().execute(
+            "SELECT user_id, epoch FROM cache_invalidations WHERE epoch>? ORDER BY epoch",
+            (self._epoch,),
+        ).fetchall())
+
+    def _apply(self, rows: list) -> None:
+        if rows:
+            with self._lock:
+                for user_id, epoch in rows:
+                    self._forget(user_id, epoch)
+
+    def _bump(self, user_id: str) -> Optional[int]:
+        """Record an invalidation of user_id and return its epoch (None without a path)."""
+        if self.path is None:
+            return None
+        c = self._conn()
+        now = time.time()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # catch up first, or taking the newest epoch would skip the ones before it
+            self._apply(c.execute("SELECT user_id, epoch FROM cache_invalidations "
+                                  "WHERE epoch>? ORDER BY epoch", (self._epoch,)).fetchall())
+            epoch = c.execute("SELECT COALESCE(MAX(epoch), 0) + 1 FROM cache_invalidations").fetchone()[0]
+            c.execute("INSERT INTO cache_invalidations(user_id,epoch,t) VALUES(?,?,?) "
+                      "ON CONFLICT(user_id) DO UPDATE SET epoch=excluded.epoch, t=excluded.t",
+                      (user_id, epoch, now))
+            # keep the newest record, so MAX(epoch) never goes back
+            c.execute("DELETE FROM cache_invalidations WHERE t<? AND epoch<?",
+                      (now - self.ttl_s, epoch))
+            c.commit()
+        except Exception:
+            c.rollback()
+            raise
+        return epoch
+
+    def get(self, user_id: str, tag: Hashable, default=None):
+        self._sync()
+        key = (user_id, tag)
+        with self._lock:
+            entry = self._data.get(key, _MISS)
+            if entry is _MISS or entry[0] < time.monotonic():
+                if entry is not _MISS:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, user_id: str) -> int:
+        """Token to pass to put() for a value about to be computed."""
+        self._sync()
+        return self._epoch
+
+    def put(self, user_id: str, tag: Hashable, value: Any,
+            generation: int | None = None) -> None:
+        """
+        Store a value. Pass the generation() read before computing it so a
+        result that raced with an invalidation is discarded, not cached.
+        """
+        key = (user_id, tag)
+        with self._lock:
+            if generation is not None and (generation < self._floor
+                                           or self._gen.get(user_id, 0) > generation):
+                return
+            self._data[key] = (time.monotonic() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, user_id: str, tag: Hashable) -> None:
+        """
+        Drop one entry (every entry of the user in other processes). Also
+        bumps the user's generation, so a read of the old value still in
+        flight doesn't put it back.
+        """
+        epoch = self._bump(user_id)
+        with self._lock:
+            self._note(user_id, epoch)
+            if (user_id, tag) in self._data:
+                self._drop((user_id, tag))
+
+    def invalidate_user(self, user_id: str) -> int:
+        """Drop every entry for this user; returns how many were dropped."""
+        epoch = self._bump(user_id)
+        with self._lock:
+            return self._forget(user_id, epoch)
+
+    def _note(self, user_id: str, epoch: Optional[int]):
+        if epoch is None:
+            epoch = self._epoch + 1
+        self._epoch = max(self._epoch, epoch)
+        self._gen[user_id] = epoch
+        self._gen.move_to_end(user_id)
+        while len(self._gen) > self.maxsize:
+            _, old = self._gen.popitem(last=False)
+            self._floor = max(self._floor, old)
+
+    def _forget(self, user_id: str, epoch: Optional[int]) -> int:
+        self._note(user_id, epoch)
+        keys = self._by_user.pop(user_id, set())
+        for k in keys:
+            self._data.pop(k, None)
+        return len(keys)
+
+    def _drop(self, key: tuple):
+        self._data.pop(key, None)
+        keys = self._by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[key[0]]
+
+    def __len__(self) -> int:
+        return len(self._data)
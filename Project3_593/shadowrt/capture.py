@@ -0,0 +1,141 @@
+"""
+Traffic capture for the FastAPI apps.
+
+CaptureMiddleware records every HTTP request/response pair and hands it
+to a CaptureWriter, which encodes and appends it to a JSONL file from a
+background thread. At most max_buffer exchanges wait in memory; past
+that new ones are dropped and counted, so a slow disk never stalls
+requests. Replay a capture with `python -m shadowrt.replay`.
+
+One line per exchange:
+    {"t", "app", "method", "path", "route", "query", "headers",
+     "body", "body_kind", "status", "response", "response_kind", "duration_ms"}
+
+Captures hold user data: top-level and nested JSON fields named in
+`redact` (billing_address by default) are replaced before writing.
+"""
+import json, time, base64, queue, threading, atexit
+from typing import Optional
+
+# request headers worth replaying; tracing and transport headers are not
+REPLAY_HEADERS = ("content-type", "x-shadow-label")
+REDACTED = "<redacted>"
+
+def _redact(obj, fields: tuple):
+    if isinstance(obj, dict):
+        return {k: REDACTED if k in fields else _redact(v, fields) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_redact(v, fields) for v in obj]
+    return obj
+
+def encode_body(data: bytes, redact: tuple = ()) -> tuple:
+    """(value, kind): parsed JSON, text, or base64 for anything else."""
+    if not data:
+        return None, "empty"
+    try:
+        return _redact(json.loads(data), redact), "json"
+    except ValueError:
+        pass
+    try:
+        return data.decode(), "text"
+    except UnicodeDecodeError:
+        return base64.b64encode(data).decode(), "b64"
+
+def decode_body(value, kind: str) -> bytes:
+    if kind == "json":
+        return json.dumps(value).encode()
+    if kind == "text":
+        return value.encode()
+    if kind == "b64":
+        return base64.b64decode(value)
+    return b""
+
+
+class CaptureWriter:
+    def __init__(self, path: str, max_buffer: int = 10_000,
+                 redact: tuple = ("billing_address",)):
+        self.path = path
+        self.redact = redact
+        self.written = 0
+        self.dropped = 0
+        self._q: queue.Queue = queue.Queue(maxsize=max_buffer)
+        self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, exchange: dict) -> None:
+        try:
+            self._q.put_nowait(exchange)
+        except queue.Full:
+            self.dropped += 1
+
+    def _encode(self, x: dict) -> str:
+        x["body"], x["body_kind"] = encode_body(x.pop("raw_body"), self.redact)
+        x["response"], x["response_kind"] = encode_body(x.pop("raw_response"), self.redact)
+        return json.dumps(x)
+
+    def _run(self):
+        with open(self.path, "a") as fh:
+            while True:
+                x = self._q.get()
+                while x is not None:
+                    fh.write(self._encode(x) + "\n")
+                    self.written += 1
+                    try:
+                        x = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                fh.flush()
+                if x is None:
+                    return
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout=5)
+
+
+class CaptureMiddleware:
+    """ASGI middleware feeding every HTTP exchange to a CaptureWriter."""
+    def __init__(self, app, writer: CaptureWriter, app_name: str = "",
+                 max_body: int = 64 * 1024):
+        self.app = app
+        self.writer = writer
+        self.app_name = app_name
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.time()
+        req, resp = bytearray(), bytearray()
+        status: list[Optional[int]] = [None]
+
+        async def recv():
+            msg = await receive()
+            if msg["type"] == "http.request" and len(req) < self.max_body:
+                req.extend(msg.get("body", b"")[: self.max_body - len(req)])
+            return msg
+
+        async def snd(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            elif msg["type"] == "http.response.body" and len(resp) < self.max_body:
+                resp.extend(msg.get("body", b"")[: self.max_body - len(resp)])
+            await send(msg)
+
+        try:
+            await self.app(scope, recv, snd)
+        finally:
+            headers = {k.decode().lower(): v.decode() for k, v in scope.get("headers") or []}
+            route = scope.get("route")
+            self.writer.put({
+                "t": t0, "app": self.app_name,
+                "method": scope["method"], "path": scope["path"],
+                "route": getattr(route, "path", None) or scope["path"],
+                "query": scope.get("query_string", b"").decode(),
+                "headers": {h: headers[h] for h in REPLAY_HEADERS if h in headers},
+                "raw_body": bytes(req), "raw_response": bytes(resp),
+                "status": status[0],
+                "duration_ms": (time.time() - t0) * 1000,
+            })
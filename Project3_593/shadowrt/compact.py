@@ -0,0 +1,131 @@
+"""
+v2 on-disk encoding of the SQLite provenance table.
+
+  - op / src_app / dst_app: integer codes into prov_ops / prov_apps
+  - event_id: 16-byte BLOB for ULIDs (32 for legacy sha256 hex ids)
+  - payload_hash: 32-byte BLOB
+  - tag_id: 16-byte UUID BLOB (+ any ".N" child suffix) for label tags;
+    other tags such as 'purchase:7' or '*' stay TEXT
+  - meta: NULL for '{}'
+
+Values that don't fit a binary form are stored as TEXT unchanged, so every
+field round-trips exactly. A `provenance` view with the old column names
+and text values keeps ad-hoc queries (inspect_db.py) working.
+"""
+import sqlite3, uuid, re
+
+from .ids import is_event_id, event_id_to_bytes, event_id_from_bytes
+from .migrate import statements
+
+_HEX64 = re.compile(r"[0-9a-f]{64}\Z")
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+V2_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prov_ops (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS prov_apps (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS provenance_v2 (
+  event_id BLOB PRIMARY KEY,
+  t_unix REAL NOT NULL,
+  op INTEGER NOT NULL REFERENCES prov_ops(id),
+  src_app INTEGER NOT NULL REFERENCES prov_apps(id),
+  dst_app INTEGER REFERENCES prov_apps(id),
+  user_id TEXT NOT NULL,
+  tag_id BLOB NOT NULL,
+  payload_hash BLOB NOT NULL,
+  meta TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_prov2_time ON provenance_v2(t_unix, event_id);
+CREATE INDEX IF NOT EXISTS idx_prov2_user ON provenance_v2(user_id, t_unix, event_id);
+CREATE INDEX IF NOT EXISTS idx_prov2_tag ON provenance_v2(tag_id, t_unix, event_id)
+"""
+
+# Old column names, text values. ULID event ids show as hex here.
+COMPAT_VIEW = """
+CREATE VIEW IF NOT EXISTS provenance AS
+SELECT
+  CASE WHEN typeof(p.event_id)='blob' THEN lower(hex(p.event_id)) ELSE p.event_id END AS event_id,
+  p.t_unix AS t_unix,
+  o.name AS op,
+  s.name AS src_app,
+  d.name AS dst_app,
+  p.user_id AS user_id,
+  CASE WHEN typeof(p.tag_id)='blob' THEN
+    lower(substr(hex(p.tag_id),1,8) || '-' || substr(hex(p.tag_id),9,4) || '-' ||
+          substr(hex(p.tag_id),13,4) || '-' || substr(hex(p.tag_id),17,4) || '-' ||
+          substr(hex(p.tag_id),21,12)) || CAST(substr(p.tag_id,17) AS TEXT)
+  ELSE p.tag_id END AS tag_id,
+  CASE WHEN typeof(p.payload_hash)='blob' THEN lower(hex(p.payload_hash)) ELSE p.payload_hash END AS payload_hash,
+  COALESCE(p.meta, '{}') AS meta
+FROM provenance_v2 p
+JOIN prov_ops o ON o.id = p.op
+JOIN prov_apps s ON s.id = p.src_app
+LEFT JOIN prov_apps d ON d.id = p.dst_app
+"""
+
+def enc_event_id(s: str):
+    if is_event_id(s):
+        return event_id_to_bytes(s)
+    if _HEX64.match(s):
+        return bytes.fromhex(s)
+    return s
+
+def dec_event_id(v) -> str:
+    if isinstance(v, bytes):
+        return event_id_from_bytes(v) if len(v) == 16 else v.hex()
+    return v
+
+def enc_hash(s: str):
+    return bytes.fromhex(s) if _HEX64.match(s) else s
+
+def dec_hash(v) -> str:
+    return v.hex() if isinstance(v, bytes) else v
+
+def enc_tag(s: str):
+    if _UUID.match(s):
+        return uuid.UUID(s[:36]).bytes + s[36:].encode()
+    return s
+
+def dec_tag(v) -> str:
+    if isinstance(v, bytes):
+        return str(uuid.UUID(bytes=v[:16])) + v[16:].decode()
+    return v
+
+def enc_meta(s: str):
+    return None if s == "{}" else s
+
+def dec_meta(v) -> str:
+    return "{}" if v is None else v
+
+
+def migrate_v2(conn: sqlite3.Connection) -> None:
+    """
+    One-shot, in-place conversion of a v1 `provenance` table to v2.
+    Runs inside apply_migrations' transaction.
+    """
+    for stmt in statements(V2_SCHEMA):
+        conn.execute(stmt)
+    conn.execute("INSERT OR IGNORE INTO prov_ops(name) SELECT DISTINCT op FROM provenance")
+    conn.execute(
+        "INSERT OR IGNORE INTO prov_apps(name) "
+        "SELECT src_app FROM provenance UNION "
+        "SELECT dst_app FROM provenance WHERE dst_app IS NOT NULL"
+    )
+    ops = dict(conn.execute("SELECT name, id FROM prov_ops").fetchall())
+    apps = dict(conn.execute("SELECT name, id FROM prov_apps").fetchall())
+
+    cur = conn.execute(
+        "SELECT event_id,t_unix,op,src_app,dst_app,user_id,tag_id,payload_hash,meta "
+        "FROM provenance"
+    )
+    while True:
+        rows = cur.fetchmany(10_000)
+        if not rows:
+            break
+        conn.executemany(
+            "INSERT INTO provenance_v2 VALUES(?,?,?,?,?,?,?,?,?)",
+            [(enc_event_id(e), t, ops[op], apps[src], None if dst is None else apps[dst],
+              u, enc_tag(tag), enc_hash(h), enc_meta(m))
+             for e, t, op, src, dst, u, tag, h, m in rows],
+        )
+    conn.execute("DROP TABLE provenance")
+    conn.execute(COMPAT_VIEW)
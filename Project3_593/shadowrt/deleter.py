@@ -0,0 +1,50 @@
+import sqlite3, time
+from contextlib import closing
+from typing import Callable, Optional
+
+class ChunkedDeleter:
+    """
+    Deletes one user's rows from a table in bounded batches by primary-key
+    range. Each batch is its own short transaction, so other writers can
+    grab the SQLite write lock in between instead of waiting for one big DELETE.
+    """
+    def __init__(self, connect: Callable[[], sqlite3.Connection],
+                 batch_size: int = 500, pause_s: float = 0.01,
+                 progress: Optional[Callable[[str, int, int], None]] = None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        self.connect = connect
+        self.batch_size = batch_size
+        self.pause_s = pause_s
+        self.progress = progress      # called as progress(table, batch_rows, total_rows)
+        self.deleted = 0
+        self.batches = 0
+
+    def delete(self, table: str, user_id: str,
+               key: str = "id", user_col: str = "user_id") -> int:
+        """Delete every row of `table` owned by user_id; returns rows removed."""
+        total = 0
+        while True:
+            with closing(self.connect()) as conn, conn:
+                ids = conn.execute(
+                    f"SELECT {key} FROM {table} WHERE {user_col}=? "
+                    f"ORDER BY {key} LIMIT ?",
+                    (user_id, self.batch_size),
+                ).fetchall()
+                if not ids:
+                    break
+                cur = conn.execute(
+                    f"DELETE FROM {table} WHERE {user_col}=? AND {key} BETWEEN ? AND ?",
+                    (user_id, ids[0][0], ids[-1][0]),
+                )
+                conn.commit()
+            total += cur.rowcount
+            self.deleted += cur.rowcount
+            self.batches += 1
+            if self.progress:
+                self.progress(table, cur.rowcount, total)
+            if len(ids) < self.batch_size:
+                break
+            if self.pause_s:
+                time.sleep(self.pause_s)
+        return total
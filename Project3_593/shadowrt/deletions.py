@@ -0,0 +1,120 @@
+import sqlite3, time, math
+from typing import Optional, List
+
+from .migrate import ensure_schema
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS open_deletions (
+  user_id TEXT NOT NULL,
+  dst_app TEXT NOT NULL,       -- '' for local-only requests
+  t_request REAL NOT NULL,
+  PRIMARY KEY (user_id, dst_app)
+);
+CREATE INDEX IF NOT EXISTS idx_open_deletions_t ON open_deletions(t_request);
+
+-- completion latency per destination as a log2(ms) histogram
+CREATE TABLE IF NOT EXISTS deletion_latency (
+  dst_app TEXT NOT NULL,
+  bucket INTEGER NOT NULL,
+  n INTEGER NOT NULL,
+  sum_s REAL NOT NULL,
+  max_s REAL NOT NULL,
+  PRIMARY KEY (dst_app, bucket)
+);
+"""
+
+def _bucket(latency_s: float) -> int:
+    return int(math.log2(max(latency_s, 0.0) * 1000 + 1))
+
+def _bucket_upper_s(bucket: int) -> float:
+    return (2 ** (bucket + 1) - 1) / 1000.0
+
+def _percentile(sorted_vals: List[float], p: float) -> float:
+    i = min(len(sorted_vals) - 1, max(0, math.ceil(p / 100 * len(sorted_vals)) - 1))
+    return sorted_vals[i]
+
+
+class DeletionTracker:
+    """
+    Pairs delete_request with delete_done as they are logged. A request
+    opens a (user_id, dst_app) row in open_deletions, the matching done
+    closes it and adds its latency to a per-destination histogram, so
+    SLA questions never touch the provenance log itself.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with sqlite3.connect(self.db_path) as c:
+            ensure_schema(c, SCHEMA)
+
+    def on_event(self, op: str, user_id: str, dst_app: Optional[str], t_unix: float):
+        dst = dst_app or ""
+        with sqlite3.connect(self.db_path) as c:
+            if op == "delete_request":
+                # a retry keeps the original request time
+                c.execute(
+                    "INSERT OR IGNORE INTO open_deletions(user_id,dst_app,t_request) VALUES(?,?,?)",
+                    (user_id, dst, t_unix),
+                )
+            elif op == "delete_done":
+                row = c.execute(
+                    "SELECT t_request FROM open_deletions WHERE user_id=? AND dst_app=?",
+                    (user_id, dst),
+                ).fetchone()
+                if row is None:
+                    return      # e.g. the receiving side's own delete_done
+                lat = t_unix - row[0]
+                c.execute("DELETE FROM open_deletions WHERE user_id=? AND dst_app=?",
+                          (user_id, dst))
+                c.execute(
+                    "INSERT INTO deletion_latency(dst_app,bucket,n,sum_s,max_s) VALUES(?,?,1,?,?) "
+                    "ON CONFLICT(dst_app,bucket) DO UPDATE SET n=n+1, sum_s=sum_s+excluded.sum_s, "
+                    "max_s=MAX(max_s, excluded.max_s)",
+                    (dst, _bucket(lat), lat, lat),
+                )
+            c.commit()
+
+    def outstanding(self, older_than_s: float = 0.0, limit: int = 100) -> List[dict]:
+        """Open deletions, oldest first."""
+        now = time.time()
+        with sqlite3.connect(self.db_path) as c:
+            rows = c.execute(
+                "SELECT user_id,dst_app,t_request FROM open_deletions "
+                "WHERE t_request<=? ORDER BY t_request LIMIT ?",
+                (now - older_than_s, limit),
+            ).fetchall()
+        return [{"user_id": u, "dst_app": d or None, "t_request": t, "age_s": now - t}
+                for u, d, t in rows]
+
+    def metrics(self, percentiles=(50, 90, 99)) -> dict:
+        now = time.time()
+        with sqlite3.connect(self.db_path) as c:
+            ages = [now - t for (t,) in c.execute(
+                "SELECT t_request FROM open_deletions ORDER BY t_request DESC")]
+            hist = c.execute(
+                "SELECT dst_app,bucket,n,sum_s,max_s FROM deletion_latency "
+                "ORDER BY dst_app,bucket").fetchall()
+
+        out = {"open": len(ages)}
+        for p in percentiles:
+            out[f"open_age_p{p}_s"] = _percentile(ages, p) if ages else None
+
+        dests = {}
+        for dst, bucket, n, sum_s, max_s in hist:
+            d = dests.setdefault(dst or None, {"completed": 0, "sum_s": 0.0, "max_s": 0.0, "_h": []})
+            d["completed"] += n
+            d["sum_s"] += sum_s
+            d["max_s"] = max(d["max_s"], max_s)
+            d["_h"].append((bucket, n))
+        for d in dests.values():
+            d["mean_s"] = d.pop("sum_s") / d["completed"]
+            h = d.pop("_h")
+            for p in percentiles:
+                # upper edge of the bucket holding the p-th completion, capped at max
+                need, seen = math.ceil(p / 100 * d["completed"]), 0
+                for bucket, n in h:
+                    seen += n
+                    if seen >= need:
+                        d[f"p{p}_s"] = min(_bucket_upper_s(bucket), d["max_s"])
+                        break
+        out["destinations"] = dests
+        return out
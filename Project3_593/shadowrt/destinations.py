@@ -0,0 +1,197 @@
+"""
+Registry of the apps a service ships labeled data to, loaded from config.
+
+    {
+      "PayPal": {
+        "transport": "${PAYPAL_TRANSPORT:-http}",   # http | asgi | local
+        "url": "${PAYPAL_URL:-http://127.0.0.1:8001}",
+        "asgi": "paypal.app:app",                   # the peer's ASGI app
+        "local": "paypal.app:local",                # the peer's LocalTransport
+        "send": "POST /charge",
+        "send_batch": "POST /charge_batch",         # optional
+        "delete": "DELETE /delete_by_user/{user_id}",
+        "timeout_s": 5,
+        "max_concurrency": 8,
+        "batch_size": 50
+      }
+    }
+
+String values may use ${VAR} / ${VAR:-default}. rt.send() routes a sink
+through its destination and rt.delete_remote() fans a deletion out to
+every registered destination holding the user's data, so a new
+destination is a config entry, not code.
+
+Each destination gets one transport (HTTP keeps a connection pool sized
+to max_concurrency; asgi/local import the peer on first use), a budget
+of max_concurrency requests in flight (callers past it wait up to
+timeout_s, then get TransportError 503), and send_many(), which ships
+up to batch_size items per request when a send_batch route is configured.
+A batch is not atomic: the peer answers per item, and send_many() hands
+back a TransportError in place of each item it rejected.
+
+Registry.load() reads its file on first lookup, so building a runtime at
+import touches no disk.
+"""
+import importlib, json, os, re, threading
+from typing import Any, Dict, List, Optional
+
+from .labels import Labeled
+from .transport import Transport, TransportError, HTTPTransport, ASGITransport
+
+_VAR = re.compile(r"\$\{(\w+)(?::-([^}]*))?\}")
+
+def _expand(value):
+    if isinstance(value, str):
+        return _VAR.sub(lambda m: os.environ.get(m.group(1), m.group(2) or ""), value)
+    return value
+
+def _resolve(ref: str):
+    """'package.module:attr' -> the object."""
+    module, _, attr = ref.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+
+class Destination:
+    def __init__(self, name: str, transport: str = "http", url: Optional[str] = None,
+                 asgi: Optional[str] = None, local: Optional[str] = None,
+                 send: Optional[str] = None, send_batch: Optional[str] = None,
+                 delete: Optional[str] = None, timeout_s: float = 5.0,
+                 max_concurrency: int = 8, batch_size: int = 50):
+        self.name = name
+        self.kind = transport
+        self.url, self.asgi, self.local = url, asgi, local
+        self.routes = {"send": send, "send_batch": send_batch, "delete": delete}
+        self.timeout_s = float(timeout_s)
+        self.max_concurrency = int(max_concurrency)
+        self.batch_size = max(1, int(batch_size))
+        self.stats = {"sent": 0, "batches": 0, "deleted": 0, "errors": 0, "budget_waits": 0}
+        self._budget = threading.BoundedSemaphore(self.max_concurrency)
+        self._transport: Optional[Transport] = None
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self) -> Transport:
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = self._connect()
+        return self._transport
+
+    def _connect(self) -> Transport:
+        if self.kind == "http":
+            return HTTPTransport(self.url, self.timeout_s, pool_size=self.max_concurrency)
+        if self.kind == "asgi":
+            return ASGITransport(_resolve(self.asgi))
+        if self.kind == "local":
+            return _resolve(self.local)
+        raise ValueError(f"{self.name}: unknown transport {self.kind!r}")
+
+    def call(self, route: str, labeled=None, **params) -> Any:
+        """One request on a configured route, within the concurrency budget."""
+        spec = self.routes[route]
+        if spec is None:
+            raise TransportError(404, f"{self.name} has no {route} route")
+        method, path = spec.split(None, 1)
+        if not self._budget.acquire(blocking=False):
+            self.stats["budget_waits"] += 1
+            if not self._budget.acquire(timeout=self.timeout_s):
+                self.stats["errors"] += 1
+                raise TransportError(503, f"{self.name}: {self.max_concurrency} requests already in flight")
+        try:
+            return self.transport.request(method, path.format(**params), labeled)
+        except TransportError:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self._budget.release()
+
+    def send(self, labeled: Labeled) -> Any:
+        result = self.call("send", labeled)
+        self.stats["sent"] += 1
+        return result
+
+    def send_many(self, labeled: List[Labeled]) -> List[Any]:
+        """
+        Ship several items, batch_size per request on the send_batch route,
+        or one by one without it. One result per item, in order; an item
+        the peer rejected gets a TransportError instead. A request that
+        fails as a whole raises.
+        """
+        if self.routes["send_batch"] is None or len(labeled) == 1:
+            results = []
+            for l in labeled:
+                try:
+                    results.append(self.send(l))
+                except TransportError as e:
+                    if not 400 <= e.status < 500:      # the peer or the link, not the item
+                        raise
+                    results.append(e)
+            return results
+        results = []
+        for i in range(0, len(labeled), self.batch_size):
+            chunk = labeled[i:i + self.batch_size]
+            out = self.call("send_batch", chunk)
+            if len(out) != len(chunk):
+                self.stats["errors"] += 1
+                raise TransportError(502, f"{self.name}: {len(out)} results for {len(chunk)} items")
+            for r in out:
+                if isinstance(r, dict) and r.get("ok") is False:
+                    self.stats["errors"] += 1
+                    results.append(TransportError(r.get("status", 400), r.get("error", "")))
+                else:
+                    results.append(r)
+            self.stats["sent"] += len(chunk)
+            self.stats["batches"] += 1
+        return results
+
+    def delete(self, user_id: str) -> Any:
+        receipt = self.call("delete", user_id=user_id)
+        self.stats["deleted"] += 1
+        return receipt
+
+
+class Registry:
+    """dst_app name -> Destination."""
+    def __init__(self, destinations: Optional[Dict[str, Destination]] = None,
+                 path: Optional[str] = None):
+        self._destinations = destinations
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def destinations(self) -> Dict[str, Destination]:
+        if self._destinations is None:
+            with self._lock:
+                if self._destinations is None:
+                    if self.path is None:
+                        self._destinations = {}
+                    else:
+                        with open(self.path) as fh:
+                            self._destinations = self.from_config(json.load(fh))._destinations
+        return self._destinations
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Registry":
+        return cls({name: Destination(name, **{k: _expand(v) for k, v in spec.items()})
+                    for name, spec in config.items()})
+
+    @classmethod
+    def load(cls, path: str) -> "Registry":
+        """The registry in a JSON config file, read on first use."""
+        return cls(path=path)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.destinations
+
+    def __getitem__(self, name: str) -> Destination:
+        try:
+            return self.destinations[name]
+        except KeyError:
+            raise KeyError(f"no destination {name!r} registered") from None
+
+    def __iter__(self):
+        return iter(self.destinations.values())
+
+    def stats(self) -> dict:
+        return {d.name: {"transport": d.kind, "max_concurrency": d.max_concurrency,
+                         "batch_size": d.batch_size, **d.stats} for d in self}
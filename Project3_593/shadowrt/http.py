@@ -0,0 +1,166 @@
+import base64, json, hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from .storage import COLUMNS
+from .trace import TRACE_HEADER
+
+MAX_PAGE = 1000
+
+def encode_cursor(t_unix: float, event_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([t_unix, event_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        t, eid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(t), str(eid)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Bad cursor")
+
+class TraceMiddleware:
+    """ASGI middleware: one trace span per HTTP request."""
+    def __init__(self, app, rt):
+        self.app = app
+        self.rt = rt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = dict(scope.get("headers") or []).get(TRACE_HEADER.encode())
+        with self.rt.span(f"{scope['method']} {scope['path']}",
+                          header.decode() if header else None):
+            await self.app(scope, receive, send)
+
+class ProfileMiddleware:
+    """ASGI middleware: sampled requests become profiler roots named by route."""
+    def __init__(self, app, rt):
+        self.app = app
+        self.rt = rt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        with self.rt.profiler.request(f"{scope['method']} {scope['path']}") as sample:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = scope.get("route")
+                if sample is not None and route is not None:
+                    sample.root = f"{scope['method']} {route.path}"     # /purchases/{user_id}
+
+class AdmissionMiddleware:
+    """ASGI middleware: 503 + Retry-After for requests rt.admission sheds."""
+    def __init__(self, app, rt):
+        self.app = app
+        self.rt = rt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            retry = self.rt.admission.check(self.rt.log.pressure(), scope["method"], scope["path"])
+            if retry is not None:
+                resp = _overloaded_response(retry)
+                return await resp(scope, receive, send)
+        await self.app(scope, receive, send)
+
+def _overloaded_response(retry_after_s: int) -> JSONResponse:
+    return JSONResponse({"detail": "Provenance store is behind, retry later"},
+                        status_code=503, headers={"Retry-After": str(retry_after_s)})
+
+async def overloaded_handler(request, exc):
+    """Exception handler for backpressure.Overloaded (a provenance lookup that couldn't flush)."""
+    return _overloaded_response(exc.retry_after_s)
+
+def provenance_router(rt) -> APIRouter:
+    """Read-only provenance/deletion API for a ShadowRuntime (see ShadowRuntime.mount)."""
+    router = APIRouter()
+
+    @router.get("/provenance")
+    def provenance(user_id: Optional[str] = None, tag_id: Optional[str] = None,
+                   op: Optional[str] = None, dst_app: Optional[str] = None,
+                   t_from: Optional[float] = None, t_to: Optional[float] = None,
+                   cursor: Optional[str] = None,
+                   limit: int = Query(100, ge=1, le=MAX_PAGE)):
+        """
+        Provenance events ordered by (t_unix, event_id). Pass next_cursor
+        back as cursor to get the following page.
+        """
+        rows = rt.log.reader.query(
+            user_id=user_id, tag_id=tag_id, op=op, dst_app=dst_app,
+            t_from=t_from, t_to=t_to,
+            after=decode_cursor(cursor) if cursor else None,
+            limit=limit + 1,
+        )
+        more = len(rows) > limit
+        rows = rows[:limit]
+        events = []
+        for r in rows:
+            e = dict(zip(COLUMNS, r))
+            e["meta"] = json.loads(e["meta"])
+            events.append(e)
+        return {
+            "events": events,
+            "next_cursor": encode_cursor(rows[-1][1], rows[-1][0]) if more else None,
+        }
+
+    @router.get("/deletions/open")
+    def open_deletions(older_than_s: float = 0.0, limit: int = Query(100, ge=1, le=MAX_PAGE)):
+        """Deletions requested but not yet confirmed done, oldest first."""
+        return {"open": rt.log.deletions.outstanding(older_than_s, limit)}
+
+    @router.get("/deletions/metrics")
+    def deletion_metrics():
+        """Outstanding count, age percentiles and per-destination completion latency."""
+        return rt.log.deletions.metrics()
+
+    @router.get("/backpressure")
+    def backpressure():
+        """Provenance writer lag and queue depth, plus admission counters."""
+        out = rt.log.pressure()
+        if rt.admission is not None:
+            out["admission"] = dict(rt.admission.stats)
+        return out
+
+    @router.get("/destinations")
+    def destinations():
+        """Registered destinations: transport, limits, send/delete/error counters."""
+        return rt.destinations.stats()
+
+    return router
+
+def require_admin(rt):
+    """
+    Dependency for admin routes: the X-Admin-Token header must match
+    rt.admin_token. Without a token configured the routes are disabled.
+    """
+    def check(x_admin_token: Optional[str] = Header(None)):
+        if not rt.admin_token:
+            raise HTTPException(status_code=403, detail="Admin API disabled (no admin token set)")
+        if x_admin_token is None or not hmac.compare_digest(x_admin_token, rt.admin_token):
+            raise HTTPException(status_code=401, detail="Bad admin token")
+    return check
+
+def profile_router(rt) -> APIRouter:
+    """Live control of rt.profiler: sample rate, collapsed-stack dump, reset. Admin only."""
+    router = APIRouter(dependencies=[Depends(require_admin(rt))])
+
+    @router.get("/admin/profile", response_class=PlainTextResponse)
+    def profile_dump(metric: str = Query("wall", pattern="^(wall|cpu)$")):
+        """Collapsed stacks (microseconds of self time) for flamegraph.pl or speedscope."""
+        return rt.profiler.collapsed(metric)
+
+    @router.get("/admin/profile/stats")
+    def profile_stats():
+        return rt.profiler.stats()
+
+    @router.put("/admin/profile")
+    def profile_rate(sample_rate: float = Query(..., ge=0.0, le=1.0)):
+        rt.profiler.sample_rate = sample_rate
+        return rt.profiler.stats()
+
+    @router.delete("/admin/profile")
+    def profile_reset():
+        rt.profiler.reset()
+        return rt.profiler.stats()
+
+    return router
@@ -0,0 +1,57 @@
+import random, time, threading
+
+# Crockford base32: sorts the same as the numbers it encodes
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RAND_BITS = 80
+# two base32 digits per lookup: 13 steps for the 130-bit (26-char) id
+_PAIRS = [a + b for a in _ALPHABET for b in _ALPHABET]
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_rand = 0
+
+def new_event_id(t_unix: float | None = None) -> str:
+    """
+    26-char ULID: 48-bit millisecond timestamp + 80 random bits. Ids made
+    in the same millisecond increment the random part, so they are unique
+    and strictly increasing within a process and sort by time as text.
+    """
+    global _last_ms, _last_rand
+    ms = int((time.time() if t_unix is None else t_unix) * 1000)
+    with _lock:
+        if ms <= _last_ms:
+            ms = _last_ms           # clock went backwards or same tick: stay monotonic
+            rand = _last_rand + 1
+            if rand >> _RAND_BITS:   # random part exhausted; borrow the next ms
+                ms, rand = ms + 1, random.getrandbits(_RAND_BITS - 1)
+        else:
+            # top bit clear leaves room to increment within the tick
+            rand = random.getrandbits(_RAND_BITS - 1)
+        _last_ms, _last_rand = ms, rand
+    n = (ms << _RAND_BITS) | rand
+    p = _PAIRS
+    return "".join([p[(n >> 120) & 1023], p[(n >> 110) & 1023], p[(n >> 100) & 1023],
+                    p[(n >> 90) & 1023], p[(n >> 80) & 1023], p[(n >> 70) & 1023],
+                    p[(n >> 60) & 1023], p[(n >> 50) & 1023], p[(n >> 40) & 1023],
+                    p[(n >> 30) & 1023], p[(n >> 20) & 1023], p[(n >> 10) & 1023],
+                    p[n & 1023]])
+
+def event_id_time(event_id: str) -> float:
+    """Unix time (seconds, ms precision) encoded in an id from new_event_id()."""
+    n = 0
+    for ch in event_id:
+        n = (n << 5) | _ALPHABET.index(ch)
+    return (n >> _RAND_BITS) / 1000.0
+
+_TO_INT32 = str.maketrans(_ALPHABET, "0123456789abcdefghijklmnopqrstuv")
+
+def is_event_id(s: str) -> bool:
+    return len(s) == 26 and s[0] in "01234567" and all(c in _ALPHABET for c in s)
+
+def event_id_to_bytes(event_id: str) -> bytes:
+    """16-byte big-endian form; byte order sorts like the text form."""
+    return int(event_id.translate(_TO_INT32), 32).to_bytes(16, "big")
+
+def event_id_from_bytes(b: bytes) -> str:
+    n, p = int.from_bytes(b, "big"), _PAIRS
+    return "".join([p[(n >> s) & 1023] for s in range(120, -1, -10)])
@@ -0,0 +1,279 @@
+import sqlite3, time, json, os, threading, logging
+from typing import Callable, Optional
+
+from .migrate import ensure_schema
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  state TEXT NOT NULL,       -- 'queued','running','done','failed'
+  payload TEXT NOT NULL,
+  result TEXT,
+  error TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  run_after REAL NOT NULL,
+  created REAL NOT NULL,
+  updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, run_after);
+"""
+
+MIGRATIONS = [
+    # whose data a job carries, so an erasure can cancel it (cancel_user)
+    (1, """
+ALTER TABLE jobs ADD COLUMN user_id TEXT;
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, state);
+"""),
+    # until when the process running a job owns it; expired leases are requeued
+    (2, "ALTER TABLE jobs ADD COLUMN lease_until REAL"),
+]
+
+class JobQueue:
+    """
+    Durable SQLite-backed job queue drained by a pool of worker threads.
+    `handler(payload) -> result` runs for each job; failures are retried
+    with exponential backoff up to max_attempts. The pool size is the
+    concurrency limit towards whatever the handler calls.
+
+    With batched=True (the default when batch_size > 1) a worker claims up
+    to batch_size ready jobs at once and `handler(payloads) -> results`
+    gets them as a list. It must return one result per payload, in order;
+    an Exception in place of a result fails (and retries) just that job.
+    If the handler raises, or returns the wrong number of results, every
+    job in the batch is retried, so handlers should be idempotent.
+
+    Payloads may hold personal data: a job enqueued with a user_id is
+    dropped by cancel_user(), a finished job keeps only its result, and
+    with retention_s set the workers purge done/failed jobs older than that.
+
+    Several processes may share one queue file. A claimed job is leased
+    for lease_s and the lease is renewed while it runs; a job whose lease
+    ran out (its process died) is claimed again by whoever gets there first.
+    """
+    def __init__(self, db_path: str, handler: Callable,
+                 workers: int = 4, max_attempts: int = 5,
+                 backoff_s: float = 1.0, poll_s: float = 0.2, batch_size: int = 1,
+                 batched: Optional[bool] = None, retention_s: Optional[float] = None,
+                 lease_s: float = 60.0):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batched = batch_size > 1 if batched is None else batched
+        self.max_attempts = max_attempts
+        self.backoff_s = backoff_s
+        self.poll_s = poll_s
+        self.retention_s = retention_s
+        self.lease_s = lease_s
+        self._purged = 0.0
+        self._held: set[int] = set()
+        self._held_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._ready = False
+        self._ready_lock = threading.Lock()
+
+    def _open(self):
+        """Schema and crash recovery, once, on first use instead of at construction."""
+        with self._ready_lock:
+            if self._ready:
+                return
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            with sqlite3.connect(self.db_path, timeout=30) as c:
+                ensure_schema(c, SCHEMA, MIGRATIONS)
+                # jobs whose process died mid-flight get another go; jobs another
+                # live process is running keep their lease
+                c.execute("UPDATE jobs SET state='queued' WHERE state='running' "
+                          "AND (lease_until IS NULL OR lease_until<?)", (time.time(),))
+                c.commit()
+            self._ready = True
+
+    def _conn(self):
+        if not self._ready:
+            self._open()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, payload: dict, user_id: Optional[str] = None) -> int:
+        now = time.time()
+        with self._conn() as c:
+            cur = c.execute(
+                "INSERT INTO jobs(state,payload,user_id,run_after,created,updated) "
+                "VALUES('queued',?,?,?,?,?)",
+                (json.dumps(payload), user_id, now, now, now),
+            )
+            c.commit()
+        self._wake.set()
+        return cur.lastrowid
+
+    def status(self, job_id: int) -> Optional[dict]:
+        with self._conn() as c:
+            r = c.execute(
+                "SELECT id,state,result,error,attempts,created,updated FROM jobs WHERE id=?",
+                (job_id,),
+            ).fetchone()
+        if r is None:
+            return None
+        d = dict(r)
+        d["result"] = json.loads(d["result"]) if d["result"] else None
+        return d
+
+    def cancel_user(self, user_id: str, timeout: float = 30.0) -> int:
+        """
+        Delete every job carrying user_id's data. Jobs a worker is still
+        running (lease not expired) are waited for (they may be shipping the data right now,
+        and whatever they send must be logged before the caller fans the
+        erasure out), then deleted too. Returns the number of jobs removed;
+        raises TimeoutError if some are still running after `timeout`.
+        """
+        deadline = time.time() + timeout
+        removed = 0
+        while True:
+            with self._conn() as c:
+                removed += c.execute(
+                    "DELETE FROM jobs WHERE user_id=? AND (state!='running' "
+                    "OR lease_until IS NULL OR lease_until<?)", (user_id, time.time())
+                ).rowcount
+                running = c.execute(
+                    "SELECT count(*) FROM jobs WHERE user_id=? AND state='running'", (user_id,)
+                ).fetchone()[0]
+                c.commit()
+            if not running:
+                return removed
+            if time.time() >= deadline:
+                raise TimeoutError(f"{running} job(s) for {user_id} still running")
+            time.sleep(min(self.poll_s, 0.05))
+
+    def purge(self, older_than_s: float) -> int:
+        """Delete done/failed jobs last updated more than older_than_s ago."""
+        with self._conn() as c:
+            n = c.execute(
+                "DELETE FROM jobs WHERE state IN ('done','failed') AND updated<?",
+                (time.time() - older_than_s,),
+            ).rowcount
+            c.commit()
+        return n
+
+    def _claim(self) -> list:
+        # BEGIN IMMEDIATE takes the write lock before the SELECT, so no other
+        # thread or process can claim the same rows in between
+        with self._conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            rows = c.execute(
+                "SELECT * FROM jobs WHERE (state='queued' AND run_after<=?) "
+                "OR (state='running' AND lease_until<?) ORDER BY id LIMIT ?",
+                (now, now, self.batch_size),
+            ).fetchall()
+            if rows:
+                c.executemany(
+                    "UPDATE jobs SET state='running', attempts=attempts+1, lease_until=?, "
+                    "updated=? WHERE id=?",
+                    [(now + self.lease_s, now, r["id"]) for r in rows],
+                )
+            c.commit()
+        with self._held_lock:
+            self._held.update(r["id"] for r in rows)
+        return rows
+
+    def renew_leases(self) -> int:
+        """Extend the lease of every job this queue is running; returns how many."""
+        with self._held_lock:
+            held = list(self._held)
+        if not held:
+            return 0
+        with self._conn() as c:
+            n = c.execute(
+                f"UPDATE jobs SET lease_until=? WHERE state='running' "
+                f"AND id IN ({','.join('?' * len(held))})",
+                [time.time() + self.lease_s, *held],
+            ).rowcount
+            c.commit()
+        return n
+
+    def _finish(self, job: sqlite3.Row, result=None, error: Optional[str] = None):
+        now = time.time()
+        with self._conn() as c:
+            if error is None:
+                # the payload is no longer needed once the job has succeeded
+                c.execute("UPDATE jobs SET state='done', payload='{}', result=?, error=NULL, "
+                          "updated=? WHERE id=?",
+                          (json.dumps(result), now, job["id"]))
+            elif job["attempts"] + 1 >= self.max_attempts:
+                c.execute("UPDATE jobs SET state='failed', error=?, updated=? WHERE id=?",
+                          (error, now, job["id"]))
+            else:
+                retry_at = now + self.backoff_s * (2 ** job["attempts"])
+                c.execute("UPDATE jobs SET state='queued', error=?, run_after=?, updated=? WHERE id=?",
+                          (error, retry_at, now, job["id"]))
+            c.commit()
+
+    def run_once(self) -> bool:
+        """Process one ready job (or batch) on the calling thread; False if none was ready."""
+        jobs = self._claim()
+        if not jobs:
+            return False
+        try:
+            payloads = [json.loads(job["payload"]) for job in jobs]
+            try:
+                results = (self.handler(payloads) if self.batched
+                           else [self.handler(payloads[0])])
+                if len(results) != len(jobs):
+                    raise ValueError(f"handler returned {len(results)} results for {len(jobs)} jobs")
+            except Exception as e:
+                for job in jobs:
+                    self._finish(job, error=f"{type(e).__name__}: {e}")
+            else:
+                for job, result in zip(jobs, results):
+                    if isinstance(result, Exception):
+                        self._finish(job, error=f"{type(result).__name__}: {result}")
+                    else:
+                        self._finish(job, result=result)
+        finally:
+            # a job we could not finish is left to expire and be claimed again
+            with self._held_lock:
+                self._held.difference_update(job["id"] for job in jobs)
+        return True
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                if self.retention_s is not None and time.time() - self._purged >= min(self.retention_s, 60):
+                    self._purged = time.time()
+                    self.purge(self.retention_s)
+                if self.run_once():
+                    continue
+            except Exception:
+                # e.g. "database is locked" past the timeout; the thread must outlive it
+                log.exception("job queue worker error")
+            self._wake.wait(self.poll_s)
+            self._wake.clear()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_s / 3):
+            try:
+                self.renew_leases()
+            except Exception:
+                log.exception("job queue lease renewal failed")
+
+    def start(self):
+        self._open()
+        self._stop.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"jobqueue-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat, name="jobqueue-lease", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
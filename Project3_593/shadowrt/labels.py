@@ -9,18 +9,33 @@ T = TypeVar("T")
 # Current user context
 current_user: ContextVar[str | None] = ContextVar("current_user", default=None)
 
+# Policy values from least to most strict; derive_label keeps the strictest
+POLICY_STRICTNESS = {
+    "delete_policy": ["retain", "delete_on_request", "delete_all_user_data"],
+}
+
 @dataclass(frozen=True)
 class Label:
     user_id: str
     tag_id: str
     policies: dict
+    parents: tuple = ()     # tag_ids this label was derived from
+    users: tuple = ()       # every data subject, when derived from several users
+
+    def all_users(self) -> tuple:
+        return self.users or (self.user_id,)
 
     def to_header(self) -> str:
-        return json.dumps({
+        d = {
             "user_id": self.user_id,
             "tag_id": self.tag_id,
             "policies": self.policies,
-        })
+        }
+        if self.parents:
+            d["parents"] = list(self.parents)
+        if self.users:
+            d["users"] = list(self.users)
+        return json.dumps(d)
 
     @staticmethod
     def from_header(s: str) -> "Label":
@@ -29,11 +44,47 @@ class Label:
             user_id=d["user_id"],
             tag_id=d["tag_id"],
             policies=d["policies"],
+            parents=tuple(d.get("parents", ())),
+            users=tuple(d.get("users", ())),
         )
 
 def new_label(user_id: str, policies: dict) -> "Label":
     return Label(user_id=user_id, tag_id=str(uuid.uuid4()), policies=policies)
 
+def child_label(parent: Label, index: int) -> "Label":
+    """Derived label for the index-th part (e.g. line item) of a labeled blob."""
+    return Label(user_id=parent.user_id, tag_id=f"{parent.tag_id}.{index}",
+                 policies=parent.policies)
+
+def strictest_policies(policies: list[dict]) -> dict:
+    out: dict = {}
+    for pol in policies:
+        for k, v in pol.items():
+            order = POLICY_STRICTNESS.get(k, [])
+            rank = order.index(v) if v in order else -1
+            cur = out.get(k)
+            if cur is None or rank > (order.index(cur) if cur in order else -1):
+                out[k] = v
+    return out
+
+def derive_label(parents: list[Label]) -> "Label":
+    """
+    New label for data computed from `parents`: links to their tag_ids,
+    covers the union of their users and keeps the strictest policies.
+    """
+    users = []
+    for p in parents:
+        for u in p.all_users():
+            if u not in users:
+                users.append(u)
+    return Label(
+        user_id=users[0],
+        tag_id=str(uuid.uuid4()),
+        policies=strictest_policies([p.policies for p in parents]),
+        parents=tuple(p.tag_id for p in parents),
+        users=tuple(users) if len(users) > 1 else (),
+    )
+
 @dataclass
 class Labeled(Generic[T]):
     value: T
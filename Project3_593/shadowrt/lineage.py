@@ -0,0 +1,91 @@
+import sqlite3, time, threading, atexit
+from typing import List
+
+from .labels import Label
+from .migrate import ensure_schema
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lineage_edges (
+  child_tag TEXT NOT NULL,
+  parent_tag TEXT NOT NULL,
+  user_id TEXT NOT NULL,
+  op TEXT NOT NULL,          -- e.g. 'map','merge','combine'
+  app TEXT NOT NULL,
+  t_unix REAL NOT NULL,
+  PRIMARY KEY (child_tag, parent_tag, user_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_lineage_parent ON lineage_edges(parent_tag);
+CREATE INDEX IF NOT EXISTS idx_lineage_user ON lineage_edges(user_id);
+"""
+
+class LineageRecorder:
+    """
+    Buffers label derivation edges (child tag -> parent tag) and writes them
+    with one executemany once batch_size edges are pending or the oldest has
+    waited flush_s. Whatever is left is written at interpreter exit.
+    """
+    def __init__(self, db_path: str, app: str,
+                 batch_size: int = 256, flush_s: float = 1.0):
+        self.db_path = db_path
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._pending: list[tuple] = []
+        self._oldest = 0.0
+        self._lock = threading.Lock()
+        with sqlite3.connect(self.db_path) as c:
+            ensure_schema(c, SCHEMA)
+        atexit.register(self.flush)
+
+    def record(self, child: Label, op: str) -> None:
+        now = time.time()
+        edges = [(child.tag_id, p, u, op, self.app, now)
+                 for p in child.parents for u in child.all_users()]
+        with self._lock:
+            if not self._pending:
+                self._oldest = now
+            self._pending.extend(edges)
+            due = (len(self._pending) >= self.batch_size
+                   or now - self._oldest >= self.flush_s)
+        if due:
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            with sqlite3.connect(self.db_path) as c:
+                c.executemany(
+                    "INSERT OR IGNORE INTO lineage_edges"
+                    "(child_tag,parent_tag,user_id,op,app,t_unix) VALUES(?,?,?,?,?,?)",
+                    batch,
+                )
+                c.commit()
+        return len(batch)
+
+    def parents_of(self, tag_id: str) -> List[str]:
+        self.flush()
+        with sqlite3.connect(self.db_path) as c:
+            return [r[0] for r in c.execute(
+                "SELECT DISTINCT parent_tag FROM lineage_edges WHERE child_tag=?",
+                (tag_id,))]
+
+    def descendants(self, tag_id: str) -> List[str]:
+        """Every tag derived, directly or transitively, from tag_id."""
+        self.flush()
+        with sqlite3.connect(self.db_path) as c:
+            return [r[0] for r in c.execute(
+                """WITH RECURSIVE d(tag) AS (
+                     SELECT child_tag FROM lineage_edges WHERE parent_tag=?
+                     UNION
+                     SELECT e.child_tag FROM lineage_edges e JOIN d ON e.parent_tag=d.tag
+                   ) SELECT tag FROM d""",
+                (tag_id,))]
+
+    def tags_for_user(self, user_id: str) -> List[str]:
+        """Derived tags that carry this user's data."""
+        self.flush()
+        with sqlite3.connect(self.db_path) as c:
+            return [r[0] for r in c.execute(
+                "SELECT DISTINCT child_tag FROM lineage_edges WHERE user_id=?",
+                (user_id,))]
@@ -0,0 +1,105 @@
+import sqlite3, time, re, functools
+from typing import Callable, Iterator, List, Sequence, Tuple, Union
+
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INTEGER PRIMARY KEY,
+  applied REAL NOT NULL
+);
+"""
+
+def current_version(conn: sqlite3.Connection) -> int:
+    conn.execute(VERSION_SCHEMA)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+# objects a schema script creates, for schema_applied()
+_CREATED = re.compile(r"CREATE\s+(?:UNIQUE\s+)?(?:TABLE|INDEX|VIEW|TRIGGER)\s+IF\s+NOT\s+EXISTS\s+(\w+)",
+                      re.IGNORECASE)
+
+@functools.lru_cache(maxsize=None)
+def _created(schema: str) -> tuple:
+    return tuple(sorted(set(_CREATED.findall(schema))))
+
+def schema_applied(conn: sqlite3.Connection, schema: str,
+                   migrations: List[Tuple[int, Union[str, Callable]]] = ()) -> bool:
+    """
+    True if every object `schema` creates exists and the recorded
+    schema_version is already the newest migration. One read, no DDL,
+    no transaction.
+    """
+    names = _created(schema)
+    version = "(SELECT MAX(version) FROM schema_version)" if migrations else "NULL"
+    try:
+        found, current = conn.execute(
+            f"SELECT (SELECT count(DISTINCT name) FROM sqlite_master "
+            f"WHERE name IN ({','.join('?' * len(names))})), {version}",
+            names,
+        ).fetchone()
+    except sqlite3.OperationalError:     # no schema_version table yet
+        return False
+    return found == len(names) and (not migrations
+                                    or (current or 0) >= max(v for v, _ in migrations))
+
+def ensure_schema(conn: sqlite3.Connection, schema: str,
+                  migrations: List[Tuple[int, Union[str, Callable]]] = ()) -> bool:
+    """
+    Create `schema` and apply `migrations`, unless schema_applied() says
+    the file is already current. Returns True if any DDL ran.
+    """
+    if schema_applied(conn, schema, migrations):
+        return False
+    conn.executescript(schema)
+    conn.commit()
+    if migrations:
+        apply_migrations(conn, migrations)
+    return True
+
+def statements(sql: str) -> Iterator[str]:
+    """
+    Split a script into whole statements. A ";" inside a string literal or
+    a trigger body does not end a statement (sqlite3.complete_statement).
+    """
+    stmt = ""
+    for part in sql.split(";"):
+        stmt += part + ";"
+        if sqlite3.complete_statement(stmt):
+            if stmt.strip(" \t\r\n;"):
+                yield stmt
+            stmt = ""
+    if stmt.strip(" \t\r\n;"):
+        yield stmt
+
+def apply_migrations(conn: sqlite3.Connection,
+                     migrations: List[Tuple[int, Union[str, Sequence[str], Callable]]]) -> int:
+    """
+    Run every (version, sql) migration newer than the recorded schema_version,
+    in version order, each in its own transaction. `sql` is a script, a list
+    of statements, or a callable taking the connection, for data conversions.
+    Returns the final version.
+
+    Each step takes the write lock (BEGIN IMMEDIATE) and re-reads the
+    version under it, so processes starting together apply it once.
+    """
+    version = current_version(conn)
+    conn.commit()
+    for v, sql in sorted(migrations, key=lambda m: m[0]):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(conn)
+            if v <= version:
+                conn.rollback()
+                continue
+            if callable(sql):
+                sql(conn)
+            else:
+                for stmt in statements(sql) if isinstance(sql, str) else sql:
+                    conn.execute(stmt)
+            conn.execute("INSERT INTO schema_version(version,applied) VALUES(?,?)",
+                         (v, time.time()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = v
+    return version
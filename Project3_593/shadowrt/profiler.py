@@ -0,0 +1,150 @@
+"""
+Opt-in sampling profiler for requests and runtime primitives.
+
+A sampled request gets a root frame; inside it, source/sink/receive/log
+and db sections (see ShadowRuntime and ProfiledConnection) open child
+frames. Each frame's self time (its wall and CPU time minus its
+children's) is added to a per-stack total when the request ends, and
+collapsed() renders the totals as flamegraph.pl / speedscope input:
+
+    POST /purchase;source:build_payment_blob;log 1840
+
+Unsampled requests cost one random() and one ContextVar lookup per
+section. PROFILER is process-wide; its sample_rate can change live
+(PUT /admin/profile, which needs the runtime's admin token).
+"""
+import random, sqlite3, threading, time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+class _Frame:
+    __slots__ = ("path", "parent", "sample", "t0", "c0", "child_wall", "child_cpu")
+
+    def __init__(self, path: tuple, parent, sample):
+        self.path = path
+        self.parent = parent
+        self.sample = sample
+        self.child_wall = self.child_cpu = 0.0
+        self.t0 = time.perf_counter()
+        self.c0 = time.thread_time()
+
+    def close(self):
+        wall = time.perf_counter() - self.t0
+        cpu = time.thread_time() - self.c0
+        if self.parent is not None:
+            self.parent.child_wall += wall
+            self.parent.child_cpu += cpu
+        # CPU clocks are per thread, so a parent on another thread can come out negative
+        self.sample.add(self.path, max(wall - self.child_wall, 0.0),
+                        max(cpu - self.child_cpu, 0.0))
+
+
+class Sample:
+    """One sampled request; `root` may be renamed (e.g. to the route template) before it ends."""
+    def __init__(self, root: str):
+        self.root = root
+        self.frames: list = []      # (path below root, self wall s, self cpu s)
+        self._lock = threading.Lock()
+
+    def add(self, path: tuple, wall: float, cpu: float):
+        with self._lock:
+            self.frames.append((path, wall, cpu))
+
+
+_frame: ContextVar[Optional[_Frame]] = ContextVar("profile_frame", default=None)
+
+class Profiler:
+    def __init__(self, sample_rate: float = 0.0):
+        self.sample_rate = sample_rate
+        self._totals: dict = {}     # stack tuple -> [wall s, cpu s, count]
+        self._lock = threading.Lock()
+        self.seen = 0
+        self.sampled = 0
+
+    @contextmanager
+    def request(self, name: str):
+        """Root of a possibly sampled unit of work; yields its Sample or None."""
+        with self._lock:
+            self.seen += 1
+        if _frame.get() is not None or not self.sample_rate or random.random() >= self.sample_rate:
+            yield None
+            return
+        with self._lock:
+            self.sampled += 1
+        sample = Sample(name)
+        frame = _Frame((), None, sample)
+        token = _frame.set(frame)
+        try:
+            yield sample
+        finally:
+            _frame.reset(token)
+            frame.close()
+            self._merge(sample)
+
+    def enter(self, name: str):
+        parent = _frame.get()
+        if parent is None:
+            return None
+        frame = _Frame(parent.path + (name,), parent, parent.sample)
+        return frame, _frame.set(frame)
+
+    def exit(self, handle) -> None:
+        if handle is not None:
+            frame, token = handle
+            _frame.reset(token)
+            frame.close()
+
+    @contextmanager
+    def section(self, name: str):
+        """Time a block as a child frame of the current sampled request, if any."""
+        handle = self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit(handle)
+
+    def _merge(self, sample: Sample):
+        with self._lock:
+            for path, wall, cpu in sample.frames:
+                t = self._totals.setdefault((sample.root, *path), [0.0, 0.0, 0])
+                t[0] += wall
+                t[1] += cpu
+                t[2] += 1
+
+    def collapsed(self, metric: str = "wall") -> str:
+        """Collapsed stacks, one 'a;b;c <microseconds>' line per stack."""
+        i = 1 if metric == "cpu" else 0
+        with self._lock:
+            rows = sorted(self._totals.items())
+        return "".join(f"{';'.join(s.replace(';', ',') for s in stack)} {round(t[i] * 1e6)}\n"
+                       for stack, t in rows if round(t[i] * 1e6) > 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sample_rate": self.sample_rate, "seen": self.seen,
+                    "sampled": self.sampled, "stacks": len(self._totals)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {}
+            self.seen = self.sampled = 0
+
+
+PROFILER = Profiler()
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """
+    sqlite3 connection factory whose `with conn:` block is a 'db' section:
+    sqlite3.connect(path, factory=ProfiledConnection).
+    """
+    def __enter__(self):
+        self._profile = PROFILER.enter("db")
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return super().__exit__(*exc)
+        finally:
+            PROFILER.exit(self._profile)
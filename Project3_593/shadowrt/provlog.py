@@ -1,66 +1,229 @@
-import sqlite3, time, json, hashlib, os
-from typing import Optional, Iterable, List
-
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS provenance (
-  event_id TEXT PRIMARY KEY,
-  t_unix REAL NOT NULL,
-  op TEXT NOT NULL,          -- e.g. 'source','insert','transfer_out','transfer_in','delete_request','delete_done'
-  src_app TEXT NOT NULL,
-  dst_app TEXT,
-  user_id TEXT NOT NULL,
-  tag_id TEXT NOT NULL,
-  payload_hash TEXT NOT NULL,
-  meta TEXT NOT NULL
-);
-"""
+import time, json, hashlib, os, base64, threading
+from typing import Optional, List
+
+from .storage import ProvBackend, SQLiteBackend, ShardedBackend
+from .shards import shard_path, pin_shards
+from .bloom import BloomFilter
+from .backpressure import ProvWriter, Overloaded
+from .singleflight import SingleFlight
+from .profiler import PROFILER
+from .deletions import DeletionTracker
+from .trace import current_span
+from .ids import new_event_id
+
+# Deletion bookkeeping is never queued or shed: it is written through even
+# when other events go via the ProvWriter.
+CRITICAL_OPS = ("delete_request", "delete_done", "delete_local")
 
 class ProvLogger:
-    def __init__(self, db_path: str, appname: str):
+    def __init__(self, db_path: str, appname: str,
+                 backend: Optional[ProvBackend] = None,
+                 bloom_path: Optional[str] = None, bloom_save_every: int = 1000,
+                 snapshot_s: Optional[float] = None, shards: int = 1,
+                 archive_after_s: Optional[float] = None, archive_every_s: float = 3600.0,
+                 max_pending: Optional[int] = None, flush_timeout_s: float = 5.0,
+                 bloom_exclusive: bool = False):
         self.db_path = db_path
         self.appname = appname
-        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
-        with sqlite3.connect(self.db_path) as c:
-            c.execute(SCHEMA)
-            c.commit()
+        # SQLite at db_path unless another storage engine is plugged in. With
+        # shards > 1 that is one file per shard (db.s0.db, ...) keyed by user_id,
+        # and db_path itself keeps the shard count (pin_shards), the deletion
+        # tracker and the lineage edges: those are per destination or span
+        # several users, so they have no one shard to live on.
+        paths = [shard_path(db_path, i, shards) for i in range(shards)]
+        if backend is not None:
+            self.backend = backend
+        elif shards > 1:
+            pin_shards(db_path, shards, ("provenance", "provenance_v2"))
+            self.backend = ShardedBackend([SQLiteBackend(p) for p in paths])
+        else:
+            pin_shards(db_path, 1, ("provenance", "provenance_v2"))
+            self.backend = SQLiteBackend(db_path)
+
+        # Heavy reads (analytics, exports, lineage) go to `reader`. With
+        # snapshot_s set on the SQLite backend that is a periodically
+        # refreshed replica (one per shard), so they never contend with
+        # log() writers.
+        self.snapshots: list = []
+        self.reader = self.backend
+        if snapshot_s and (backend is None or isinstance(backend, SQLiteBackend)):
+            from .replica import SnapshotReader
+            self.snapshots = [SnapshotReader(p, refresh_s=snapshot_s) for p in paths]
+            for s in self.snapshots:
+                s.start()
+            readers = [s.backend for s in self.snapshots]
+            self.reader = (ShardedBackend(readers, self.backend.ring) if shards > 1
+                           else readers[0])
+
+        # Events older than archive_after_s move to compressed, immutable files
+        # in <db>.archive/; backend and reader keep answering over both tiers.
+        self.archiver = None
+        if archive_after_s:
+            from .archive import ArchiveBackend, TieredBackend, Archiver    # lzma/zstandard only when used
+            cold = ArchiveBackend(f"{db_path}.archive")
+            self.archiver = Archiver(self.backend, cold, archive_after_s, archive_every_s)
+            self.archiver.start()
+            self.backend = TieredBackend(self.backend, cold)
+            self.reader = TieredBackend(self.reader, cold)
+
+        # With max_pending, log() queues non-critical events for a background
+        # batch writer instead of writing on the caller's thread (see
+        # shadowrt.backpressure); either way pressure() reports the lag.
+        self.writer = ProvWriter(self.backend, max_pending) if max_pending else None
+        self.flush_timeout_s = flush_timeout_s
+        self._append_s = 0.0        # moving average of a synchronous append
+
+        # concurrent lookups for the same user share one backend query
+        self.flights = SingleFlight()
+
+        # Per-destination Bloom filters of user_ids seen in transfer_out, so
+        # deletions for users who never left this app skip the provenance query.
+        # The filters only see this process's events, so a miss is trusted
+        # only with bloom_exclusive (this is the store's only writer);
+        # otherwise every lookup still runs the query.
+        self.bloom_path = bloom_path or f"{db_path}.bloom"
+        self.bloom_save_every = bloom_save_every
+        self.bloom_exclusive = bloom_exclusive
+        self._bloom_lock = threading.RLock()    # a lost bit is a skipped erasure
+        self.transfers: dict[str, BloomFilter] = {}
+        self.bloom_stats = {"skipped": 0, "queried": 0, "false_positives": 0}
+        self._bloom_mark = 0.0      # newest transfer_out t_unix covered by the filters
+        self._bloom_unsaved = 0
+        self._load_filters()
+
+        # open delete_request -> delete_done pairs, kept next to the log
+        self.deletions = DeletionTracker(db_path)
 
     def log(self, op: str, user_id: str, tag_id: str, payload: bytes,
             dst_app: Optional[str] = None, meta: Optional[dict] = None) -> str:
-        """Append a provenance event."""
-        meta = meta or {}
-        event_id = hashlib.sha256(
-            f"{time.time()}|{op}|{user_id}|{tag_id}".encode()
-        ).hexdigest()
-        phash = hashlib.sha256(payload).hexdigest()
-        rec = (
-            event_id,
-            time.time(),
-            op,
-            self.appname,
-            dst_app,
-            user_id,
-            tag_id,
-            phash,
-            json.dumps(meta),
-        )
-        with sqlite3.connect(self.db_path) as c:
-            c.execute(
-                """INSERT INTO provenance(event_id,t_unix,op,src_app,dst_app,user_id,tag_id,payload_hash,meta)
-                   VALUES(?,?,?,?,?,?,?,?,?)""",
-                rec,
+        """Append a provenance event (tagged with the current trace span, if any)."""
+        with PROFILER.section("log"):
+            meta = meta or {}
+            sp = current_span.get()
+            if sp is not None:
+                meta = {**sp.meta(), **meta}
+            # one clock read; the id is time-ordered so inserts append to the index
+            t_unix = time.time()
+            event_id = new_event_id(t_unix)
+            phash = hashlib.sha256(payload).hexdigest()
+            rec = (
+                event_id,
+                t_unix,
+                op,
+                self.appname,
+                dst_app,
+                user_id,
+                tag_id,
+                phash,
+                json.dumps(meta),
             )
-            c.commit()
-        return event_id
+            # a full queue means a synchronous write, never an error: the
+            # caller's own write has usually committed already
+            if self.writer is None or op in CRITICAL_OPS or not self.writer.submit(rec):
+                t0 = time.perf_counter()
+                self.backend.append(rec)
+                self._append_s = 0.8 * self._append_s + 0.2 * (time.perf_counter() - t0)
+            if op == "transfer_out" and dst_app is not None:
+                self._note_transfer(dst_app, user_id, rec[1])
+            elif op in ("delete_request", "delete_done"):
+                self.deletions.on_event(op, user_id, dst_app, rec[1])
+            return event_id
 
     def destinations_for_user(self, user_id: str) -> List[str]:
         """
         Return distinct dst_app values where this user was ever sent
         (based on transfer_out events).
         """
-        with sqlite3.connect(self.db_path) as c:
-            rows = c.execute(
-                "SELECT DISTINCT dst_app FROM provenance "
-                "WHERE user_id=? AND op='transfer_out' AND dst_app IS NOT NULL",
-                (user_id,),
-            ).fetchall()
-        return [r[0] for r in rows]
+        with self._bloom_lock:
+            maybe = [d for d, f in self.transfers.items() if user_id in f]
+        if not maybe and self.bloom_exclusive:
+            self.bloom_stats["skipped"] += 1
+            return []
+        self.bloom_stats["queried"] += 1
+        found = self.flights.do(("destinations", user_id), self._destinations, user_id)
+        self.bloom_stats["false_positives"] += len(set(maybe) - set(found))
+        return list(found)
+
+    def _destinations(self, user_id: str) -> List[str]:
+        # a queued transfer_out must count; if the queue can't be drained in
+        # time the answer could miss a destination, so refuse to give one
+        if not self.flush(self.flush_timeout_s):
+            raise Overloaded(self.writer.retry_after_s())
+        return self.backend.destinations_for_user(user_id)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait for queued events to reach the backend."""
+        return self.writer.flush(timeout) if self.writer is not None else True
+
+    def pressure(self) -> dict:
+        """
+        Live writer lag: the age of the oldest queued event with a ProvWriter,
+        otherwise the recent synchronous append latency.
+        """
+        if self.writer is None:
+            return {"pending": 0, "max_pending": None, "lag_s": self._append_s,
+                    "write_ms": self._append_s * 1000}
+        return {"pending": len(self.writer.pending), "max_pending": self.writer.max_pending,
+                "lag_s": self.writer.lag_s(), "write_ms": self.writer.batch_s * 1000,
+                "errors": self.writer.errors, "overflow": self.writer.overflow}
+
+    def bloom_fp_rate(self) -> float:
+        """Observed share of filter hits the provenance query did not confirm."""
+        q = self.bloom_stats["queried"]
+        return self.bloom_stats["false_positives"] / q if q else 0.0
+
+    # ---------- Bloom filter persistence ----------
+
+    def _note_transfer(self, dst_app: str, user_id: str, t_unix: float, save: bool = True):
+        with self._bloom_lock:
+            f = self.transfers.get(dst_app)
+            if f is None:
+                f = self.transfers[dst_app] = BloomFilter()
+            f.add(user_id)
+            self._bloom_mark = max(self._bloom_mark, t_unix)
+            self._bloom_unsaved += 1
+            if save and self._bloom_unsaved >= self.bloom_save_every:
+                self.save_filters()
+
+    def save_filters(self):
+        with self._bloom_lock:
+            state = {
+                "mark": self._bloom_mark,
+                "filters": {
+                    d: {"m": f.m, "k": f.k, "count": f.count,
+                        "bits": base64.b64encode(f.bits).decode()}
+                    for d, f in self.transfers.items()
+                },
+            }
+            tmp = self.bloom_path + ".tmp"
+            with open(tmp, "w") as fh:
+                json.dump(state, fh)
+            os.replace(tmp, self.bloom_path)
+            self._bloom_unsaved = 0
+
+    def _load_filters(self):
+        with self._bloom_lock:
+            try:
+                with open(self.bloom_path) as fh:
+                    state = json.load(fh)
+                for d, s in state["filters"].items():
+                    f = BloomFilter(s["m"], s["k"], base64.b64decode(s["bits"]))
+                    f.count = s["count"]
+                    self.transfers[d] = f
+                self._bloom_mark = state["mark"]
+            except (OSError, ValueError, KeyError):
+                self.transfers, self._bloom_mark = {}, 0.0
+            # replay the transfer_outs the log gained since the filters were
+            # saved, a keyset page at a time
+            after = None
+            while True:
+                page = self.backend.query(op="transfer_out", t_from=self._bloom_mark,
+                                          after=after, limit=5000)
+                for r in page:
+                    if r[4] is not None:
+                        self._note_transfer(r[4], r[5], r[1], save=False)
+                if len(page) < 5000:
+                    break
+                after = (page[-1][1], page[-1][0])
+            if self._bloom_unsaved >= self.bloom_save_every:
+                self.save_filters()
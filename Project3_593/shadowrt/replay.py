@@ -0,0 +1,186 @@
+"""
+Replay a capture (see shadowrt.capture) against a running app.
+
+    python -m shadowrt.replay capture.jsonl --target http://127.0.0.1:8000
+        [--speed 2 | --asap] [--workers 8]
+        [--baseline-prov pencilpros_prov.db --replay-prov /tmp/run/pencilpros_prov.db]
+        [--max-p99-ratio 1.5]
+
+Requests go out at their original relative times (scaled by --speed, or
+back to back with --asap) from a pool of workers; --workers 1 keeps
+strict capture order. The report compares status codes and per-route
+latency with the capture and, given both provenance stores, the events
+each run produced, counted by (op, src_app, dst_app, user_id). Ids,
+tags, timestamps and payload hashes differ between runs by design and
+are ignored. Exits 1 on any mismatch or latency regression past
+--max-p99-ratio.
+"""
+import argparse, glob, http.client, json, os, sys, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from .capture import decode_body
+from .storage import ProvBackend, SQLiteBackend, ShardedBackend
+from .archive import ArchiveBackend, TieredBackend
+
+def load_capture(path: str) -> List[dict]:
+    with open(path) as fh:
+        recs = [json.loads(line) for line in fh if line.strip()]
+    return sorted(recs, key=lambda r: r["t"])
+
+
+class _Sender:
+    """One keep-alive connection per worker thread."""
+    def __init__(self, target: str, timeout: float):
+        u = urlsplit(target)
+        self.host, self.port = u.hostname, u.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, rec: dict) -> dict:
+        path = rec["path"] + (f"?{rec['query']}" if rec.get("query") else "")
+        body = decode_body(rec["body"], rec["body_kind"])
+        t0 = time.perf_counter()
+        status = None
+        for attempt in (1, 2):      # one reconnect if the kept-alive socket was closed
+            conn = getattr(self._local, "conn", None)
+            if conn is None:
+                conn = self._local.conn = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request(rec["method"], path, body=body or None, headers=rec["headers"])
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+                break
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._local.conn = None
+        return {"route": f"{rec['method']} {rec['route']}", "status": status,
+                "orig_status": rec["status"], "ms": (time.perf_counter() - t0) * 1000,
+                "orig_ms": rec["duration_ms"]}
+
+
+def replay(recs: List[dict], target: str, speed: Optional[float] = 1.0,
+           workers: int = 8, timeout: float = 10.0) -> List[dict]:
+    """Issue recs against target; speed None means as fast as possible."""
+    sender = _Sender(target, timeout)
+    base, t0 = recs[0]["t"] if recs else 0.0, time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for rec in recs:
+            if speed:
+                delay = t0 + (rec["t"] - base) / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(pool.submit(sender.send, rec))
+        return [f.result() for f in futures]
+
+
+def _pct(vals: List[float], p: float) -> float:
+    vals = sorted(vals)
+    return vals[min(len(vals) - 1, int(p / 100 * len(vals)))]
+
+def summarize(results: List[dict]) -> dict:
+    routes = {}
+    for r in results:
+        routes.setdefault(r["route"], []).append(r)
+    return {
+        "requests": len(results),
+        "failed": sum(r["status"] is None for r in results),
+        "status_mismatches": sum(r["status"] != r["orig_status"] for r in results),
+        "routes": {
+            route: {
+                "n": len(rs),
+                "p50_ms": _pct([r["ms"] for r in rs], 50),
+                "p99_ms": _pct([r["ms"] for r in rs], 99),
+                "orig_p50_ms": _pct([r["orig_ms"] for r in rs], 50),
+                "orig_p99_ms": _pct([r["orig_ms"] for r in rs], 99),
+            }
+            for route, rs in sorted(routes.items())
+        },
+    }
+
+
+def open_prov(path: str) -> ProvBackend:
+    """
+    A provenance store on disk, with its shard files and archive if
+    present, opened read-only. Raises FileNotFoundError if there is
+    neither path nor any shard of it.
+    """
+    root, ext = os.path.splitext(path)
+    shards = sorted(glob.glob(f"{root}.s[0-9]*{ext}"),
+                    key=lambda p: int(p[len(root) + 2:-len(ext) or None]))
+    backend = (ShardedBackend([SQLiteBackend(p, readonly=True) for p in shards]) if shards
+               else SQLiteBackend(path, readonly=True))
+    if os.path.isdir(f"{path}.archive"):
+        backend = TieredBackend(backend, ArchiveBackend(f"{path}.archive"))
+    return backend
+
+def provenance_profile(backend: ProvBackend, t_from: float, t_to: float) -> Counter:
+    return Counter((r[2], r[3], r[4], r[5]) for r in backend.scan(t_from, t_to))
+
+def compare_provenance(baseline: Counter, replayed: Counter) -> dict:
+    return {
+        "baseline_events": sum(baseline.values()),
+        "replay_events": sum(replayed.values()),
+        "missing": [[*k, n] for k, n in sorted((baseline - replayed).items(), key=str)],
+        "extra": [[*k, n] for k, n in sorted((replayed - baseline).items(), key=str)],
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m shadowrt.replay")
+    ap.add_argument("capture")
+    ap.add_argument("--target", required=True)
+    ap.add_argument("--speed", type=float, default=1.0, help="1 = original timing, 2 = twice as fast")
+    ap.add_argument("--asap", action="store_true", help="ignore timing, send back to back")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--baseline-prov", help="provenance db of the captured run")
+    ap.add_argument("--replay-prov", help="provenance db the target writes to")
+    ap.add_argument("--settle-s", type=float, default=2.0,
+                    help="wait for queued work (async charges) before reading provenance")
+    ap.add_argument("--max-p99-ratio", type=float)
+    args = ap.parse_args(argv)
+
+    recs = load_capture(args.capture)
+    if not recs:
+        print("empty capture", file=sys.stderr)
+        return 1
+    stores = None
+    if args.baseline_prov and args.replay_prov:
+        try:        # before replaying, so a mistyped path costs nothing
+            stores = open_prov(args.baseline_prov), open_prov(args.replay_prov)
+        except (OSError, ValueError) as e:
+            ap.error(str(e))
+    start = time.time()
+    results = replay(recs, args.target, None if args.asap else args.speed,
+                     args.workers, args.timeout)
+    end = time.time()
+    report = summarize(results)
+    bad = report["status_mismatches"] > 0
+
+    if args.max_p99_ratio:
+        slow = [route for route, s in report["routes"].items()
+                if s["p99_ms"] > args.max_p99_ratio * s["orig_p99_ms"]]
+        report["slow_routes"] = slow
+        bad = bad or bool(slow)
+
+    if stores:
+        time.sleep(args.settle_s)
+        last = recs[-1]
+        report["provenance"] = compare_provenance(
+            provenance_profile(stores[0], recs[0]["t"],
+                               last["t"] + last["duration_ms"] / 1000 + args.settle_s),
+            provenance_profile(stores[1], start, end + args.settle_s),
+        )
+        bad = bad or bool(report["provenance"]["missing"] or report["provenance"]["extra"])
+
+    print(json.dumps(report, indent=2))
+    return 1 if bad else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import sqlite3, time, threading
+from typing import Optional
+
+from .storage import SQLiteBackend, Record
+
+class ReplicaBackend(SQLiteBackend):
+    """Read-only SQLiteBackend over whichever snapshot file is current."""
+    def __init__(self, reader: "SnapshotReader"):
+        self.reader = reader      # no schema/migrations: the snapshot already has them
+        self._init_codes()
+
+    @property
+    def db_path(self) -> str:
+        return self.reader.current_path
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+
+    def append(self, rec: Record) -> None:
+        raise RuntimeError("provenance replica is read-only")
+
+
+class SnapshotReader:
+    """
+    Keeps a read-only copy of a provenance SQLite file for heavy reads
+    (analytics, exports, lineage), refreshed every refresh_s seconds.
+
+    The primary is switched to WAL so the online backup reads a consistent
+    snapshot without blocking ProvLogger writers. Snapshots alternate
+    between two files, so readers of the old one are never yanked.
+    """
+    def __init__(self, db_path: str, replica_path: Optional[str] = None,
+                 refresh_s: float = 60.0):
+        self.db_path = db_path
+        base = replica_path or f"{db_path}.replica"
+        self.paths = (f"{base}.a", f"{base}.b")
+        self.refresh_s = refresh_s
+        self.current_path = self.paths[0]
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        with sqlite3.connect(self.db_path) as c:
+            c.execute("PRAGMA journal_mode=WAL")
+        self.backend = ReplicaBackend(self)
+        self.refresh()
+
+    @property
+    def lag_s(self) -> float:
+        return time.time() - self.last_refresh
+
+    def refresh(self) -> None:
+        """Take a consistent snapshot of the primary and switch readers to it."""
+        with self._lock:
+            target = self.paths[1] if self.current_path == self.paths[0] else self.paths[0]
+            src = sqlite3.connect(self.db_path)
+            dst = sqlite3.connect(target)
+            try:
+                src.backup(dst)     # one step: a single read transaction on the WAL
+                dst.execute("PRAGMA journal_mode=DELETE")   # plain file for read-only opens
+            finally:
+                dst.close()
+                src.close()
+            self.current_path = target
+            self.last_refresh = time.time()
+
+    def _loop(self):
+        while not self._stop.wait(self.refresh_s):
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                pass    # keep serving the previous snapshot; retry next tick
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="prov-snapshot",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
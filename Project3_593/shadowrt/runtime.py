@@ -1,62 +1,314 @@
 from __future__ import annotations
-from typing import Callable, Any
-from .labels import current_user, Labeled, Label, new_label
-from .provlog import ProvLogger
+from typing import Callable, Any, TYPE_CHECKING
+import functools, threading, json, contextvars, os
+from contextlib import contextmanager, nullcontext
+from .labels import current_user, Labeled, Label, new_label, derive_label
+from .cache import LabelCache
+from .trace import span, parse_header
+from .singleflight import SingleFlight
+from .profiler import PROFILER
+from .destinations import Registry
+from .transport import TransportError
+from .shards import scatter
+
+if TYPE_CHECKING:     # the storage stack is imported when the log is first opened
+    from .provlog import ProvLogger
+    from .lineage import LineageRecorder
+    from .storage import ProvBackend
+    from .backpressure import AdmissionPolicy
 
 POLICY_DEFAULT = {"delete_policy": "delete_all_user_data"}
 
+_MISS = object()
+
 class ShadowRuntime:
     """
     Small runtime that:
       - wraps sources (creates labels + logs 'source')
-      - wraps sinks (logs 'transfer_out')
+      - wraps sinks (logs 'transfer_out'), or sends through the destination registry
+      - fans deletions out to every destination holding a user's data
       - can 'receive' labeled data (logs 'transfer_in')
       - exposes prov log for insert/delete/etc.
+      - caches per-user reads and drops them on local deletion
+      - serves its provenance log over HTTP (mount)
+      - propagates labels through map/merge/combine, recording lineage edges
+      - sheds non-critical requests while provenance writes lag (admission)
+      - coalesces concurrent identical operations (single-flight)
+      - profiles a sample of requests down to source/sink/receive/log/db
+    Constructing one does no I/O: the provenance log and lineage store are
+    opened by open() (call it from the app's lifespan) or on first use.
     """
-    def __init__(self, appname: str, prov_db: str):
+    def __init__(self, appname: str, prov_db: str, backend: ProvBackend | None = None,
+                 cache_size: int = 1024, cache_ttl_s: float = 30.0,
+                 snapshot_s: float | None = None, shards: int = 1,
+                 archive_after_s: float | None = None, max_pending: int | None = None,
+                 admission: AdmissionPolicy | None = None,
+                 profile_rate: float | None = None,
+                 destinations: Registry | None = None, bloom_exclusive: bool = False,
+                 admin_token: str | None = None):
         self.app = appname
-        self.log = ProvLogger(db_path=prov_db, appname=appname)
+        self.admin_token = admin_token     # X-Admin-Token for /admin routes; None disables them
+        self.destinations = destinations or Registry()
+        self.prov_db = prov_db
+        self._log_args = dict(db_path=prov_db, appname=appname, backend=backend,
+                              snapshot_s=snapshot_s, shards=shards,
+                              archive_after_s=archive_after_s, max_pending=max_pending,
+                              bloom_exclusive=bloom_exclusive)
+        self._log: ProvLogger | None = None
+        self._lineage: LineageRecorder | None = None
+        self._open_lock = threading.Lock()
+        self.admission = admission
+        self.flights = SingleFlight()
+        self.profiler = PROFILER
+        if profile_rate is not None:
+            self.profiler.sample_rate = profile_rate
+        # invalidations go through <prov>.cache.db, so every worker of the app
+        # drops a user's entries as soon as one of them deletes or writes
+        root, ext = os.path.splitext(prov_db)
+        self.cache = LabelCache(maxsize=cache_size, ttl_s=cache_ttl_s,
+                                path=f"{root}.cache{ext or '.db'}")
+
+    @property
+    def log(self) -> ProvLogger:
+        if self._log is None:
+            self.open()
+        return self._log
+
+    @property
+    def lineage(self) -> LineageRecorder:
+        if self._lineage is None:
+            self.open()
+        return self._lineage
+
+    def open(self) -> "ShadowRuntime":
+        """Open the provenance log and lineage store (schema checks included), once."""
+        with self._open_lock:
+            if self._log is None:
+                from .provlog import ProvLogger
+                from .lineage import LineageRecorder
+                self._lineage = LineageRecorder(self.prov_db, self.app)
+                self._log = ProvLogger(**self._log_args)
+        return self
 
     def source(self, fn: Callable[..., Any]) -> Callable[..., Labeled[Any]]:
         def wrapper(*args, **kwargs):
             u = current_user.get()
             if not u:
                 raise RuntimeError("No user context set for source()")
-            raw = fn(*args, **kwargs)
-            lab = new_label(user_id=u, policies=POLICY_DEFAULT)
-            self.log.log(
-                "source", u, lab.tag_id,
-                payload=str(raw).encode(),
-                meta={"function": fn.__name__},
-            )
-            return Labeled(value=raw, label=lab)
+            with self.profiler.section(f"source:{fn.__name__}"):
+                raw = fn(*args, **kwargs)
+                lab = new_label(user_id=u, policies=POLICY_DEFAULT)
+                self.log.log(
+                    "source", u, lab.tag_id,
+                    payload=str(raw).encode(),
+                    meta={"function": fn.__name__},
+                )
+                return Labeled(value=raw, label=lab)
         wrapper.__name__ = fn.__name__
         return wrapper
 
     def sink(self, dst_app: str):
         def deco(fn: Callable[..., Any]):
             def wrapper(labeled: Labeled[Any], *args, **kwargs):
-                if not isinstance(labeled, Labeled):
-                    raise TypeError("sink() requires a Labeled[...] value")
-                self.log.log(
-                    "transfer_out",
-                    labeled.label.user_id,
-                    labeled.label.tag_id,
-                    payload=str(labeled.value).encode(),
-                    dst_app=dst_app,
-                    meta={"function": fn.__name__},
-                )
-                return fn(labeled, *args, **kwargs)
+                with self._transfer_out(dst_app, [labeled], fn.__name__):
+                    return fn(labeled, *args, **kwargs)
             wrapper.__name__ = fn.__name__
             return wrapper
         return deco
 
-    def receive(self, labeled_header: str, body: Any) -> Labeled[Any]:
-        lab = Label.from_header(labeled_header)
+    @contextmanager
+    def _transfer_out(self, dst_app: str, labeled: list, function: str,
+                      traces: list | None = None):
+        for l in labeled:
+            if not isinstance(l, Labeled):
+                raise TypeError("sink() requires a Labeled[...] value")
+        # the hop gets its own span; transports forward it via trace.current_header()
+        with span(f"sink:{dst_app}", app=self.app), \
+                self.profiler.section(f"sink:{dst_app}"):
+            for i, l in enumerate(labeled):
+                # an item with its own trace (a queued checkout) is logged in
+                # that trace, not the batch's
+                with (self.span(f"sink:{dst_app}", traces[i]) if traces and traces[i]
+                      else nullcontext()):
+                    payload = str(l.value).encode()
+                    # one event per data subject, so deleting any of the users
+                    # behind merged data reaches dst_app
+                    for u in l.label.all_users():
+                        self.log.log(
+                            "transfer_out",
+                            u,
+                            l.label.tag_id,
+                            payload=payload,
+                            dst_app=dst_app,
+                            meta={"function": function},
+                        )
+            yield
+
+    def send(self, dst_app: str, labeled: Labeled[Any]) -> Any:
+        """Sink through the destination registry: log transfer_out, then ship to dst_app."""
+        dest = self.destinations[dst_app]
+        with self._transfer_out(dst_app, [labeled], "send"):
+            return dest.send(labeled)
+
+    def send_many(self, dst_app: str, labeled: list[Labeled[Any]],
+                  traces: list[str | None] | None = None) -> list[Any]:
+        """
+        send() for several items, batched as dst_app's config allows. One
+        result per item; a TransportError in place of any the peer rejected
+        (see Destination.send_many). traces are the items' own traceparent
+        headers, if they come from different requests.
+        """
+        dest = self.destinations[dst_app]
+        with self._transfer_out(dst_app, labeled, "send_many", traces):
+            return dest.send_many(labeled)
+
+    def receive(self, labeled_header: str | Label, body: Any) -> Labeled[Any]:
+        """Accept labeled data from another app (header string, or the Label in-process)."""
+        with self.profiler.section("receive"):
+            lab = labeled_header if isinstance(labeled_header, Label) else Label.from_header(labeled_header)
+            payload = str(body).encode()
+            for u in lab.all_users():
+                self.log.log("transfer_in", u, lab.tag_id, payload=payload)
+            return Labeled(value=body, label=lab)
+
+    def map(self, fn: Callable[[Any], Any], labeled: Labeled[Any],
+            op: str = "map") -> Labeled[Any]:
+        """fn(value) under a label derived from labeled's."""
+        return self.combine(fn, labeled, op=op)
+
+    def combine(self, fn: Callable[..., Any], *labeled: Labeled[Any],
+                op: str = "combine") -> Labeled[Any]:
+        """
+        fn(*values) under one derived label: parents are the inputs' tag_ids,
+        users their union, policies the strictest. The derivation edges are
+        batched into the lineage table instead of logging payloads.
+        """
+        for l in labeled:
+            if not isinstance(l, Labeled):
+                raise TypeError("combine() requires Labeled[...] inputs")
+        with self.profiler.section(f"label:{op}"):
+            lab = derive_label([l.label for l in labeled])
+            value = fn(*(l.value for l in labeled))
+            self.lineage.record(lab, op)
+            return Labeled(value=value, label=lab)
+
+    def merge(self, *labeled: Labeled[Any], op: str = "merge") -> Labeled[Any]:
+        """Merge dict values left to right (others are collected in a list)."""
+        def merge_values(*values):
+            if all(isinstance(v, dict) for v in values):
+                out = {}
+                for v in values:
+                    out.update(v)
+                return out
+            return list(values)
+        return self.combine(merge_values, *labeled, op=op)
+
+    def span(self, name: str, header: str | None = None):
+        """Trace span for a block, continuing a traceparent header if given."""
+        return span(name, app=self.app, parent=parse_header(header, self.app))
+
+    def profile(self, name: str):
+        """Profiling root for work outside a request (e.g. a queue job)."""
+        return self.profiler.request(name)
+
+    def mount(self, app) -> None:
+        """
+        Add the read-only /provenance query API to a FastAPI app, trace
+        every request (continuing an incoming traceparent header), sample
+        requests for the profiler (/admin/profile) and, with an admission
+        policy, shed load while provenance writes lag.
+        """
+        from .http import (provenance_router, profile_router, TraceMiddleware,
+                           ProfileMiddleware, AdmissionMiddleware, overloaded_handler)
+        from .backpressure import Overloaded
+        app.include_router(provenance_router(self))
+        app.include_router(profile_router(self))
+        app.add_middleware(TraceMiddleware, rt=self)
+        app.add_middleware(ProfileMiddleware, rt=self)
+        if self.admission is not None:
+            app.add_middleware(AdmissionMiddleware, rt=self)
+        app.add_exception_handler(Overloaded, overloaded_handler)
+
+    def cached(self, tag: str):
+        """
+        Cache a read function whose first argument is a user_id. Entries are
+        keyed by (user_id, tag, remaining args) and dropped by delete_local().
+        A None result (not found) is not cached, so a row created right
+        after a miss is seen on the next read.
+        """
+        def deco(fn: Callable[..., Any]):
+            def wrapper(user_id: str, *args):
+                key = (tag, *args)
+                hit = self.cache.get(user_id, key, _MISS)
+                if hit is not _MISS:
+                    return hit
+                gen = self.cache.generation(user_id)
+                value = fn(user_id, *args)
+                if value is not None:
+                    self.cache.put(user_id, key, value, generation=gen)
+                return value
+            wrapper.__name__ = fn.__name__
+            return wrapper
+        return deco
+
+    def coalesced(self, name: str):
+        """
+        Run at most one call per (name, arguments) at a time; concurrent
+        duplicates (double clicks, client retries) wait for it and share its
+        result. Keeps fn's signature, so it can sit under a FastAPI route.
+        """
+        def deco(fn: Callable[..., Any]):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                key = (name, args, tuple(sorted(kwargs.items())))
+                return self.flights.do(key, fn, *args, **kwargs)
+            return wrapper
+        return deco
+
+    def delete_remote(self, user_id: str) -> dict:
+        """
+        Ask every app the provenance log says holds user_id's data to delete
+        it, concurrently, logging delete_request/delete_done per destination.
+        Destinations with no registered delete route only get the request
+        logged, so they stay visible in /deletions/open. Returns receipts by
+        destination; if any failed, raises TransportError(502) naming them
+        once the rest are done.
+        """
+        dsts = self.log.destinations_for_user(user_id)
+        # pool threads keep the caller's trace span and profile frame
+        ctxs = [contextvars.copy_context() for _ in dsts]
+
+        def one(i: int):
+            dst = dsts[i]
+            self.log.log("delete_request", user_id, "*", payload=b"", dst_app=dst,
+                         meta={"reason": "user deletion request"})
+            if dst not in self.destinations or self.destinations[dst].routes["delete"] is None:
+                return None
+            try:
+                receipt = self.destinations[dst].delete(user_id)
+            except TransportError as e:
+                return e
+            self.log.log("delete_done", user_id, "*", payload=json.dumps(receipt).encode(),
+                         dst_app=dst, meta={})
+            return receipt
+
+        results = dict(zip(dsts, scatter(len(dsts), lambda i: ctxs[i].run(one, i)))) if dsts else {}
+        failed = [d for d, r in results.items() if isinstance(r, TransportError)]
+        if failed:
+            raise TransportError(502, f"delete failed at {', '.join(failed)}")
+        return {d: r for d, r in results.items() if r is not None}
+
+    def delete_local(self, user_id: str, delete_fn: Callable[[str], Any],
+                     details: str = "") -> Any:
+        """
+        Delete a user's rows from this app's DB, invalidate every cached
+        read for them, and log 'delete_local'.
+        """
+        result = delete_fn(user_id)
+        self.cache.invalidate_user(user_id)
         self.log.log(
-            "transfer_in",
-            lab.user_id,
-            lab.tag_id,
-            payload=str(body).encode(),
+            "delete_local", user_id, "*",
+            payload=b"",
+            meta={"details": details, "deleted": result},
         )
-        return Labeled(value=body, label=lab)
+        return result
@@ -0,0 +1,193 @@
+import os, mmap, struct, json, threading
+from typing import Optional, Iterator, List, Dict
+
+# Record layout: fixed header, then the eight string fields back to back.
+#   u32 total_len | f64 t_unix | 8 x u32 field lengths (NULL_LEN = None)
+# A total_len of 0 marks the end of data in a preallocated segment.
+HEADER = struct.Struct("<Id8I")
+NULL_LEN = 0xFFFFFFFF
+FIELDS = ("event_id", "op", "src_app", "dst_app",
+          "user_id", "tag_id", "payload_hash", "meta")
+STR_FIELDS = (0, 2, 3, 4, 5, 6, 7, 8)   # positions of FIELDS in a provenance tuple
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+def encode_record(rec: tuple) -> bytes:
+    parts = [None if rec[i] is None else rec[i].encode() for i in STR_FIELDS]
+    lens = [NULL_LEN if p is None else len(p) for p in parts]
+    body = b"".join(p for p in parts if p)
+    return HEADER.pack(HEADER.size + len(body), rec[1], *lens) + body
+
+
+class RecordView:
+    """
+    Zero-copy view of one record inside a mapped segment. Fields are
+    memoryview slices of the mapped pages; nothing is decoded until asked.
+    """
+    __slots__ = ("buf", "offset", "size", "t_unix", "_spans")
+
+    def __init__(self, buf: memoryview, offset: int):
+        self.buf = buf
+        self.offset = offset
+        self.size, self.t_unix, *lens = HEADER.unpack_from(buf, offset)
+        pos = offset + HEADER.size
+        spans = []
+        for n in lens:
+            if n == NULL_LEN:
+                spans.append(None)
+            else:
+                spans.append((pos, pos + n))
+                pos += n
+        self._spans = spans
+
+    def raw(self, name: str) -> Optional[memoryview]:
+        span = self._spans[FIELDS.index(name)]
+        return None if span is None else self.buf[span[0]:span[1]]
+
+    def text(self, name: str) -> Optional[str]:
+        mv = self.raw(name)
+        return None if mv is None else str(mv, "utf-8")
+
+    def to_record(self) -> tuple:
+        vals = [self.text(f) for f in FIELDS]
+        return (vals[0], self.t_unix, *vals[1:])
+
+    def to_bytes(self) -> memoryview:
+        return self.buf[self.offset:self.offset + self.size]
+
+
+class Segment:
+    """One preallocated segment file, mapped read/write, plus its user index."""
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.index_path = path[:-len(".log")] + ".idx"
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(self.file.fileno()).st_size < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.view = memoryview(self.map)
+        self.capacity = len(self.map)
+        self.end = 0
+        self.users: Dict[str, List[int]] = {}
+        self._load_index()
+        self._catch_up()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.end, self.users = d["end"], d["users"]
+
+    def _catch_up(self):
+        # index records written after the sidecar was last saved (or all of them)
+        off = self.end
+        while off + HEADER.size <= self.capacity:
+            (size,) = struct.unpack_from("<I", self.map, off)
+            if size == 0:
+                break
+            v = RecordView(self.view, off)
+            self.users.setdefault(v.text("user_id"), []).append(off)
+            off += size
+        self.end = off
+
+    def append(self, data: bytes, user_id: str) -> int:
+        off = self.end
+        self.map[off:off + len(data)] = data
+        self.end += len(data)
+        self.users.setdefault(user_id, []).append(off)
+        return off
+
+    def write_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"end": self.end, "users": self.users}, f)
+        os.replace(tmp, self.index_path)
+
+    def views(self) -> Iterator[RecordView]:
+        off = 0
+        while off < self.end:
+            v = RecordView(self.view, off)
+            yield v
+            off += v.size
+
+    def close(self):
+        self.map.flush()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+class SegmentLog:
+    """
+    Append-only provenance log stored as numbered segment files in a directory.
+    Writes are copied straight into the mapped active segment; once it is full
+    the log rolls over to a new one and writes the old one's sidecar index
+    (user_id -> record offsets). Readers get RecordViews over the mapped pages.
+    """
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(n for n in os.listdir(directory) if n.endswith(".log"))
+        self.segments = [Segment(os.path.join(directory, n), 0) for n in names]
+        if not self.segments:
+            self._roll(0)
+
+    @property
+    def active(self) -> Segment:
+        return self.segments[-1]
+
+    def _roll(self, need: int):
+        if self.segments:
+            self.active.write_index()
+        n = len(self.segments) + 1
+        path = os.path.join(self.directory, f"seg-{n:06d}.log")
+        self.segments.append(Segment(path, max(self.segment_bytes, need + HEADER.size)))
+
+    def append(self, rec: tuple) -> None:
+        data = encode_record(rec)
+        with self._lock:
+            seg = self.active
+            # keep room for the zero end-marker after the last record
+            if seg.end + len(data) + 4 > seg.capacity:
+                self._roll(len(data))
+                seg = self.active
+            seg.append(data, rec[5])
+
+    def views(self) -> Iterator[RecordView]:
+        for seg in list(self.segments):
+            yield from seg.views()
+
+    def user_views(self, user_id: str) -> Iterator[RecordView]:
+        for seg in list(self.segments):
+            for off in list(seg.users.get(user_id, ())):
+                yield RecordView(seg.view, off)
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        seen = []
+        for v in self.user_views(user_id):
+            if v.raw("op") == b"transfer_out":
+                dst = v.text("dst_app")
+                if dst is not None and dst not in seen:
+                    seen.append(dst)
+        return seen
+
+    def export(self, out) -> int:
+        """Write every raw record to a binary file object; returns bytes written."""
+        n = 0
+        for v in self.views():
+            n += out.write(v.to_bytes())
+        return n
+
+    def flush(self):
+        with self._lock:
+            self.active.map.flush()
+            self.active.write_index()
+
+    def close(self):
+        self.flush()
+        for seg in self.segments:
+            seg.close()
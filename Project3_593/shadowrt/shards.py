@@ -0,0 +1,112 @@
+import hashlib, bisect, os, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+def shard_path(path: str, shard: int, n: int) -> str:
+    """'app.db' -> 'app.s3.db'; with a single shard the path is unchanged."""
+    if n <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.s{shard}{ext}"
+
+LAYOUT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shard_layout (
+  id INTEGER PRIMARY KEY CHECK (id = 0),
+  shards INTEGER NOT NULL
+);
+"""
+
+def _found_shards(path: str, tables: Sequence[str]) -> int:
+    """Shard count implied by the files on disk, for databases older than shard_layout."""
+    k = 0
+    while os.path.exists(shard_path(path, k, 2)):
+        k += 1
+    if k or not os.path.exists(path):
+        return k
+    with closing(sqlite3.connect(path)) as c:
+        used = c.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' "
+                         f"AND name IN ({','.join('?' * len(tables))})", tuple(tables)).fetchone()[0]
+    return 1 if used else 0
+
+def pin_shards(path: str, n: int, tables: Sequence[str]) -> None:
+    """
+    Record n as the shard count of the database at `path`, or raise
+    ValueError if its data was written under another count. The ring puts
+    a user on a different shard when n changes, and their existing rows
+    do not move with them, so a changed DB_SHARDS would hide them from
+    per-user reads and deletes. The record lives in the unsharded base
+    file, which exists whatever n is; a base file without the record that
+    holds one of the data `tables` was written unsharded.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    found = _found_shards(path, tables)
+    with closing(sqlite3.connect(path, timeout=30)) as c:
+        c.execute(LAYOUT_SCHEMA)
+        c.execute("BEGIN IMMEDIATE")
+        row = c.execute("SELECT shards FROM shard_layout").fetchone()
+        pinned = row[0] if row else (found or n)
+        if row is None:
+            c.execute("INSERT INTO shard_layout(id,shards) VALUES(0,?)", (pinned,))
+        c.commit()
+    if pinned != n:
+        raise ValueError(f"{path} holds {pinned} shard(s) but {n} were configured; "
+                         f"keep DB_SHARDS={pinned} or move the data first")
+
+# ids handed out by next_id() encode their shard modulo this
+MAX_SHARDS = 256
+
+def next_id(conn, table: str, shard: int, n: int) -> int:
+    """
+    Next id for an AUTOINCREMENT `table` on `shard` of `n`, unique across
+    shards: shard s hands out s, s + MAX_SHARDS, s + 2*MAX_SHARDS, ...
+    above its sqlite_sequence, so ids never collide between shards and are
+    never reused after a delete. With a single shard this is the plain
+    next rowid. Call inside the write transaction (BEGIN IMMEDIATE) that
+    inserts the row. The shard count itself is fixed by pin_shards().
+    """
+    if shard >= MAX_SHARDS:
+        raise ValueError(f"at most {MAX_SHARDS} shards")
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (table,)).fetchone()
+    seq = row[0] if row else 0
+    if n <= 1:
+        return seq + 1
+    return (seq // MAX_SHARDS + 1) * MAX_SHARDS + shard
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash of user_id onto n shards. Each shard owns `vnodes`
+    points on the ring, so going from n to n+1 shards moves about 1/(n+1)
+    of the users instead of nearly all of them.
+    """
+    def __init__(self, n: int, vnodes: int = 64):
+        if n < 1:
+            raise ValueError("need at least one shard")
+        self.n = n
+        ring = sorted((_point(f"shard-{s}#{v}"), s) for s in range(n) for v in range(vnodes))
+        self._points = [p for p, _ in ring]
+        self._shards = [s for _, s in ring]
+
+    def shard_for(self, user_id: str) -> int:
+        if self.n == 1:
+            return 0
+        i = bisect.bisect(self._points, _point(user_id)) % len(self._points)
+        return self._shards[i]
+
+
+_pool = None
+
+def scatter(n: int, fn: Callable[[int], T]) -> List[T]:
+    """Run fn(shard) for every shard concurrently; results in shard order."""
+    global _pool
+    if n == 1:
+        return [fn(0)]
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="shard")
+    return list(_pool.map(fn, range(n)))
@@ -0,0 +1,67 @@
+"""
+Import-to-ready latency of the apps.
+
+    python -m shadowrt.startup pencilpros.app paypal.app [--runs 5] [--max-ready-ms 800]
+
+Each run is a fresh interpreter in a scratch working directory (the apps
+keep their databases relative to it) that imports the module, then
+enters its FastAPI lifespan. "cold" runs start from an empty directory,
+so every schema is created; "warm" runs reuse one already initialised,
+which is the usual restart and should skip all DDL. Reports the median
+and worst import_ms (module import) and ready_ms (import plus startup)
+per module, and exits 1 if a warm median ready_ms exceeds --max-ready-ms.
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile
+
+CHILD = """
+import asyncio, importlib, json, sys, time
+t0 = time.perf_counter()
+mod = importlib.import_module(sys.argv[1])
+t1 = time.perf_counter()
+
+async def ready():
+    async with mod.app.router.lifespan_context(mod.app):
+        return time.perf_counter()
+
+t2 = asyncio.run(ready())
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "ready_ms": (t2 - t0) * 1000}))
+"""
+
+def run_once(module: str, cwd: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    out = subprocess.run([sys.executable, "-c", CHILD, module], cwd=cwd, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def _summary(runs: list) -> dict:
+    return {k: {"median": round(statistics.median(r[k] for r in runs), 1),
+                "max": round(max(r[k] for r in runs), 1)}
+            for k in ("import_ms", "ready_ms")}
+
+def measure(module: str, runs: int = 5) -> dict:
+    cold = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as d:
+            cold.append(run_once(module, d))
+    with tempfile.TemporaryDirectory() as d:
+        run_once(module, d)                 # initialise the schemas once
+        warm = [run_once(module, d) for _ in range(runs)]
+    return {"cold": _summary(cold), "warm": _summary(warm)}
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m shadowrt.startup")
+    ap.add_argument("modules", nargs="+", help="e.g. pencilpros.app (run from the project root)")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--max-ready-ms", type=float)
+    args = ap.parse_args(argv)
+
+    report = {m: measure(m, args.runs) for m in args.modules}
+    print(json.dumps(report, indent=2))
+    if args.max_ready_ms:
+        slow = [m for m, r in report.items() if r["warm"]["ready_ms"]["median"] > args.max_ready_ms]
+        return 1 if slow else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
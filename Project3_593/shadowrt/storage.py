@@ -0,0 +1,389 @@
+import sqlite3, os, heapq
+from itertools import islice
+from typing import Optional, Iterator, List, Tuple
+
+from .segmentlog import SegmentLog, SEGMENT_BYTES
+from .migrate import ensure_schema, schema_applied
+from .shards import HashRing, scatter
+from .compact import (migrate_v2, enc_event_id, dec_event_id, enc_tag, dec_tag,
+                      enc_hash, dec_hash, enc_meta, dec_meta)
+
+# One provenance event, in SQLite column order:
+# (event_id, t_unix, op, src_app, dst_app, user_id, tag_id, payload_hash, meta)
+Record = Tuple[str, float, str, str, Optional[str], str, str, str, str]
+
+COLUMNS = ("event_id", "t_unix", "op", "src_app", "dst_app",
+           "user_id", "tag_id", "payload_hash", "meta")
+
+# v1 table; migration 2 converts it to provenance_v2 plus a compatibility view
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS provenance (
+  event_id TEXT PRIMARY KEY,
+  t_unix REAL NOT NULL,
+  op TEXT NOT NULL,          -- e.g. 'source','insert','transfer_out','transfer_in','delete_request','delete_done'
+  src_app TEXT NOT NULL,
+  dst_app TEXT,
+  user_id TEXT NOT NULL,
+  tag_id TEXT NOT NULL,
+  payload_hash TEXT NOT NULL,
+  meta TEXT NOT NULL
+);
+"""
+
+# Applied on top of SCHEMA by SQLiteBackend (see shadowrt.migrate).
+MIGRATIONS = [
+    # keyset pagination on (t_unix, event_id), optionally scoped to a user or tag
+    (1, """
+CREATE INDEX IF NOT EXISTS idx_prov_time ON provenance(t_unix, event_id);
+CREATE INDEX IF NOT EXISTS idx_prov_user ON provenance(user_id, t_unix, event_id);
+CREATE INDEX IF NOT EXISTS idx_prov_tag ON provenance(tag_id, t_unix, event_id);
+"""),
+    # compact row encoding; converts existing rows in place
+    (2, migrate_v2),
+    # one op's events in keyset order (rebuilding the Bloom filters from transfer_out)
+    (3, "CREATE INDEX IF NOT EXISTS idx_prov2_op ON provenance_v2(op, t_unix, event_id)"),
+]
+
+class ProvBackend:
+    """
+    Storage interface behind ProvLogger. Every query returns records
+    ordered by (t_unix, event_id).
+    """
+    def append(self, rec: Record) -> None:
+        raise NotImplementedError
+
+    def append_many(self, recs: List[Record]) -> None:
+        """Append a batch (e.g. from ProvWriter). SQLite writes it in one transaction."""
+        for r in recs:
+            self.append(r)
+
+    def by_user(self, user_id: str) -> List[Record]:
+        raise NotImplementedError
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        raise NotImplementedError
+
+    def scan(self, t_from: Optional[float] = None,
+             t_to: Optional[float] = None) -> Iterator[Record]:
+        """Yield records with t_from <= t_unix < t_to."""
+        raise NotImplementedError
+
+    def query(self, user_id: Optional[str] = None, tag_id: Optional[str] = None,
+              op: Optional[str] = None, dst_app: Optional[str] = None,
+              t_from: Optional[float] = None, t_to: Optional[float] = None,
+              after: Optional[Tuple[float, str]] = None,
+              limit: int = 100) -> List[Record]:
+        """
+        Up to `limit` matching records strictly after the (t_unix, event_id)
+        keyset cursor `after`, in (t_unix, event_id) order.
+        """
+        if user_id is not None:
+            src = self.by_user(user_id)
+        elif tag_id is not None:
+            src = self.by_tag(tag_id)
+        else:
+            src = self.scan(t_from, t_to)
+        hits = (r for r in src
+                if (tag_id is None or r[6] == tag_id)
+                and (op is None or r[2] == op)
+                and (dst_app is None or r[4] == dst_app)
+                and _in_range(r[1], t_from, t_to)
+                and (after is None or (r[1], r[0]) > tuple(after)))
+        return list(islice(hits, limit))
+
+    def drop_through(self, key: Tuple[float, str]) -> int:
+        """
+        Delete every record at or before the (t_unix, event_id) key; used
+        once those records are safely archived (see shadowrt.archive).
+        """
+        raise NotImplementedError
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        seen = []
+        for r in self.by_user(user_id):
+            if r[2] == "transfer_out" and r[4] is not None and r[4] not in seen:
+                seen.append(r[4])
+        return seen
+
+def _key(r: Record):
+    return (r[1], r[0])
+
+def _sort(recs) -> List[Record]:
+    return sorted(recs, key=_key)
+
+def _in_range(t: float, t_from, t_to) -> bool:
+    return (t_from is None or t >= t_from) and (t_to is None or t < t_to)
+
+
+class SQLiteBackend(ProvBackend):
+    """
+    Provenance in a single SQLite file (default). Rows live in the compact
+    v2 table (see shadowrt.compact); a `provenance` view keeps the old shape.
+
+    readonly=True opens an existing store for inspection: connections are
+    SQLITE_OPEN_READONLY, nothing is created or migrated, and a missing
+    file or one not at the current schema is an error.
+    """
+    def __init__(self, db_path: str, readonly: bool = False):
+        self.db_path = db_path
+        self.readonly = readonly
+        self._init_codes()
+        if readonly:
+            if not os.path.isfile(db_path):
+                raise FileNotFoundError(f"no provenance store at {db_path}")
+            with self._connect() as c:
+                if not schema_applied(c, SCHEMA, MIGRATIONS):
+                    raise ValueError(f"{db_path} is not a provenance store at the current "
+                                     f"schema version (open it with the app once to migrate)")
+            return
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as c:
+            ensure_schema(c, SCHEMA, MIGRATIONS)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.readonly:
+            return sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        return sqlite3.connect(self.db_path)
+
+    # ---------- op/app lookup tables ----------
+
+    def _init_codes(self):
+        self._codes = {"prov_ops": {}, "prov_apps": {}}     # name -> id
+        self._names = {"prov_ops": {}, "prov_apps": {}}     # id -> name
+
+    def _code(self, c: sqlite3.Connection, table: str, name: str,
+              create: bool = False) -> Optional[int]:
+        code = self._codes[table].get(name)
+        if code is None:
+            if create:
+                c.execute(f"INSERT OR IGNORE INTO {table}(name) VALUES(?)", (name,))
+            row = c.execute(f"SELECT id FROM {table} WHERE name=?", (name,)).fetchone()
+            if row is None:
+                return None
+            code = self._codes[table][name] = row[0]
+            self._names[table][code] = name
+        return code
+
+    def _name(self, c: sqlite3.Connection, table: str, code: Optional[int]) -> Optional[str]:
+        if code is None:
+            return None
+        name = self._names[table].get(code)
+        if name is None:
+            self._names[table].update(c.execute(f"SELECT id, name FROM {table}").fetchall())
+            name = self._names[table][code]
+        return name
+
+    def _decode(self, c: sqlite3.Connection, r: tuple) -> Record:
+        e, t, op, src, dst, u, tag, h, m = r
+        return (dec_event_id(e), t, self._name(c, "prov_ops", op),
+                self._name(c, "prov_apps", src), self._name(c, "prov_apps", dst),
+                u, dec_tag(tag), dec_hash(h), dec_meta(m))
+
+    # ---------- ProvBackend ----------
+
+    def append(self, rec: Record) -> None:
+        e, t, op, src, dst, u, tag, h, m = rec
+        with self._connect() as c:
+            c.execute(
+                """INSERT INTO provenance_v2(event_id,t_unix,op,src_app,dst_app,user_id,tag_id,payload_hash,meta)
+                   VALUES(?,?,?,?,?,?,?,?,?)""",
+                (enc_event_id(e), t, self._code(c, "prov_ops", op, create=True),
+                 self._code(c, "prov_apps", src, create=True),
+                 None if dst is None else self._code(c, "prov_apps", dst, create=True),
+                 u, enc_tag(tag), enc_hash(h), enc_meta(m)),
+            )
+            c.commit()
+
+    def append_many(self, recs: List[Record]) -> None:
+        # OR IGNORE: a batch retried after a failure may be partly written
+        with self._connect() as c:
+            c.executemany(
+                """INSERT OR IGNORE INTO provenance_v2(event_id,t_unix,op,src_app,dst_app,user_id,tag_id,payload_hash,meta)
+                   VALUES(?,?,?,?,?,?,?,?,?)""",
+                [(enc_event_id(e), t, self._code(c, "prov_ops", op, create=True),
+                  self._code(c, "prov_apps", src, create=True),
+                  None if dst is None else self._code(c, "prov_apps", dst, create=True),
+                  u, enc_tag(tag), enc_hash(h), enc_meta(m))
+                 for e, t, op, src, dst, u, tag, h, m in recs],
+            )
+            c.commit()
+
+    def _select(self, c: sqlite3.Connection, where: list, args: list,
+                limit: Optional[int] = None) -> List[Record]:
+        sql = (f"SELECT {','.join(COLUMNS)} FROM provenance_v2 "
+               f"WHERE {' AND '.join(where) or '1'} ORDER BY t_unix, event_id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            args = [*args, limit]
+        return [self._decode(c, r) for r in c.execute(sql, args)]
+
+    def by_user(self, user_id: str) -> List[Record]:
+        with self._connect() as c:
+            return self._select(c, ["user_id=?"], [user_id])
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        with self._connect() as c:
+            return self._select(c, ["tag_id=?"], [enc_tag(tag_id)])
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        lo = float("-inf") if t_from is None else t_from
+        hi = float("inf") if t_to is None else t_to
+        with self._connect() as c:
+            rows = self._select(c, ["t_unix>=?", "t_unix<?"], [lo, hi])
+        yield from rows
+
+    def query(self, user_id=None, tag_id=None, op=None, dst_app=None,
+              t_from=None, t_to=None, after=None, limit=100) -> List[Record]:
+        where, args = [], []
+        with self._connect() as c:
+            if user_id is not None:
+                where.append("user_id=?")
+                args.append(user_id)
+            if tag_id is not None:
+                where.append("tag_id=?")
+                args.append(enc_tag(tag_id))
+            for col, table, val in (("op", "prov_ops", op), ("dst_app", "prov_apps", dst_app)):
+                if val is not None:
+                    code = self._code(c, table, val)
+                    if code is None:
+                        return []       # never-seen op/app: nothing can match
+                    where.append(f"{col}=?")
+                    args.append(code)
+            if t_from is not None:
+                where.append("t_unix>=?")
+                args.append(t_from)
+            if t_to is not None:
+                where.append("t_unix<?")
+                args.append(t_to)
+            if after is not None:
+                # row-value comparison lets SQLite seek straight to the cursor
+                where.append("(t_unix, event_id) > (?, ?)")
+                args.extend((after[0], enc_event_id(after[1])))
+            return self._select(c, where, args, limit)
+
+    def drop_through(self, key) -> int:
+        with self._connect() as c:
+            cur = c.execute("DELETE FROM provenance_v2 WHERE (t_unix, event_id) <= (?, ?)",
+                            (key[0], enc_event_id(key[1])))
+            c.commit()
+            return cur.rowcount
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        with self._connect() as c:
+            op = self._code(c, "prov_ops", "transfer_out")
+            if op is None:
+                return []
+            rows = c.execute(
+                "SELECT DISTINCT dst_app FROM provenance_v2 "
+                "WHERE user_id=? AND op=? AND dst_app IS NOT NULL",
+                (user_id, op),
+            ).fetchall()
+            return [self._name(c, "prov_apps", r[0]) for r in rows]
+
+
+class MemoryBackend(ProvBackend):
+    """Plain Python lists and dicts; for tests and benchmarks."""
+    def __init__(self):
+        self.records: List[Record] = []
+        self._by_user = {}
+        self._by_tag = {}
+
+    def append(self, rec: Record) -> None:
+        self.records.append(rec)
+        self._by_user.setdefault(rec[5], []).append(rec)
+        self._by_tag.setdefault(rec[6], []).append(rec)
+
+    def by_user(self, user_id: str) -> List[Record]:
+        return _sort(self._by_user.get(user_id, []))
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        return _sort(self._by_tag.get(tag_id, []))
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        yield from _sort(r for r in self.records if _in_range(r[1], t_from, t_to))
+
+    def drop_through(self, key) -> int:
+        keep = [r for r in self.records if _key(r) > tuple(key)]
+        dropped = len(self.records) - len(keep)
+        self.records, self._by_user, self._by_tag = [], {}, {}
+        for r in keep:
+            self.append(r)
+        return dropped
+
+
+class LogFileBackend(ProvBackend):
+    """
+    Append-only memory-mapped segment log (see segmentlog.SegmentLog) in the
+    directory at path. Per-user lookups go through the segment indexes.
+    """
+    def __init__(self, path: str, segment_bytes: int = SEGMENT_BYTES):
+        self.log = SegmentLog(path, segment_bytes=segment_bytes)
+
+    def append(self, rec: Record) -> None:
+        self.log.append(rec)
+
+    def by_user(self, user_id: str) -> List[Record]:
+        return _sort(v.to_record() for v in self.log.user_views(user_id))
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        key = tag_id.encode()
+        return _sort(v.to_record() for v in self.log.views() if v.raw("tag_id") == key)
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        yield from _sort(v.to_record() for v in self.log.views()
+                         if _in_range(v.t_unix, t_from, t_to))
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        return self.log.destinations_for_user(user_id)
+
+
+class ShardedBackend(ProvBackend):
+    """
+    Records spread over several backends by consistent hash of user_id.
+    Appends and per-user reads touch only the owning shard; tag, time and
+    cross-user queries run on every shard concurrently and are merged in
+    (t_unix, event_id) order.
+    """
+    def __init__(self, shards: List[ProvBackend], ring: Optional[HashRing] = None):
+        self.shards = shards
+        self.ring = ring or HashRing(len(shards))
+
+    def shard(self, user_id: str) -> ProvBackend:
+        return self.shards[self.ring.shard_for(user_id)]
+
+    def _gather(self, fn) -> list:
+        return scatter(len(self.shards), lambda i: fn(self.shards[i]))
+
+    def append(self, rec: Record) -> None:
+        self.shard(rec[5]).append(rec)
+
+    def append_many(self, recs: List[Record]) -> None:
+        parts = [[] for _ in self.shards]
+        for r in recs:
+            parts[self.ring.shard_for(r[5])].append(r)
+        scatter(len(self.shards), lambda i: parts[i] and self.shards[i].append_many(parts[i]))
+
+    def by_user(self, user_id: str) -> List[Record]:
+        return self.shard(user_id).by_user(user_id)
+
+    def by_tag(self, tag_id: str) -> List[Record]:
+        return list(heapq.merge(*self._gather(lambda b: b.by_tag(tag_id)), key=_key))
+
+    def scan(self, t_from=None, t_to=None) -> Iterator[Record]:
+        yield from heapq.merge(*(b.scan(t_from, t_to) for b in self.shards), key=_key)
+
+    def query(self, user_id=None, tag_id=None, op=None, dst_app=None,
+              t_from=None, t_to=None, after=None, limit=100) -> List[Record]:
+        kw = dict(user_id=user_id, tag_id=tag_id, op=op, dst_app=dst_app,
+                  t_from=t_from, t_to=t_to, after=after, limit=limit)
+        if user_id is not None:
+            return self.shard(user_id).query(**kw)
+        # each shard's first `limit` rows cover the merged first `limit`
+        parts = self._gather(lambda b: b.query(**kw))
+        return list(islice(heapq.merge(*parts, key=_key), limit))
+
+    def drop_through(self, key) -> int:
+        return sum(self._gather(lambda b: b.drop_through(key)))
+
+    def destinations_for_user(self, user_id: str) -> List[str]:
+        return self.shard(user_id).destinations_for_user(user_id)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+from contextvars import ContextVar
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+import secrets, time, json, threading
+
+# W3C trace-context header, so other tooling can read it too
+TRACE_HEADER = "traceparent"
+
+@dataclass
+class Span:
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    app: str
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    remote: bool = False        # context received from another app, not timed here
+
+    def to_header(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def meta(self) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id}
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id, "span_id": self.span_id,
+            "parent_id": self.parent_id, "name": self.name, "app": self.app,
+            "start": self.start, "end": self.end,
+            "duration_ms": None if self.end is None else (self.end - self.start) * 1000,
+        }
+
+current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+_exporters: list[Callable[[dict], None]] = []
+
+def add_exporter(fn: Callable[[dict], None]) -> None:
+    """Register a callback that receives every finished span as a dict."""
+    _exporters.append(fn)
+
+def remove_exporter(fn: Callable[[dict], None]) -> None:
+    _exporters.remove(fn)
+
+def parse_header(header: str | None, app: str = "") -> Span | None:
+    """Remote parent context from a traceparent header (None if absent/bad)."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return Span(trace_id=parts[1], span_id=parts[2], parent_id=None,
+                name="remote", app=app, remote=True)
+
+def current_header() -> str | None:
+    sp = current_span.get()
+    return sp.to_header() if sp else None
+
+@contextmanager
+def span(name: str, app: str = "", parent: Span | None = None):
+    """
+    Time a block as a child of `parent` (default: the current span, else a
+    new trace). The span is current inside the block and exported on exit.
+    """
+    parent = parent or current_span.get()
+    sp = Span(
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        name=name, app=app,
+    )
+    token = current_span.set(sp)
+    try:
+        yield sp
+    finally:
+        current_span.reset(token)
+        sp.end = time.time()
+        d = sp.to_dict()
+        for fn in list(_exporters):
+            try:
+                fn(d)
+            except Exception:
+                pass        # exporters must never break the request
+
+def jsonl_exporter(path: str) -> Callable[[dict], None]:
+    """Exporter that appends spans as JSON lines to a file."""
+    lock = threading.Lock()
+    def export(d: dict):
+        with lock, open(path, "a") as f:
+            f.write(json.dumps(d) + "\n")
+    return export
@@ -0,0 +1,169 @@
+"""
+How a sink reaches another app.
+
+    HTTPTransport("http://127.0.0.1:8001")   remote peer, over HTTP
+    ASGITransport(paypal.app.app)            same process, through the peer's
+                                             ASGI app with no sockets
+    LocalTransport()                         same process, direct calls: the
+                                             Labeled object itself is handed over
+
+All of them answer request(method, path, labeled=None) with the peer's
+JSON-able response body and raise TransportError for non-2xx answers
+(and, over HTTP, 502 for a peer that cannot be reached or answers
+garbage, 504 for one that times out).
+A labeled payload travels with its label (X-Shadow-Label) and the
+current trace context. A list of Labeled is one batch request whose
+body is [{"label": <header>, "value": ...}, ...].
+"""
+import asyncio, json, re, threading
+from typing import Any, Callable, Optional
+
+from .labels import Labeled
+from .trace import TRACE_HEADER, current_header
+
+LABEL_HEADER = "X-Shadow-Label"
+
+class TransportError(Exception):
+    def __init__(self, status: int, detail: str = ""):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+def _headers(labeled) -> dict:
+    headers = {}
+    if isinstance(labeled, Labeled):
+        headers[LABEL_HEADER] = labeled.label.to_header()
+    trace = current_header()
+    if trace:
+        headers[TRACE_HEADER] = trace
+    return headers
+
+def _body(labeled):
+    if labeled is None or isinstance(labeled, Labeled):
+        return None if labeled is None else labeled.value
+    return [{"label": l.label.to_header(), "value": l.value} for l in labeled]
+
+
+class Transport:
+    def request(self, method: str, path: str, labeled: Optional[Labeled] = None) -> Any:
+        raise NotImplementedError
+
+
+class HTTPTransport(Transport):
+    """JSON over HTTP, reusing up to pool_size keep-alive connections to the peer."""
+    def __init__(self, base_url: str, timeout: float = 5.0, pool_size: int = 10):
+        import requests     # only remote peers need it
+        from requests.adapters import HTTPAdapter
+        self._requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, labeled=None):
+        url = f"{self.base_url}{path}"
+        try:
+            resp = self.session.request(
+                method, url,
+                json=_body(labeled),
+                headers=_headers(labeled), timeout=self.timeout,
+            )
+            if not resp.ok:
+                raise TransportError(resp.status_code, resp.text)
+            return resp.json()
+        except self._requests.Timeout as e:
+            raise TransportError(504, f"{method} {url}: {e}") from e
+        except self._requests.RequestException as e:    # refused, reset, DNS, bad JSON
+            raise TransportError(502, f"{method} {url}: {e}") from e
+
+
+class ASGITransport(Transport):
+    """
+    Calls a co-located ASGI app (e.g. the peer's FastAPI app) directly.
+    Same request/response bytes as HTTP, so the peer's validation and
+    middleware still run, but nothing touches the network. Must be called
+    from a thread without a running event loop (sync endpoints, workers).
+    """
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()     # one reusable event loop per calling thread
+
+    def _loop(self) -> asyncio.AbstractEventLoop:
+        loop = getattr(self._local, "loop", None)
+        if loop is None:
+            loop = self._local.loop = asyncio.new_event_loop()
+        return loop
+
+    def request(self, method, path, labeled=None):
+        body = b"" if labeled is None else json.dumps(_body(labeled)).encode()
+        headers = [(k.lower().encode(), v.encode()) for k, v in _headers(labeled).items()]
+        headers += [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())]
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method.upper(), "scheme": "http", "path": path,
+            "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": headers,
+            "client": ("127.0.0.1", 0), "server": ("in-process", 80),
+        }
+        status, out = self._loop().run_until_complete(self._call(scope, body))
+        if not 200 <= status < 300:
+            raise TransportError(status, out.decode(errors="replace"))
+        return json.loads(out) if out else None
+
+    async def _call(self, scope: dict, body: bytes):
+        sent = False
+        status, chunks = 500, []
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class LocalTransport(Transport):
+    """
+    Direct calls into handlers the peer registered in this process. No
+    serialization at all: a labeled request passes the Labeled object (or
+    the list of them, for a batch) as the handler's first argument (treat
+    it as read-only), and path
+    parameters such as {user_id} arrive as keyword arguments.
+
+        local = LocalTransport()
+
+        @local.route("POST", "/charge")
+        def charge(labeled): ...
+    """
+    def __init__(self):
+        self.routes: list = []      # (method, compiled path, handler)
+
+    def route(self, method: str, path: str):
+        pattern = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", path) + "$")
+        def deco(fn: Callable[..., Any]):
+            self.routes.append((method.upper(), pattern, fn))
+            return fn
+        return deco
+
+    def request(self, method, path, labeled=None):
+        for m, pattern, fn in self.routes:
+            match = pattern.match(path)
+            if m == method.upper() and match:
+                if labeled is None:
+                    return fn(**match.groupdict())
+                return fn(labeled, **match.groupdict())
+        raise TransportError(404, f"no local route for {method} {path}")
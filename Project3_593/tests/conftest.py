@@ -0,0 +1,36 @@
+import uuid
+import pytest
+
+@pytest.fixture
+def uid():
+    """A fresh user id, so tests sharing the session's app databases don't collide."""
+    return lambda prefix="u": f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+@pytest.fixture(scope="session")
+def apps(tmp_path_factory):
+    """
+    Both services, imported once per session in a scratch working directory
+    (their databases are relative paths), sharded in two, with PayPal
+    reached in-process through its ASGI app.
+    """
+    pytest.importorskip("fastapi")
+    mp = pytest.MonkeyPatch()
+    mp.chdir(tmp_path_factory.mktemp("apps"))
+    mp.setenv("DB_SHARDS", "2")
+    mp.setenv("PAYPAL_TRANSPORT", "asgi")
+    import paypal.app, pencilpros.app
+    yield pencilpros.app, paypal.app
+    for mod in (pencilpros.app, paypal.app):
+        mod.rt.lineage.flush()      # before leaving the directory its relative db_path points into
+    mp.undo()
+
+@pytest.fixture(scope="session")
+def shop(apps):
+    # no lifespan: the charge workers stay off and tests drain the queue with run_once()
+    from fastapi.testclient import TestClient
+    return TestClient(apps[0].app)
+
+@pytest.fixture(scope="session")
+def paypal(apps):
+    from fastapi.testclient import TestClient
+    return TestClient(apps[1].app)
@@ -0,0 +1,60 @@
+import pytest
+np = pytest.importorskip("numpy")
+
+from shadowrt.analytics import ProvColumns, deletion_sla, top_users
+
+def columns(rows):
+    cols = ProvColumns()
+    cols.add_chunk(rows)
+    return cols.finish()
+
+def ev(t, op, user, dst="PayPal"):
+    return ("e", t, op, "PencilPros", dst, user, "*", "", "{}")
+
+def test_deletion_sla_pairs_requests_with_their_done():
+    cols = columns([
+        ev(0.0, "delete_request", "a"), ev(2.0, "delete_done", "a"),
+        ev(1.0, "delete_request", "b"),
+        ev(5.0, "delete_request", "c"), ev(5.5, "delete_done", "c"),
+    ])
+    sla = deletion_sla(cols)
+    assert (sla["requests"], sla["completed"], sla["open"]) == (3, 2, 1)
+    assert sla["max_s"] == 2.0
+
+def test_top_users():
+    cols = columns([ev(i, "source", u) for i, u in enumerate("abbccc")])
+    assert [u["user_id"] for u in top_users(cols, 2)] == ["c", "b"]
+
+def test_deletion_sla_keeps_groups_apart_over_any_time_span():
+    cols = columns([
+        ev(0.0, "delete_request", "a"), ev(2e9, "delete_done", "a"),     # ~63 years later
+        ev(1.0, "delete_request", "b", dst="Shipping"), ev(3.0, "delete_done", "b", dst="PayPal"),
+        ev(4.0, "delete_request", "c"), ev(4.0, "delete_done", "c"),
+    ])
+    sla = deletion_sla(cols)
+    assert (sla["completed"], sla["open"]) == (2, 1)
+    assert sla["max_s"] == 2e9
+
+def test_deletion_sla_without_deletions():
+    assert deletion_sla(columns([ev(0.0, "source", "a")])) == {"requests": 0, "completed": 0, "open": 0}
+
+def test_load_columns_reads_sqlite_codes_like_the_generic_path(tmp_path):
+    from shadowrt.analytics import load_columns, transfers_per_destination_per_day
+    from shadowrt.storage import SQLiteBackend, MemoryBackend, ShardedBackend
+    recs = [(f"e{i:04d}", 1000.0 + i * 3600, op, "PencilPros", dst, f"u{i % 7}", "*", "h", "{}")
+            for i, (op, dst) in enumerate([("source", None), ("transfer_out", "PayPal"),
+                                           ("transfer_out", "Shipping"), ("delete_request", "PayPal"),
+                                           ("delete_done", "PayPal")] * 20)]
+    sharded = ShardedBackend([SQLiteBackend(str(tmp_path / f"p{i}.db")) for i in range(2)])
+    for b in (SQLiteBackend(str(tmp_path / "p.db")), sharded):
+        b.append_many(recs)
+        mem = MemoryBackend()
+        mem.append_many(recs)
+        fast, slow = load_columns(b, t_from=1000.0 + 3600 * 10), load_columns(mem, t_from=1000.0 + 3600 * 10)
+        assert len(fast) == len(slow) == 90
+        by_day = lambda cols: sorted(transfers_per_destination_per_day(cols), key=lambda r: (r["dst_app"], r["day"]))
+        assert by_day(fast) == by_day(slow)
+        assert deletion_sla(fast) == deletion_sla(slow)
+        users = lambda cols: sorted(map(str, top_users(cols, 7)))
+        assert users(fast) == users(slow)
+        assert {fast.apps.values[d] for d in fast.dst} == {None, "PayPal", "Shipping"}
@@ -0,0 +1,145 @@
+import json
+
+def test_purchase_reaches_paypal_and_deletion_follows(shop, apps, uid):
+    pp, pay = apps
+    u = uid()
+    assert shop.post("/user", json={"user_id": u, "name": "A"}).status_code == 200
+    r = shop.post("/purchase", json={"user_id": u, "amount_cents": 500,
+                                     "billing_address": "1 Main St"})
+    assert r.status_code == 200 and r.json()["paypal_result"]["ok"]
+    assert pay.rt.log.backend.by_user(u), "PayPal logged the transfer_in"
+
+    r = shop.delete(f"/delete/{u}")
+    assert r.status_code == 200
+    assert r.json()["receipts"]["PayPal"]["deleted_records"] == 1
+    assert shop.get(f"/purchases/{u}").json()["purchases"] == []
+    from paypal.db import get_conn
+    with get_conn(u) as c:
+        assert c.execute("SELECT count(*) FROM payments WHERE user_id=?", (u,)).fetchone()[0] == 0
+    assert shop.get("/deletions/open").json()["open"] == []
+
+def test_itemized_purchase(shop, uid):
+    u = uid()
+    shop.post("/user", json={"user_id": u, "name": "B"})
+    r = shop.post("/purchase", json={"user_id": u, "billing_address": "x", "items": [
+        {"item": "pen", "qty": 2, "unit_cents": 100}, {"item": "ink", "unit_cents": 50}]})
+    body = r.json()
+    assert r.status_code == 200 and len(body["item_ids"]) == 2
+    order = shop.get(f"/purchases/{u}/{body['purchase_id']}").json()
+    assert order["amount_cents"] == 250 and len(order["items"]) == 2
+
+def test_provenance_api_pages(shop, uid):
+    u = uid()
+    for i in range(3):
+        shop.post("/user", json={"user_id": u, "name": f"n{i}"})
+    first = shop.get("/provenance", params={"user_id": u, "limit": 2}).json()
+    assert len(first["events"]) == 2 and first["next_cursor"]
+    rest = shop.get("/provenance", params={"user_id": u, "cursor": first["next_cursor"]}).json()
+    assert len(rest["events"]) == 1 and rest["next_cursor"] is None
+
+def test_async_checkout_charges_from_the_queue(shop, apps, uid):
+    pp, pay = apps
+    u = uid()
+    r = shop.post("/purchase", params={"async_mode": True},
+                  json={"user_id": u, "amount_cents": 300, "billing_address": "y"})
+    job = r.json()["charge_job"]
+    assert shop.get(f"/charge_jobs/{job}").json()["state"] == "queued"
+    while pp.charge_queue.run_once():
+        pass
+    assert shop.get(f"/charge_jobs/{job}").json()["state"] == "done"
+    assert "PayPal" in pp.rt.log.destinations_for_user(u)
+
+def test_deleting_before_a_queued_charge_runs_cancels_it(shop, apps, uid):
+    pp, pay = apps
+    u = uid()
+    job = shop.post("/purchase", params={"async_mode": True},
+                    json={"user_id": u, "amount_cents": 300, "billing_address": "z"}).json()["charge_job"]
+    assert shop.delete(f"/delete/{u}").status_code == 200
+    assert shop.get(f"/charge_jobs/{job}").status_code == 404
+    while pp.charge_queue.run_once():
+        pass
+    assert pay.rt.log.backend.by_user(u) == [], "nothing reached PayPal after the erasure"
+
+def test_charge_batch_answers_per_item(paypal, uid):
+    from shadowrt.labels import new_label
+    u = uid()
+    good = {"label": new_label(u, {}).to_header(),
+            "value": {"user_id": u, "amount_cents": 1, "item": "x", "billing_address": "a"}}
+    bad = {"label": new_label(u, {}).to_header(), "value": {"user_id": u}}
+    r = paypal.post("/charge_batch", json=[good, bad, good])
+    assert r.status_code == 200
+    first, rejected, retried = r.json()
+    assert first["ok"] and rejected == {**rejected, "ok": False, "status": 422}
+    assert retried == {**first, "duplicate": True}, "the same label is charged once"
+
+def test_batched_checkouts_keep_their_own_traces(shop, apps, uid):
+    pp, pay = apps
+    users = [uid() for _ in range(3)]
+    jobs = [shop.post("/purchase", params={"async_mode": True},
+                      json={"user_id": u, "amount_cents": 100, "billing_address": "q"}).json()["charge_job"]
+            for u in users]
+    pp.charge_queue.batch_size = 50
+    try:
+        while pp.charge_queue.run_once():
+            pass
+    finally:
+        pp.charge_queue.batch_size = 1
+    assert [shop.get(f"/charge_jobs/{j}").json()["state"] for j in jobs] == ["done"] * 3
+    pp.rt.log.flush()
+    for u in users:
+        recs = pp.rt.log.backend.by_user(u)
+        trace = {r[2]: json.loads(r[8]).get("trace_id") for r in recs}
+        assert trace["transfer_out"] == trace["source"]
+
+def test_deleting_either_user_of_merged_data_reaches_paypal(shop, apps, uid):
+    from shadowrt.labels import Labeled, new_label
+    pp, pay = apps
+    alice, bob = uid("alice"), uid("bob")
+    order = Labeled({"user_id": alice, "amount_cents": 700, "item": "shared cart"}, new_label(alice, {}))
+    address = Labeled({"billing_address": "2 Side St"}, new_label(bob, {}))
+    merged = pp.rt.merge(order, address)
+    assert merged.label.all_users() == (alice, bob)
+    assert pp.send_to_paypal(merged)["ok"]
+    assert {r[2] for r in pay.rt.log.backend.by_user(bob)} >= {"transfer_in"}
+
+    r = shop.delete(f"/delete/{bob}")
+    assert r.status_code == 200 and "PayPal" in r.json()["receipts"]
+
+def test_purchase_ids_are_unique_across_shards(shop, apps, uid):
+    from pencilpros.db import RING
+    users = [uid() for _ in range(16)]
+    assert {RING.shard_for(u) for u in users} == {0, 1}, "both shards in play"
+    ids = {}
+    for u in users:
+        shop.post("/user", json={"user_id": u, "name": "n"})
+        ids[u] = shop.post("/purchase", json={"user_id": u, "amount_cents": 1,
+                                              "billing_address": "a"}).json()["purchase_id"]
+    assert len(set(ids.values())) == len(users)
+    a, b = users[:2]
+    assert shop.get(f"/purchases/{a}/{ids[a]}").status_code == 200
+    assert shop.get(f"/purchases/{a}/{ids[b]}").status_code == 404
+
+def test_profiler_admin_needs_the_token(shop, apps, monkeypatch):
+    pp, pay = apps
+    monkeypatch.setattr(pp.rt, "admin_token", None)
+    assert shop.get("/admin/profile/stats").status_code == 403
+    monkeypatch.setattr(pp.rt, "admin_token", "s3cret")
+    assert shop.put("/admin/profile", params={"sample_rate": 1}).status_code == 401
+    assert shop.get("/admin/profile/stats", headers={"X-Admin-Token": "nope"}).status_code == 401
+    r = shop.get("/admin/profile/stats", headers={"X-Admin-Token": "s3cret"})
+    assert r.status_code == 200 and r.json()["sample_rate"] == pp.rt.profiler.sample_rate
+
+def test_local_transport_rejects_a_bad_charge_like_http(apps, paypal, uid):
+    import pytest
+    from shadowrt.labels import Labeled, new_label
+    from shadowrt.transport import TransportError
+    pp, pay = apps
+    u = uid()
+    bad = Labeled({"user_id": u, "amount_cents": "lots"}, new_label(u, {}))
+    with pytest.raises(TransportError) as e:
+        pay.local.request("POST", "/charge", bad)
+    assert e.value.status == 422
+    assert paypal.post("/charge", json=bad.value,
+                       headers={"X-Shadow-Label": bad.label.to_header()}).status_code == 422
+    [result] = pay.local.request("POST", "/charge_batch", [bad])
+    assert result["ok"] is False and result["status"] == 422
@@ -0,0 +1,68 @@
+import os, subprocess, sys, threading
+
+from shadowrt.archive import ArchiveBackend, TieredBackend, Archiver
+from shadowrt.conformance import sample_records
+from shadowrt.storage import SQLiteBackend
+
+def two_processes(tmp_path):
+    """Two app instances over one hot store and one archive directory."""
+    path = str(tmp_path / "prov.db")
+    hot = SQLiteBackend(path)
+    return [(hot, ArchiveBackend(f"{path}.archive")) for _ in range(2)]
+
+def test_readers_see_segments_another_instance_archived(tmp_path):
+    (hot, a), (_, b) = two_processes(tmp_path)
+    recs = sample_records()
+    for r in recs[:3]:
+        hot.append(r)
+    Archiver(hot, a, after_s=0).run_once()          # A moves alice's PayPal transfer
+    assert TieredBackend(hot, b).destinations_for_user("alice") == ["PayPal"]
+
+def test_writers_merge_instead_of_dropping_each_others_segments(tmp_path):
+    (hot, a), (_, b) = two_processes(tmp_path)
+    recs = sample_records()
+    for r in recs[:3]:
+        hot.append(r)
+    Archiver(hot, a, after_s=0).run_once()
+    for r in recs[3:]:
+        hot.append(r)
+    Archiver(hot, b, after_s=0).run_once()
+    fresh = ArchiveBackend(str(tmp_path / "prov.db.archive"))
+    assert len(fresh.entries) == 2
+    assert [r[0] for r in fresh.scan()] == [r[0] for r in recs]
+    assert sorted(TieredBackend(hot, fresh).destinations_for_user("alice")) == ["PayPal", "Shipping"]
+
+def test_concurrent_archivers_move_each_event_once(tmp_path):
+    (hot, a), (_, b) = two_processes(tmp_path)
+    recs = sample_records()
+    for r in recs:
+        hot.append(r)
+    runs = [threading.Thread(target=Archiver(hot, x, after_s=0, rows_per_file=2).run_once)
+            for x in (a, b)]
+    for t in runs:
+        t.start()
+    for t in runs:
+        t.join()
+    fresh = ArchiveBackend(str(tmp_path / "prov.db.archive"))
+    assert [r[0] for r in fresh.scan()] == [r[0] for r in recs]
+    assert list(hot.scan()) == []
+
+CHILD = """
+import sys
+from shadowrt.archive import ArchiveBackend, Archiver
+from shadowrt.storage import SQLiteBackend
+hot = SQLiteBackend(sys.argv[1])
+Archiver(hot, ArchiveBackend(sys.argv[1] + ".archive"), after_s=0, rows_per_file=1).run_once()
+"""
+
+def test_archivers_in_separate_processes(tmp_path):
+    path = str(tmp_path / "prov.db")
+    hot = SQLiteBackend(path)
+    recs = sample_records()
+    for r in recs:
+        hot.append(r)
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+    procs = [subprocess.Popen([sys.executable, "-c", CHILD, path], env=env) for _ in range(3)]
+    assert [p.wait() for p in procs] == [0, 0, 0]
+    fresh = ArchiveBackend(f"{path}.archive")
+    assert [r[0] for r in fresh.scan()] == [r[0] for r in recs]
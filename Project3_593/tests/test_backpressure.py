@@ -0,0 +1,43 @@
+import threading
+import pytest
+
+from shadowrt.backpressure import Overloaded
+from shadowrt.provlog import ProvLogger
+from shadowrt.storage import MemoryBackend
+
+class StalledBackend(MemoryBackend):
+    """Batch writes (the ProvWriter's) block until released; direct appends don't."""
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def append_many(self, recs):
+        self.release.wait(5)
+        for r in recs:
+            self.append(r)
+
+@pytest.fixture
+def stalled(tmp_path):
+    backend = StalledBackend()
+    log = ProvLogger(str(tmp_path / "prov.db"), "A", backend=backend, max_pending=2,
+                     flush_timeout_s=0.05)
+    yield log, backend
+    backend.release.set()
+
+def test_full_queue_writes_through_instead_of_raising(stalled):
+    log, backend = stalled
+    for i in range(4):
+        log.log("insert_payment", "alice", f"payment:{i}", b"x")
+    assert log.pressure()["overflow"] >= 1
+    assert {r[6] for r in backend.records} >= {"payment:3"}
+    backend.release.set()
+    assert log.flush(5)
+    assert sorted(r[6] for r in backend.records) == [f"payment:{i}" for i in range(4)]
+
+def test_destination_lookup_fails_loudly_when_the_queue_wont_drain(stalled):
+    log, backend = stalled
+    log.log("transfer_out", "alice", "t1", b"x", dst_app="PayPal")
+    with pytest.raises(Overloaded):
+        log.destinations_for_user("alice")
+    backend.release.set()
+    assert log.destinations_for_user("alice") == ["PayPal"]
@@ -0,0 +1,60 @@
+import time
+
+from shadowrt.cache import LabelCache
+from shadowrt.runtime import ShadowRuntime
+
+def test_lru_and_ttl():
+    c = LabelCache(maxsize=2, ttl_s=0.05)
+    c.put("a", 1, "x")
+    c.put("a", 2, "y")
+    c.put("b", 3, "z")
+    assert c.get("a", 1) is None and c.get("a", 2) == "y"
+    time.sleep(0.06)
+    assert c.get("a", 2) is None
+
+def test_invalidate_drops_a_read_that_raced_with_it():
+    c = LabelCache()
+    gen = c.generation("alice")      # a read starts...
+    c.invalidate("alice", "purchases")  # ...a write lands...
+    c.put("alice", "purchases", ["stale"], generation=gen)     # ...the read finishes
+    assert c.get("alice", "purchases") is None
+
+def test_invalidate_user_drops_everything_for_the_user():
+    c = LabelCache()
+    c.put("alice", 1, "x")
+    c.put("alice", 2, "y")
+    c.put("bob", 1, "z")
+    assert c.invalidate_user("alice") == 2
+    assert c.get("alice", 1) is None and c.get("bob", 1) == "z"
+
+def test_cached_does_not_remember_a_miss(tmp_path):
+    rt = ShadowRuntime("A", str(tmp_path / "prov.db"))
+    rows = {}
+    @rt.cached("order")
+    def order(user_id, order_id):
+        return rows.get(order_id)
+    assert order("alice", 1) is None
+    rows[1] = {"id": 1}
+    assert order("alice", 1) == {"id": 1}
+
+def test_invalidations_reach_other_processes_sharing_the_file(tmp_path):
+    path = str(tmp_path / "cache.db")
+    a, b = LabelCache(path=path), LabelCache(path=path)
+    a.put("alice", "purchases", ["old"])
+    b.put("alice", "purchases", ["old"])
+    gen = a.generation("alice")         # a's read starts...
+    b.invalidate_user("alice")          # ...another worker deletes alice...
+    assert a.get("alice", "purchases") is None
+    a.put("alice", "purchases", ["old"], generation=gen)    # ...a's read finishes
+    assert a.get("alice", "purchases") is None
+    a.put("alice", "purchases", ["new"], generation=a.generation("alice"))
+    assert a.get("alice", "purchases") == ["new"]
+
+def test_generations_stay_bounded():
+    c = LabelCache(maxsize=4)
+    for i in range(100):
+        c.invalidate_user(f"u{i}")
+    assert len(c._gen) == 4
+    gen = c.generation("u0")
+    c.put("u0", 1, "x", generation=gen)
+    assert c.get("u0", 1) == "x"
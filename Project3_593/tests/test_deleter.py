@@ -0,0 +1,38 @@
+import sqlite3
+import pytest
+
+from shadowrt.deleter import ChunkedDeleter
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "app.db")
+    with sqlite3.connect(path) as c:
+        c.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, user_id TEXT)")
+        c.executemany("INSERT INTO t(user_id) VALUES(?)",
+                      [("alice" if i % 3 else "bob",) for i in range(1000)])
+    return path
+
+def test_deletes_a_users_rows_in_batches(db):
+    seen, opened = [], []
+    def connect():
+        conn = sqlite3.connect(db)
+        opened.append(conn)
+        return conn
+    d = ChunkedDeleter(connect, batch_size=100, pause_s=0,
+                       progress=lambda table, n, total: seen.append((n, total)))
+    assert d.delete("t", "alice") == 666
+    assert d.batches == 7 and [n for n, _ in seen] == [100] * 6 + [66]
+    assert seen[-1][1] == 666
+    with sqlite3.connect(db) as c:
+        assert c.execute("SELECT user_id, count(*) FROM t GROUP BY user_id").fetchall() == [("bob", 334)]
+    for conn in opened:     # every batch's connection was closed
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+def test_nothing_to_delete(db):
+    d = ChunkedDeleter(lambda: sqlite3.connect(db))
+    assert d.delete("t", "carol") == 0 and d.batches == 0
+
+def test_batch_size_must_be_positive(db):
+    with pytest.raises(ValueError):
+        ChunkedDeleter(lambda: sqlite3.connect(db), batch_size=0)
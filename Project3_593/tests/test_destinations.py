@@ -0,0 +1,63 @@
+import json
+import pytest
+
+from shadowrt.destinations import Registry
+from shadowrt.labels import Labeled, new_label
+from shadowrt.transport import LocalTransport, TransportError
+
+peer = LocalTransport()
+calls = []
+
+@peer.route("POST", "/one")
+def one(labeled):
+    calls.append(1)
+    if labeled.value == "bad":
+        raise TransportError(422, "bad item")
+    return {"ok": True, "value": labeled.value}
+
+@peer.route("POST", "/many")
+def many(batch):
+    calls.append(len(batch))
+    return [{"ok": False, "status": 422, "error": "bad item"} if l.value == "bad"
+            else {"ok": True, "value": l.value} for l in batch]
+
+def registry(**spec):
+    return Registry.from_config({"Peer": {"transport": "local", "local": f"{__name__}:peer",
+                                          "send": "POST /one", **spec}})
+
+def items(*values):
+    return [Labeled(value=v, label=new_label("alice", {})) for v in values]
+
+def test_load_reads_the_file_on_first_use(tmp_path):
+    path = tmp_path / "destinations.json"
+    reg = Registry.load(str(path))      # nothing there yet, and nothing read
+    path.write_text(json.dumps({"Peer": {"transport": "local", "send": "POST /one"}}))
+    assert "Peer" in reg and reg["Peer"].routes["send"] == "POST /one"
+
+@pytest.mark.parametrize("spec", [{}, {"send_batch": "POST /many"}])
+def test_send_many_reports_rejected_items_individually(spec):
+    results = registry(**spec)["Peer"].send_many(items("a", "bad", "c"))
+    assert [r["value"] for r in (results[0], results[2])] == ["a", "c"]
+    assert isinstance(results[1], TransportError) and results[1].status == 422
+
+def test_send_many_batches():
+    calls.clear()
+    registry(send_batch="POST /many", batch_size=2)["Peer"].send_many(items("a", "b", "c"))
+    assert calls == [2, 1]
+
+def test_an_unreachable_peer_is_a_502():
+    from shadowrt.transport import HTTPTransport
+    with pytest.raises(TransportError) as e:
+        HTTPTransport("http://127.0.0.1:9", timeout=2).request("GET", "/anything")
+    assert e.value.status == 502
+
+def test_delete_remote_reports_an_unreachable_peer(tmp_path):
+    from shadowrt.runtime import ShadowRuntime
+    reg = Registry.from_config({"Peer": {"transport": "http", "url": "http://127.0.0.1:9",
+                                         "delete": "DELETE /users/{user_id}", "timeout_s": 2}})
+    rt = ShadowRuntime("A", str(tmp_path / "prov.db"), destinations=reg)
+    rt.log.log("transfer_out", "alice", "t1", b"x", dst_app="Peer")
+    with pytest.raises(TransportError) as e:
+        rt.delete_remote("alice")
+    assert e.value.status == 502 and "Peer" in e.value.detail
+    assert reg["Peer"].stats["errors"] == 1
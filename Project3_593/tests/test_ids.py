@@ -0,0 +1,47 @@
+import threading
+import pytest
+
+from shadowrt import ids as ids_module
+from shadowrt.ids import (new_event_id, event_id_time, is_event_id,
+                          event_id_to_bytes, event_id_from_bytes)
+
+@pytest.fixture(autouse=True)
+def fresh_clock(monkeypatch):
+    # ids made here for far-off times must not push later ids into the future
+    monkeypatch.setattr(ids_module, "_last_ms", -1)
+    monkeypatch.setattr(ids_module, "_last_rand", 0)
+
+def test_ids_are_strictly_increasing_within_a_tick():
+    ids = [new_event_id(1_700_000_000.0) for _ in range(1000)]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert all(is_event_id(i) for i in ids)
+
+def test_ids_sort_by_time_and_carry_it():
+    early, late = new_event_id(1_000_000_000.123), new_event_id(2_000_000_000.456)
+    assert early < late
+    assert event_id_time(late) == 2_000_000_000.456
+
+def test_a_clock_going_backwards_stays_monotonic():
+    a = new_event_id(3_000_000_000.0)
+    b = new_event_id(2_999_999_999.0)
+    assert b > a
+
+def test_unique_across_threads():
+    out = []
+    def make():
+        out.extend(new_event_id() for _ in range(2000))
+    threads = [threading.Thread(target=make) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(out)) == 8000
+
+def test_bytes_round_trip_and_sort_like_text():
+    ids = sorted(new_event_id(t) for t in (1.0, 1e9, 4e9, 4e9))
+    blobs = [event_id_to_bytes(i) for i in ids]
+    assert all(len(b) == 16 for b in blobs) and blobs == sorted(blobs)
+    assert [event_id_from_bytes(b) for b in blobs] == ids
+
+def test_legacy_hex_ids_are_not_event_ids():
+    assert not is_event_id("a" * 64) and not is_event_id("8" + "0" * 25)
@@ -0,0 +1,167 @@
+import sqlite3, threading, time
+import pytest
+
+from shadowrt.jobqueue import JobQueue
+
+def drain(q):
+    while q.run_once():
+        pass
+
+def test_runs_and_records_results(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), lambda p: {"double": p["n"] * 2})
+    ids = [q.enqueue({"n": n}) for n in range(3)]
+    drain(q)
+    assert [q.status(i)["result"] for i in ids] == [{"double": 0}, {"double": 2}, {"double": 4}]
+
+def test_failures_retry_then_fail(tmp_path):
+    calls = []
+    def handler(p):
+        calls.append(p)
+        raise RuntimeError("down")
+    q = JobQueue(str(tmp_path / "jobs.db"), handler, max_attempts=3, backoff_s=0)
+    job = q.enqueue({"n": 1})
+    drain(q)
+    s = q.status(job)
+    assert s["state"] == "failed" and s["attempts"] == 3 and "down" in s["error"]
+    assert len(calls) == 3
+
+def test_running_jobs_are_requeued_after_a_crash(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    q = JobQueue(path, lambda p: p)
+    job = q.enqueue({"n": 1})
+    with sqlite3.connect(path) as c:
+        c.execute("UPDATE jobs SET state='running' WHERE id=?", (job,))
+    q2 = JobQueue(path, lambda p: p)
+    assert q2.status(job)["state"] == "queued"
+    drain(q2)
+    assert q2.status(job)["state"] == "done"
+
+def test_batches(tmp_path):
+    sizes = []
+    def handler(payloads):
+        sizes.append(len(payloads))
+        return [p["n"] for p in payloads]
+    q = JobQueue(str(tmp_path / "jobs.db"), handler, batch_size=3)
+    ids = [q.enqueue({"n": n}) for n in range(7)]
+    drain(q)
+    assert sizes == [3, 3, 1]
+    assert [q.status(i)["result"] for i in ids] == list(range(7))
+
+def test_cancel_user_drops_their_jobs(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), lambda p: p)
+    mine = [q.enqueue({"n": n}, user_id="alice") for n in range(2)]
+    other = q.enqueue({"n": 9}, user_id="bob")
+    assert q.cancel_user("alice") == 2
+    drain(q)
+    assert [q.status(i) for i in mine] == [None, None]
+    assert q.status(other)["state"] == "done"
+
+def test_cancel_user_waits_for_a_running_job(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    def handler(p):
+        started.set()
+        release.wait(5)
+        return "sent"
+    q = JobQueue(str(tmp_path / "jobs.db"), handler, poll_s=0.01)
+    job = q.enqueue({"n": 1}, user_id="alice")
+    worker = threading.Thread(target=q.run_once)
+    worker.start()
+    started.wait(5)
+    with pytest.raises(TimeoutError):
+        q.cancel_user("alice", timeout=0.05)
+    threading.Timer(0.05, release.set).start()
+    assert q.cancel_user("alice", timeout=5) == 1
+    worker.join()
+    assert q.status(job) is None
+
+def test_finished_jobs_drop_payload_and_are_purged(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    q = JobQueue(path, lambda p: "ok", max_attempts=1)
+    job = q.enqueue({"billing_address": "1 Main St"})
+    drain(q)
+    with sqlite3.connect(path) as c:
+        assert c.execute("SELECT payload FROM jobs WHERE id=?", (job,)).fetchone()[0] == "{}"
+    assert q.purge(3600) == 0
+    assert q.purge(0) == 1 and q.status(job) is None
+
+def test_a_batch_fails_only_the_jobs_the_handler_rejected(tmp_path):
+    def handler(payloads):
+        return [ValueError("bad") if p["n"] == 1 else p["n"] for p in payloads]
+    q = JobQueue(str(tmp_path / "jobs.db"), handler, batch_size=3, max_attempts=1)
+    ids = [q.enqueue({"n": n}) for n in range(3)]
+    drain(q)
+    assert [q.status(i)["state"] for i in ids] == ["done", "failed", "done"]
+
+def test_a_short_result_list_fails_the_whole_batch(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), lambda payloads: payloads[:1],
+                 batch_size=3, max_attempts=1)
+    ids = [q.enqueue({"n": n}) for n in range(3)]
+    drain(q)
+    assert [q.status(i)["state"] for i in ids] == ["failed"] * 3
+    assert "2 jobs" not in q.status(ids[0])["error"] and "3 jobs" in q.status(ids[0])["error"]
+
+def test_a_live_lease_is_not_requeued_but_an_expired_one_is(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    q = JobQueue(path, lambda p: p, lease_s=60)
+    live, dead = q.enqueue({"n": 1}), q.enqueue({"n": 2})
+    with sqlite3.connect(path) as c:
+        c.execute("UPDATE jobs SET state='running', lease_until=? WHERE id=?", (time.time() + 60, live))
+        c.execute("UPDATE jobs SET state='running', lease_until=? WHERE id=?", (time.time() - 1, dead))
+    q2 = JobQueue(path, lambda p: p)
+    assert q2.status(live)["state"] == "running" and q2.status(dead)["state"] == "queued"
+    drain(q2)
+    assert q2.status(live)["state"] == "running" and q2.status(dead)["state"] == "done"
+
+def test_a_job_whose_lease_runs_out_is_claimed_again(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    q = JobQueue(path, lambda p: p, lease_s=0.05)
+    job = q.enqueue({"n": 1})
+    assert len(q._claim()) == 1 and q._claim() == []    # another process holding it
+    time.sleep(0.1)
+    drain(JobQueue(path, lambda p: "again"))
+    assert q.status(job)["result"] == "again"
+
+def test_concurrent_claimers_never_share_a_job(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    seen = []
+    q = JobQueue(path, lambda p: seen.append(p["n"]))
+    for n in range(200):
+        q.enqueue({"n": n})
+    queues = [JobQueue(path, lambda p: seen.append(p["n"])) for _ in range(4)]
+    threads = [threading.Thread(target=drain, args=(x,)) for x in queues]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(seen) == list(range(200))
+
+def test_a_worker_survives_database_errors(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), lambda p: "ok", poll_s=0.01)
+    job = q.enqueue({"n": 1})
+    real, calls = q.run_once, []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return real()
+    q.run_once = flaky
+    q.start()
+    try:
+        deadline = time.time() + 5
+        while q.status(job)["state"] != "done" and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        q.stop()
+    assert q.status(job)["state"] == "done"
+
+def test_running_jobs_have_their_lease_renewed(tmp_path):
+    release = threading.Event()
+    q = JobQueue(str(tmp_path / "jobs.db"), lambda p: release.wait(5), lease_s=0.3)
+    job = q.enqueue({"n": 1})
+    q.start()
+    try:
+        time.sleep(0.6)                  # two lease lengths
+        assert q.status(job)["attempts"] == 1
+    finally:
+        release.set()
+        q.stop()
@@ -0,0 +1,60 @@
+import os, sqlite3, subprocess, sys, threading, time
+
+from shadowrt.migrate import apply_migrations, current_version, statements
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_statements_keep_literals_and_triggers_whole():
+    sql = """
+CREATE TABLE t (a TEXT);
+INSERT INTO t VALUES ('x; y');
+CREATE TRIGGER IF NOT EXISTS t_ins AFTER INSERT ON t BEGIN
+  UPDATE t SET a = a || ';' WHERE rowid = new.rowid;
+END;
+"""
+    assert len(list(statements(sql))) == 3
+    conn = sqlite3.connect(":memory:")
+    apply_migrations(conn, [(1, sql), (2, ["INSERT INTO t VALUES ('z')"])])
+    assert [r[0] for r in conn.execute("SELECT a FROM t ORDER BY rowid")] == ["x; y", "z;"]
+    assert current_version(conn) == 2
+
+def test_concurrent_threads_apply_each_step_once(tmp_path):
+    path = str(tmp_path / "m.db")
+    sqlite3.connect(path).execute("CREATE TABLE t (a)").connection.commit()
+    migrations = [(1, "ALTER TABLE t ADD COLUMN b"), (2, "ALTER TABLE t ADD COLUMN c")]
+    barrier, errors = threading.Barrier(4), []
+    def run():
+        conn = sqlite3.connect(path, timeout=30)
+        barrier.wait()
+        try:
+            apply_migrations(conn, migrations)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert current_version(sqlite3.connect(path)) == 2
+
+SCRIPT = """
+import sqlite3, sys, time
+from paypal.db import SCHEMA, MIGRATIONS
+from shadowrt.migrate import ensure_schema
+time.sleep(max(0, float(sys.argv[2]) - time.time()))
+with sqlite3.connect(sys.argv[1], timeout=30) as conn:
+    ensure_schema(conn, SCHEMA, MIGRATIONS)
+"""
+
+def test_processes_starting_together_migrate_paypal_once(tmp_path):
+    path = str(tmp_path / "paypal.db")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = str(time.time() + 1.0)
+    procs = [subprocess.Popen([sys.executable, "-c", SCRIPT, path, start], env=env,
+                              stderr=subprocess.PIPE, text=True) for _ in range(4)]
+    errs = [p.communicate(timeout=60)[1] for p in procs]
+    assert [p.returncode for p in procs] == [0] * 4, errs
+    conn = sqlite3.connect(path)
+    assert current_version(conn) == 2
+    assert "charge_tag" in [r[1] for r in conn.execute("PRAGMA table_info(payments)")]
@@ -0,0 +1,21 @@
+import threading
+
+from shadowrt.profiler import Profiler
+
+def test_counters_are_exact_under_concurrency():
+    p = Profiler(sample_rate=0.5)
+    def work():
+        for _ in range(2000):
+            with p.request("r"):
+                with p.section("log"):
+                    pass
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    s = p.stats()
+    assert s["seen"] == 16000 and 0 < s["sampled"] < 16000
+    assert s["stacks"] == 2      # r, r;log
+    p.reset()
+    assert (p.stats()["seen"], p.stats()["sampled"], p.stats()["stacks"]) == (0, 0, 0)
@@ -0,0 +1,50 @@
+import threading
+
+from shadowrt.provlog import ProvLogger
+
+def transfer(log, user, dst="PayPal"):
+    log.log("transfer_out", user, f"t-{user}", b"x", dst_app=dst)
+
+def test_concurrent_transfers_are_all_in_the_filter(tmp_path):
+    log = ProvLogger(str(tmp_path / "prov.db"), "A", bloom_exclusive=True, bloom_save_every=50)
+    users = [f"u{i}" for i in range(400)]
+    threads = [threading.Thread(target=lambda chunk=users[i::8]: [transfer(log, u) for u in chunk])
+               for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(u in log.transfers["PayPal"] for u in users)
+
+def test_a_shared_store_is_queried_on_a_filter_miss(tmp_path):
+    path = str(tmp_path / "prov.db")
+    ours = ProvLogger(path, "A", bloom_path=str(tmp_path / "a.bloom"))
+    other = ProvLogger(path, "A", bloom_path=str(tmp_path / "b.bloom"))    # another worker
+    transfer(other, "alice")
+    assert "alice" not in ours.transfers.get("PayPal", ())
+    assert ours.destinations_for_user("alice") == ["PayPal"]
+
+def test_an_exclusive_store_trusts_the_filter(tmp_path):
+    log = ProvLogger(str(tmp_path / "prov.db"), "A", bloom_exclusive=True)
+    transfer(log, "alice")
+    assert log.destinations_for_user("alice") == ["PayPal"]
+    assert log.destinations_for_user("bob") == [] and log.bloom_stats["skipped"] == 1
+
+def test_filters_survive_a_restart(tmp_path):
+    path = str(tmp_path / "prov.db")
+    log = ProvLogger(path, "A", bloom_exclusive=True, bloom_save_every=1)
+    transfer(log, "alice")
+    transfer(log, "bob")
+    again = ProvLogger(path, "A", bloom_exclusive=True)
+    assert "alice" in again.transfers["PayPal"] and "bob" in again.transfers["PayPal"]
+
+def test_filters_are_rebuilt_from_the_log_without_a_saved_file(tmp_path):
+    path = str(tmp_path / "prov.db")
+    log = ProvLogger(path, "A", bloom_save_every=10**9)
+    users = [f"u{i}" for i in range(6000)]      # more than one page of transfer_outs
+    log.backend.append_many([(f"e{i:05d}", 100.0 + i, "transfer_out", "A", "PayPal", u, f"t{i}", "h", "{}")
+                             for i, u in enumerate(users)])
+    log.log("source", "zed", "t-zed", b"x")
+    rebuilt = ProvLogger(path, "A", bloom_path=str(tmp_path / "missing.bloom"))
+    assert all(u in rebuilt.transfers["PayPal"] for u in users)
+    assert "zed" not in rebuilt.transfers["PayPal"]
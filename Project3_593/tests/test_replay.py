@@ -0,0 +1,38 @@
+import os, sqlite3
+import pytest
+
+from shadowrt.conformance import sample_records
+from shadowrt.replay import open_prov, provenance_profile
+from shadowrt.storage import SQLiteBackend
+
+def test_open_prov_reads_without_writing(tmp_path):
+    path = str(tmp_path / "prov.db")
+    store = SQLiteBackend(path)
+    for r in sample_records():
+        store.append(r)
+    before = sorted(os.listdir(tmp_path))
+    ro = open_prov(path)
+    assert sum(provenance_profile(ro, None, None).values()) == len(sample_records())
+    with pytest.raises(sqlite3.OperationalError):
+        ro.append(sample_records()[0])
+    assert sorted(os.listdir(tmp_path)) == before
+
+def test_open_prov_refuses_a_missing_store(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_prov(str(tmp_path / "typo_prov.db"))
+    assert os.listdir(tmp_path) == []
+
+def test_open_prov_refuses_a_file_that_is_not_a_store(tmp_path):
+    path = tmp_path / "other.db"
+    sqlite3.connect(path).close()
+    with pytest.raises(ValueError):
+        open_prov(str(path))
+
+def test_open_prov_opens_shards(tmp_path):
+    from shadowrt.shards import shard_path
+    from shadowrt.storage import ShardedBackend
+    path = str(tmp_path / "prov.db")
+    store = ShardedBackend([SQLiteBackend(shard_path(path, i, 2)) for i in range(2)])
+    for r in sample_records():
+        store.append(r)
+    assert len(list(open_prov(path).scan())) == len(sample_records())
@@ -0,0 +1,38 @@
+import pytest
+
+from shadowrt.replica import SnapshotReader
+from shadowrt.storage import SQLiteBackend
+from shadowrt.provlog import ProvLogger
+
+def rec(i, user="alice"):
+    return (f"e{i:04d}", 100.0 + i, "source", "A", None, user, f"t{i}", "h", "{}")
+
+def test_snapshot_lags_the_primary_until_refreshed(tmp_path):
+    primary = SQLiteBackend(str(tmp_path / "prov.db"))
+    primary.append(rec(1))
+    snap = SnapshotReader(primary.db_path, refresh_s=3600)
+    primary.append(rec(2))
+    assert [r[0] for r in snap.backend.by_user("alice")] == ["e0001"]
+    first = snap.current_path
+    snap.refresh()
+    assert snap.current_path != first and snap.lag_s < 5
+    assert [r[0] for r in snap.backend.by_user("alice")] == ["e0001", "e0002"]
+    assert snap.backend.query(op="source", limit=1)[0][2] == "source"
+
+def test_replica_refuses_writes(tmp_path):
+    primary = SQLiteBackend(str(tmp_path / "prov.db"))
+    snap = SnapshotReader(primary.db_path, refresh_s=3600)
+    with pytest.raises(RuntimeError):
+        snap.backend.append(rec(1))
+
+def test_logger_reads_go_to_the_refreshing_snapshot(tmp_path):
+    log = ProvLogger(str(tmp_path / "prov.db"), "A", snapshot_s=3600)
+    try:
+        log.log("source", "bob", "t1", b"x")
+        log.flush()
+        assert log.reader is not log.backend and log.reader.by_user("bob") == []
+        log.snapshots[0].refresh()
+        assert [r[5] for r in log.reader.by_user("bob")] == ["bob"]
+    finally:
+        for s in log.snapshots:
+            s.stop()
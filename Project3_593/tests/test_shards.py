@@ -0,0 +1,56 @@
+import sqlite3
+import pytest
+
+from shadowrt.shards import HashRing, next_id, MAX_SHARDS
+
+def test_ring_spreads_users_and_is_stable():
+    ring = HashRing(4)
+    shards = [ring.shard_for(f"user-{i}") for i in range(1000)]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shards == [HashRing(4).shard_for(f"user-{i}") for i in range(1000)]
+
+def insert(conn, shard, n):
+    conn.execute("BEGIN IMMEDIATE")
+    i = next_id(conn, "t", shard, n)
+    conn.execute("INSERT INTO t(id) VALUES(?)", (i,))
+    conn.commit()
+    return i
+
+def test_next_id_is_unique_across_shards_and_never_reused(tmp_path):
+    conns = []
+    for s in range(3):
+        c = sqlite3.connect(tmp_path / f"s{s}.db")
+        c.execute("CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+        conns.append(c)
+    ids = [insert(c, s, 3) for _ in range(5) for s, c in enumerate(conns)]
+    assert len(set(ids)) == len(ids)
+    assert all(i % MAX_SHARDS == s for i, s in zip(ids, [0, 1, 2] * 5))
+    last = ids[-1]
+    conns[2].execute("DELETE FROM t WHERE id=?", (last,))
+    conns[2].commit()
+    assert insert(conns[2], 2, 3) > last
+
+def test_next_id_with_one_shard_is_the_plain_rowid(tmp_path):
+    c = sqlite3.connect(tmp_path / "one.db")
+    c.execute("CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+    assert [insert(c, 0, 1) for _ in range(3)] == [1, 2, 3]
+
+def test_the_shard_count_is_pinned(tmp_path):
+    from shadowrt.shards import pin_shards
+    path = str(tmp_path / "app.db")
+    pin_shards(path, 2, ("t",))
+    pin_shards(path, 2, ("t",))
+    with pytest.raises(ValueError, match="DB_SHARDS=2"):
+        pin_shards(path, 3, ("t",))
+
+def test_an_unpinned_database_is_read_from_its_files(tmp_path):
+    from shadowrt.shards import pin_shards
+    unsharded = str(tmp_path / "one.db")
+    sqlite3.connect(unsharded).execute("CREATE TABLE t (a)")
+    with pytest.raises(ValueError, match="holds 1 shard"):
+        pin_shards(unsharded, 4, ("t",))
+    sharded = str(tmp_path / "many.db")
+    for s in range(3):
+        sqlite3.connect(tmp_path / f"many.s{s}.db").execute("CREATE TABLE t (a)")
+    with pytest.raises(ValueError, match="holds 3 shard"):
+        pin_shards(sharded, 1, ("t",))
@@ -0,0 +1,56 @@
+import threading
+
+from shadowrt.singleflight import SingleFlight
+from shadowrt.runtime import ShadowRuntime
+
+def burst(n, fn):
+    out, threads = [None] * n, []
+    def run(i):
+        try:
+            out[i] = fn()
+        except Exception as e:
+            out[i] = e
+    for i in range(n):
+        threads.append(threading.Thread(target=run, args=(i,)))
+        threads[-1].start()
+    for t in threads:
+        t.join()
+    return out
+
+def test_concurrent_callers_share_one_execution():
+    sf, calls, release = SingleFlight(), [], threading.Event()
+    def slow(user_id):
+        calls.append(user_id)
+        release.wait(5)
+        return {"deleted": user_id}
+    threading.Timer(0.1, release.set).start()
+    results = burst(8, lambda: sf.do(("delete", "alice"), slow, "alice"))
+    assert calls == ["alice"] and results == [{"deleted": "alice"}] * 8
+    assert sf.stats == {"executed": 1, "shared": 7} and sf.in_flight() == 0
+
+def test_an_error_is_shared_and_the_key_is_freed():
+    sf, release = SingleFlight(), threading.Event()
+    def fail():
+        release.wait(5)
+        raise RuntimeError("paypal down")
+    threading.Timer(0.1, release.set).start()
+    results = burst(4, lambda: sf.do("k", fail))
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert sf.do("k", lambda: "fresh") == "fresh"
+
+def test_different_keys_run_independently():
+    sf = SingleFlight()
+    assert [sf.do(k, lambda k=k: k * 2) for k in (1, 2)] == [2, 4]
+    assert sf.stats["executed"] == 2
+
+def test_coalesced_keys_on_the_arguments(tmp_path):
+    rt = ShadowRuntime("A", str(tmp_path / "prov.db"))
+    calls, release = [], threading.Event()
+    @rt.coalesced("delete_user")
+    def delete_user(user_id):
+        calls.append(user_id)
+        release.wait(5)
+        return user_id
+    threading.Timer(0.1, release.set).start()
+    results = burst(6, lambda: delete_user("alice")) + burst(1, lambda: delete_user("bob"))
+    assert sorted(calls) == ["alice", "bob"] and results == ["alice"] * 6 + ["bob"]
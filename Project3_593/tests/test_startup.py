@@ -0,0 +1,26 @@
+import json, os, sqlite3, subprocess, sys
+
+from shadowrt import startup
+from shadowrt.migrate import ensure_schema
+from paypal.db import SCHEMA, MIGRATIONS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_importing_the_apps_touches_no_database(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, "-c", "import pencilpros.app, paypal.app"],
+                   cwd=tmp_path, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+def test_a_current_schema_skips_the_ddl(tmp_path):
+    conn = sqlite3.connect(tmp_path / "paypal.db")
+    assert ensure_schema(conn, SCHEMA, MIGRATIONS) is True
+    assert ensure_schema(conn, SCHEMA, MIGRATIONS) is False
+
+def test_benchmark_reports_cold_and_warm_startup(monkeypatch, capsys):
+    monkeypatch.chdir(ROOT)         # the children import the apps from here
+    assert startup.main(["paypal.app", "--runs", "1", "--max-ready-ms", "60000"]) == 0
+    report = json.loads(capsys.readouterr().out)["paypal.app"]
+    for phase in ("cold", "warm"):
+        times = report[phase]
+        assert 0 < times["import_ms"]["median"] <= times["ready_ms"]["median"]
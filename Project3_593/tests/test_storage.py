@@ -0,0 +1,87 @@
+import os, sqlite3
+import pytest
+
+from shadowrt.conformance import check_backend, sample_records
+from shadowrt.storage import (SQLiteBackend, MemoryBackend, LogFileBackend, ShardedBackend,
+                              SCHEMA, MIGRATIONS)
+from shadowrt.archive import ArchiveBackend, TieredBackend, Archiver
+from shadowrt.migrate import ensure_schema
+
+BACKENDS = {
+    "sqlite": lambda d: SQLiteBackend(os.path.join(d, "prov.db")),
+    "logfile": lambda d: LogFileBackend(os.path.join(d, "prov.log")),
+    "sharded": lambda d: ShardedBackend(
+        [SQLiteBackend(os.path.join(d, f"prov.s{i}.db")) for i in range(3)]),
+}
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_conformance(name, tmp_path):
+    check_backend(lambda: BACKENDS[name](str(tmp_path)))
+
+def test_conformance_memory():
+    mem = MemoryBackend()
+    check_backend(lambda: mem)
+
+def test_sharded_keeps_a_user_on_one_shard(tmp_path):
+    b = BACKENDS["sharded"](str(tmp_path))
+    for r in sample_records():
+        b.append(r)
+    for user in ("alice", "bob", "carol"):
+        holding = [s for s in b.shards if s.by_user(user)]
+        assert holding == [b.shard(user)]
+
+def test_append_many_ignores_rows_already_written(tmp_path):
+    b = SQLiteBackend(str(tmp_path / "prov.db"))
+    recs = sample_records()
+    b.append_many(recs[:3])
+    b.append_many(recs)
+    assert [r[0] for r in b.scan()] == [r[0] for r in recs]
+
+def test_ensure_schema_skips_ddl_once_current(tmp_path):
+    c = sqlite3.connect(tmp_path / "x.db")
+    assert ensure_schema(c, SCHEMA, MIGRATIONS)
+    assert not ensure_schema(c, SCHEMA, MIGRATIONS)
+    assert ensure_schema(c, SCHEMA, MIGRATIONS + [(99, "CREATE TABLE later (a)")])
+    assert not ensure_schema(c, SCHEMA, MIGRATIONS + [(99, "CREATE TABLE later (a)")])
+
+def test_archive_tier_answers_like_the_hot_store(tmp_path):
+    hot = SQLiteBackend(str(tmp_path / "prov.db"))
+    recs = sample_records()
+    for r in recs:
+        hot.append(r)
+    cold = ArchiveBackend(str(tmp_path / "prov.db.archive"))
+    Archiver(hot, cold, after_s=0).run_once()
+    tiered = TieredBackend(hot, cold)
+    assert [r[0] for r in tiered.scan()] == [r[0] for r in recs]
+    assert tiered.by_user("carol") == [recs[6]]
+    assert sorted(tiered.destinations_for_user("alice")) == ["PayPal", "Shipping"]
+
+def test_a_v1_log_is_converted_in_place(tmp_path):
+    import uuid
+    from shadowrt.ids import new_event_id
+    from shadowrt.migrate import apply_migrations, current_version
+    path = str(tmp_path / "v1.db")
+    tag = str(uuid.uuid4())
+    v1 = [
+        ("ab" * 32, 1.0, "source", "PencilPros", None, "alice", tag, "cd" * 32, "{}"),
+        (new_event_id(2.0), 2.0, "transfer_out", "PencilPros", "PayPal", "alice", tag + ".1",
+         "ef" * 32, '{"route": "/charge"}'),
+        ("legacy-id", 3.0, "insert", "PencilPros", None, "bob", "purchase:7", "not-hex", "{}"),
+    ]
+    with sqlite3.connect(path) as c:          # a log as the v1 code left it
+        c.executescript(SCHEMA)
+        apply_migrations(c, [m for m in MIGRATIONS if m[0] == 1])
+        c.executemany("INSERT INTO provenance VALUES(?,?,?,?,?,?,?,?,?)", v1)
+    b = SQLiteBackend(path)
+    assert list(b.scan()) == v1
+    assert [r[0] for r in b.query(op="transfer_out")] == [v1[1][0]]
+    with sqlite3.connect(path) as c:
+        assert current_version(c) == max(v for v, _ in MIGRATIONS)
+        assert c.execute("SELECT type FROM sqlite_master WHERE name='provenance'").fetchone() == ("view",)
+        raw = c.execute("SELECT typeof(event_id), typeof(tag_id), typeof(payload_hash), meta "
+                        "FROM provenance_v2 ORDER BY t_unix").fetchall()
+        assert raw[0] == ("blob", "blob", "blob", None) and raw[2][:3] == ("text", "text", "text")
+        # old-shape queries (inspect_db.py) still read text
+        view = c.execute("SELECT * FROM provenance ORDER BY t_unix").fetchall()
+    assert [r[0] for r in view[::2]] == [v1[0][0], "legacy-id"]
+    assert [r[1:] for r in view] == [r[1:] for r in v1]